@@ -1,38 +1,272 @@
-import io
+import asyncio
+import os
+import time
+from typing import List, Optional
 from fastapi import FastAPI, File, UploadFile
-from PIL import Image
-import torchvision.transforms as transforms
+from fastapi.responses import JSONResponse
 import torch
 from model import load_model
+from backends import OnnxBackend, TorchBackend, TorchSearchBackend
+from batcher import CaptionBatcher
+from decode_pool import DecodePool
+from decoding import DEFAULT_PROFILE, PROFILES, ProfileStats, UnknownProfileError, compare_profiles, resolve_profile
+from encoder_cache import EncoderCache
+from executor import InferenceExecutor, QueueFullError
+from preprocessing import decode_image, load_image_tensor, preprocess_batch
+from evaluation import bundled_images, load_images
+from worker_memory import process_memory, share_model_weights
 
 app = FastAPI()
 
 # Set device and use a writable checkpoint path (e.g., /tmp)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-checkpoint_path = "/tmp/checkpoint.pth"  # Updated path
+# A checkpoint file, or a merged model directory from merge_checkpoint.py for an offline start
+checkpoint_path = os.getenv("CAPTION_CHECKPOINT", "/tmp/checkpoint.pth")
+
+# Micro-batching settings: how many requests to merge into one generate call,
+# and how long the first request in a batch may wait for others to arrive
+MAX_BATCH_SIZE = int(os.getenv("CAPTION_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.getenv("CAPTION_MAX_WAIT_MS", "10"))
+
+# Inference worker pool: threads running decode/generate, torch intra-op threads,
+# how many requests may be in flight before we answer 503, and shutdown drain time
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_TORCH_THREADS = int(os.getenv("INFERENCE_TORCH_THREADS", "0")) or None
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "64"))
+DRAIN_TIMEOUT = float(os.getenv("INFERENCE_DRAIN_TIMEOUT", "30"))
+
+# Decode worker processes, sized separately from the inference threads. With 0,
+# images are decoded on the inference pool; otherwise in DECODE_WORKERS processes
+# sharing DECODE_SLOTS tensor slots (default 2 per worker) in shared memory.
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "0"))
+DECODE_SLOTS = int(os.getenv("DECODE_SLOTS", "0")) or None
+
+# Encoder-output cache: in-memory budget (0 disables) and optional disk spill tier
+ENCODER_CACHE_MB = int(os.getenv("ENCODER_CACHE_MB", "256"))
+ENCODER_CACHE_SPILL_DIR = os.getenv("ENCODER_CACHE_SPILL_DIR")
+ENCODER_CACHE_SPILL_MB = int(os.getenv("ENCODER_CACHE_SPILL_MB", "1024"))
+
+# Opt-in dynamic INT8 quantization (CPU only). At startup the quantized model is
+# checked against fp32 on the bundled images; below QUANTIZE_MIN_SIMILARITY we keep fp32.
+QUANTIZE = os.getenv("CAPTION_QUANTIZE", "False").lower() in ("true", "1", "t")
+QUANTIZE_MIN_SIMILARITY = float(os.getenv("QUANTIZE_MIN_SIMILARITY", "0.6"))
+
+# Copy the weights into shared memory before workers fork (gunicorn.conf.py preload).
+# Needs /dev/shm larger than the model; a merged checkpoint is already memory-mapped
+# from disk and shared through the page cache, and preload alone shares it copy-on-write.
+SHARE_WEIGHTS = os.getenv("CAPTION_SHARE_WEIGHTS", "False").lower() in ("true", "1", "t")
+
+# Upper bound on images accepted by /generate_captions/ in one request
+MAX_FILES_PER_REQUEST = int(os.getenv("CAPTION_MAX_FILES", "256"))
+
+# Inference backend: "torch" (eager ViTT5), "torch_search" (eager ViTT5 with the
+# KV-cached search loop of search.py) or "onnx" (graphs written by export_model.py
+# into CAPTION_ONNX_DIR, run with onnxruntime on CPU)
+CAPTION_BACKEND = os.getenv("CAPTION_BACKEND", "torch").lower()
+CAPTION_ONNX_DIR = os.getenv("CAPTION_ONNX_DIR", "onnx")
+
+# Time every decoding profile on the bundled images at startup and compare its
+# captions with the default profile's (reported by /decoding_profiles)
+PROFILE_CHECK = os.getenv("CAPTION_PROFILE_CHECK", "False").lower() in ("true", "1", "t")
 
 # Load the model and tokenizer
-model, tokenizer = load_model(checkpoint_path, device)
+model = None
+quantization_report = None
+if CAPTION_BACKEND == "onnx":
+    from transformers import T5Tokenizer
+    device = torch.device("cpu")
+    backend = OnnxBackend(CAPTION_ONNX_DIR, num_threads=INFERENCE_TORCH_THREADS)
+    tokenizer = T5Tokenizer.from_pretrained(CAPTION_ONNX_DIR)
+else:
+    model, tokenizer = load_model(checkpoint_path, device)
+if model is not None and QUANTIZE and device.type == "cpu":
+    from quantization import quantize_model, check_quantized_model
+    quantized_model = quantize_model(model)
+    quantization_report = check_quantized_model(model, quantized_model, tokenizer, load_images(bundled_images()))
+    print(f"INT8 startup check: exact match {quantization_report['exact_match']:.2f}, "
+          f"similarity {quantization_report['similarity']:.2f}")
+    if quantization_report["similarity"] >= QUANTIZE_MIN_SIMILARITY:
+        model = quantized_model
+        quantization_report["enabled"] = True
+    else:
+        print("Quantized captions diverge too much from fp32, keeping the fp32 model")
+        quantization_report["enabled"] = False
+    del quantized_model
+elif model is not None and QUANTIZE:
+    print("Dynamic INT8 quantization is CPU-only, keeping the fp32 model on", device)
+if model is not None and ENCODER_CACHE_MB > 0:
+    model.encoder_cache = EncoderCache(
+        max_bytes=ENCODER_CACHE_MB * 1024 * 1024,
+        spill_dir=ENCODER_CACHE_SPILL_DIR,
+        spill_max_bytes=ENCODER_CACHE_SPILL_MB * 1024 * 1024,
+    )
+if model is not None and SHARE_WEIGHTS and device.type == "cpu":
+    shared_bytes = share_model_weights(model)
+    print(f"Moved {shared_bytes / 1024 / 1024:.0f} MB of weights into shared memory")
+if model is not None:
+    backend = TorchSearchBackend(model) if CAPTION_BACKEND == "torch_search" else TorchBackend(model)
+print("Using inference backend:", backend.name)
+
+profile_report = None
+if PROFILE_CHECK:
+    profile_report = compare_profiles(backend.generate, tokenizer, load_images(bundled_images()).to(device))
+    for name, entry in profile_report.items():
+        print(f"Decoding profile {name}: {entry['ms_per_image']:.0f} ms/image, "
+              f"similarity to {DEFAULT_PROFILE} {entry['similarity']:.2f}")
+profile_stats = ProfileStats()
+
+def caption_batch(pixel_values, profile=DEFAULT_PROFILE):
+    """Run one generate call over a stacked batch and decode a caption per image."""
+    start = time.perf_counter()
+    output_ids = backend.generate(pixel_values.to(device), **PROFILES[profile])
+    captions = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    profile_stats.record_batch(profile, time.perf_counter() - start, len(captions))
+    return captions
+
+executor = InferenceExecutor(
+    max_workers=INFERENCE_WORKERS,
+    num_threads=INFERENCE_TORCH_THREADS,
+    max_pending=INFERENCE_MAX_PENDING,
+)
+batcher = CaptionBatcher(
+    caption_batch,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_WAIT_MS,
+    executor=executor.pool,
+    max_in_flight=executor.max_workers,
+)
+# Created at startup, in each server worker process: the slab must not be shared across them
+decode_pool = None
+
+@app.on_event("startup")
+async def start_batcher():
+    global decode_pool
+    if DECODE_WORKERS > 0:
+        decode_pool = DecodePool(workers=DECODE_WORKERS, slots=DECODE_SLOTS)
+        await decode_pool.start()
+    await batcher.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    # Let admitted requests finish before tearing down the batcher and the pool
+    await executor.drain(DRAIN_TIMEOUT)
+    await batcher.stop()
+    executor.shutdown()
+    if decode_pool is not None:
+        decode_pool.shutdown()
 
-# Define image preprocessing (same as in your test file)
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-])
+async def decode_for_batch(contents):
+    """
+    Decode raw image bytes: to a normalized float tensor in a decode worker
+    process, or without a decode pool to uint8 on the inference pool (see to_pixel_values).
+    """
+    if decode_pool is not None:
+        return await decode_pool.decode(contents)
+    return await executor.run(decode_image, contents)
+
+def to_pixel_values(images):
+    """Stack images from decode_for_batch into one normalized batch."""
+    if images[0].dtype == torch.uint8:
+        # Resize and normalize the batch in one go
+        return preprocess_batch(images)
+    return torch.stack(images)
+
+def busy_response(e):
+    return JSONResponse(status_code=503, content={"error": str(e)}, headers={"Retry-After": "1"})
+
+def bad_request(e):
+    return JSONResponse(status_code=400, content={"error": str(e)})
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Image Captioning API!"}
 
+@app.get("/stats")
+def read_stats():
+    stats = {"backend": backend.name, "batcher": batcher.stats(), "executor": executor.stats()}
+    if decode_pool is not None:
+        stats["decode_pool"] = decode_pool.stats()
+    stats["decoding_profiles"] = profile_stats.stats()
+    if model is not None and model.encoder_cache is not None:
+        stats["encoder_cache"] = model.encoder_cache.stats()
+    if quantization_report is not None:
+        stats["quantization"] = quantization_report
+    # Per-worker memory, to confirm the weights are shared between workers
+    stats["memory"] = process_memory()
+    return stats
+
+@app.get("/decoding_profiles")
+def read_decoding_profiles():
+    """Profile settings, their live latencies and, with CAPTION_PROFILE_CHECK, the startup comparison."""
+    return {"default": DEFAULT_PROFILE, "profiles": profile_stats.stats(), "comparison": profile_report}
+
 @app.post("/generate_caption/")
-async def generate_caption(file: UploadFile = File(...)):
+async def generate_caption(file: UploadFile = File(...), profile: Optional[str] = None):
+    try:
+        profile = resolve_profile(profile)
+    except UnknownProfileError as e:
+        return bad_request(e)
+    started = time.perf_counter()
+    try:
+        async with executor.admit():
+            contents = await file.read()
+            if decode_pool is not None:
+                image_tensor = await decode_pool.decode(contents)
+            else:
+                image_tensor = await executor.run(load_image_tensor, contents)
+            caption = await batcher.submit(image_tensor, profile)
+            profile_stats.record_request(profile, time.perf_counter() - started)
+            return {"caption": caption, "profile": profile}
+    except QueueFullError as e:
+        return busy_response(e)
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.post("/generate_captions/")
+async def generate_captions(files: List[UploadFile] = File(...), profile: Optional[str] = None):
+    if len(files) > MAX_FILES_PER_REQUEST:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Too many files: {len(files)} (max {MAX_FILES_PER_REQUEST})."},
+        )
+    try:
+        profile = resolve_profile(profile)
+    except UnknownProfileError as e:
+        return bad_request(e)
+    started = time.perf_counter()
     try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        image_tensor = transform(image).unsqueeze(0).to(device)
-        output_ids = model.generate(pixel_values=image_tensor, max_length=30, num_beams=4)
-        caption = tokenizer.decode(output_ids[0], skip_special_tokens=True)
-        return {"caption": caption}
+        async with executor.admit():
+            results = [{"filename": f.filename} for f in files]
+
+            # Decode every image (at reduced size) in parallel on the decode or inference pool
+            contents = [await f.read() for f in files]
+            decoded = await asyncio.gather(
+                *[decode_for_batch(data) for data in contents],
+                return_exceptions=True,
+            )
+            ready = []
+            for i, item in enumerate(decoded):
+                if isinstance(item, Exception):
+                    results[i]["error"] = f"Failed to decode image: {item}"
+                else:
+                    ready.append(i)
+
+            # Caption the decoded images in batches, keeping input order
+            for start in range(0, len(ready), MAX_BATCH_SIZE):
+                indices = ready[start:start + MAX_BATCH_SIZE]
+                try:
+                    pixel_values = to_pixel_values([decoded[i] for i in indices])
+                    captions = await executor.run(caption_batch, pixel_values, profile)
+                except Exception as e:
+                    for i in indices:
+                        results[i]["error"] = str(e)
+                    continue
+                for i, caption in zip(indices, captions):
+                    results[i]["caption"] = caption
+
+            profile_stats.record_request(profile, time.perf_counter() - started)
+            return {"results": results, "profile": profile}
+    except QueueFullError as e:
+        return busy_response(e)
     except Exception as e:
         return {"error": str(e)}
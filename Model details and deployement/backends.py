@@ -0,0 +1,171 @@
+"""
+Inference backends behind a common `generate(pixel_values, **kwargs)` interface,
+selected in app.py with the CAPTION_BACKEND environment variable.
+
+  torch         eager ViTT5.generate (default)
+  torch_search  eager ViTT5 decoder run one step at a time by search.py, with
+                a key-value cache, encoder states shared by the beams of an
+                image, and finished images dropped from the batch
+  onnx          graphs written by export_model.py, run with onnxruntime on CPU
+"""
+import json
+import os
+
+import torch
+
+from decoder_step import cross_attention_states, decoder_step
+from search import beam_search, greedy_search
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model):
+        self.model = model
+
+    def generate(self, pixel_values, **kwargs):
+        with torch.no_grad():
+            return self.model.generate(pixel_values=pixel_values, **kwargs)
+
+
+class SearchBackend:
+    """
+    Runs greedy/beam search from search.py over a decoder step function.
+    Subclasses provide `config` (generation settings and special token ids),
+    `encode(pixel_values)` and `_make_step(encoder_hidden_states)`.
+    """
+
+    def generate(self, pixel_values, max_length=None, num_beams=None, no_repeat_ngram_size=2,
+                 repetition_penalty=1.2, length_penalty=1.0, early_stopping=False, **kwargs):
+        # Same decoding defaults as ViTT5.generate
+        max_length = max_length or self.config.get("max_length", 20)
+        num_beams = num_beams or self.config.get("num_beams", 1)
+        encoder_hidden_states = self.encode(pixel_values)
+
+        search_kwargs = dict(
+            batch_size=pixel_values.shape[0],
+            max_length=max_length,
+            decoder_start_token_id=self.config["decoder_start_token_id"],
+            eos_token_id=self.config["eos_token_id"],
+            pad_token_id=self.config["pad_token_id"],
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            repetition_penalty=repetition_penalty,
+            device=self.device,
+        )
+        step = self._make_step(encoder_hidden_states)
+        if num_beams == 1:
+            return greedy_search(step, **search_kwargs)
+        return beam_search(
+            step, num_beams=num_beams, length_penalty=length_penalty, early_stopping=early_stopping, **search_kwargs
+        )
+
+
+class TorchSearchBackend(SearchBackend):
+    name = "torch_search"
+
+    def __init__(self, model):
+        self.model = model
+        self.device = next(model.parameters()).device
+        generation_config = model.t5_decoder.generation_config
+        self.config = {
+            name: getattr(generation_config, name)
+            for name in ("max_length", "num_beams", "decoder_start_token_id", "eos_token_id", "pad_token_id")
+        }
+
+    def encode(self, pixel_values):
+        # Projected ViT states, one row per image (through the encoder cache when set)
+        return self.model.encode(pixel_values)
+
+    def _make_step(self, encoder_hidden_states):
+        t5 = self.model.t5_decoder
+        # Cross-attention key-values stay one row per image; decoder_step broadcasts
+        # them over the image's beams instead of repeat_interleave copies
+        state = {"cross": cross_attention_states(t5, encoder_hidden_states)}
+
+        def step(input_ids, reorder, items):
+            if items is not None:
+                state["cross"] = [(key[items], value[items]) for key, value in state["cross"]]
+            if "self" not in state:
+                logits, state["self"] = decoder_step(t5, input_ids, None, state["cross"])
+            else:
+                past = [(key[reorder], value[reorder]) for key, value in state["self"]]
+                # Only the newest token goes through the decoder; the rest is in the cache
+                logits, state["self"] = decoder_step(t5, input_ids[:, -1:], past, state["cross"])
+            return logits[:, -1]
+
+        return step
+
+    def generate(self, pixel_values, **kwargs):
+        with torch.no_grad():
+            return super().generate(pixel_values, **kwargs)
+
+
+class OnnxBackend(SearchBackend):
+    name = "onnx"
+    device = "cpu"
+
+    def __init__(self, export_dir, num_threads=None):
+        import onnxruntime as ort
+
+        with open(os.path.join(export_dir, "config.json")) as f:
+            self.config = json.load(f)
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        def session(name):
+            return ort.InferenceSession(
+                os.path.join(export_dir, name), options, providers=["CPUExecutionProvider"]
+            )
+
+        self.encoder = session("encoder.onnx")
+        self.decoder = session("decoder.onnx")
+        self.decoder_with_past = session("decoder_with_past.onnx")
+        self._with_past_inputs = [i.name for i in self.decoder_with_past.get_inputs()]
+
+    @staticmethod
+    def _run(session, feeds, input_names=None):
+        if input_names is not None:
+            # The exporter drops inputs the graph does not use
+            feeds = {name: value for name, value in feeds.items() if name in input_names}
+        return session.run(None, feeds)
+
+    def _make_step(self, encoder_hidden_states):
+        num_layers = self.config["num_layers"]
+        state = {}
+
+        def step(input_ids, reorder, items):
+            if items is not None:
+                index = items.numpy()
+                state["cross_kv"] = [tensor[index] for tensor in state["cross_kv"]]
+            if "self_kv" not in state:
+                outputs = self._run(self.decoder, {
+                    "input_ids": input_ids.numpy(),
+                    "encoder_hidden_states": encoder_hidden_states,
+                })
+                present = outputs[1:]
+                state["self_kv"] = [present[4 * i + j] for i in range(num_layers) for j in (0, 1)]
+                # Cross-attention key-values keep one row per image and are broadcast over
+                # its beams inside the graph; beams never move between images, so they
+                # are only narrowed down when images are dropped from the batch
+                state["cross_kv"] = [present[4 * i + j] for i in range(num_layers) for j in (2, 3)]
+                return torch.from_numpy(outputs[0][:, -1])
+
+            index = reorder.numpy()
+            self_kv = [tensor[index] for tensor in state["self_kv"]]
+            feeds = {"input_ids": input_ids[:, -1:].numpy()}
+            for i in range(num_layers):
+                feeds[f"past.{i}.self_key"] = self_kv[2 * i]
+                feeds[f"past.{i}.self_value"] = self_kv[2 * i + 1]
+                feeds[f"past.{i}.cross_key"] = state["cross_kv"][2 * i]
+                feeds[f"past.{i}.cross_value"] = state["cross_kv"][2 * i + 1]
+            outputs = self._run(self.decoder_with_past, feeds, self._with_past_inputs)
+            state["self_kv"] = outputs[1:]
+            return torch.from_numpy(outputs[0][:, -1])
+
+        return step
+
+    def encode(self, pixel_values):
+        pixel_values = pixel_values.detach().to("cpu", torch.float32).numpy()
+        return self._run(self.encoder, {"pixel_values": pixel_values})[0]
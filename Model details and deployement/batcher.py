@@ -0,0 +1,181 @@
+import asyncio
+from collections import Counter, deque
+
+import torch
+
+
+class CaptionBatcher:
+    """
+    Coalesces concurrent caption requests into a single batched model call.
+
+    Callers `submit` one preprocessed image tensor (3 x 224 x 224) and await its
+    caption. A background task takes the first queued request, keeps collecting
+    more until `max_batch_size` is reached or `max_wait_ms` has passed, stacks
+    them into one `pixel_values` tensor and runs `caption_fn(pixel_values, key)`
+    on it once. `caption_fn` must return one caption per row, in order.
+
+    Requests only share a batch with requests submitted with the same `key`
+    (e.g. a decoding profile). Requests with another key that arrive while a
+    batch is collected are held back and start the following batches.
+
+    Up to `max_in_flight` batches run at once (set it to the executor's worker
+    count). A new batch is only collected once a slot is free, so requests
+    arriving while every slot is busy accumulate into the next batch.
+    """
+
+    def __init__(self, caption_fn, max_batch_size=8, max_wait_ms=10.0, executor=None, max_in_flight=1):
+        self.caption_fn = caption_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.executor = executor  # None -> the event loop's default executor
+        self.max_in_flight = max(1, int(max_in_flight))
+
+        self._queue = None
+        self._held = deque()
+        self._worker = None
+        self._slots = None
+        self._in_flight = set()
+
+        # Stats
+        self.requests_total = 0
+        self.batches_total = 0
+        self.max_queue_depth = 0
+        self.batch_size_counts = Counter()
+        self.batch_key_counts = Counter()
+
+    async def start(self):
+        """Create the request queue and start the batching task on the running loop."""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching task. Batches already running finish; requests still queued are failed."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        while not self._queue.empty():
+            self._held.append(self._queue.get_nowait())
+        while self._held:
+            _, future, _ = self._held.popleft()
+            if not future.done():
+                future.set_exception(RuntimeError("Caption batcher stopped"))
+
+    async def submit(self, image_tensor, key=None):
+        """Queue a single image tensor and wait for its caption."""
+        if self._worker is None:
+            raise RuntimeError("Caption batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((image_tensor, future, key))
+        self.requests_total += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot first, so requests keep coalescing while all are busy
+            await self._slots.acquire()
+            batch = []
+            try:
+                key = await self._collect(batch)
+            except asyncio.CancelledError:
+                self._slots.release()
+                # Back to the front of the line, where stop() fails them
+                self._held.extendleft(reversed(batch))
+                raise
+            self._dispatch(batch, key)
+
+    async def _collect(self, batch):
+        """Fill `batch` with requests sharing the first one's key and return that key."""
+        loop = asyncio.get_running_loop()
+        batch.append(self._held.popleft() if self._held else await self._queue.get())
+        key = batch[0][2]
+        # Held-back requests with this key go first, in arrival order
+        held = deque()
+        while self._held:
+            request = self._held.popleft()
+            if request[2] == key and len(batch) < self.max_batch_size:
+                batch.append(request)
+            else:
+                held.append(request)
+        self._held = held
+
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already waiting before sleeping on the queue
+            if not self._queue.empty():
+                request = self._queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if request[2] == key:
+                batch.append(request)
+            else:
+                self._held.append(request)
+        return key
+
+    def _dispatch(self, batch, key):
+        # Run the batch as its own task so the next one can be collected meanwhile
+        task = asyncio.create_task(self._process(batch, key))
+        self._in_flight.add(task)
+
+        def done(task):
+            self._in_flight.discard(task)
+            self._slots.release()
+
+        task.add_done_callback(done)
+
+    async def _process(self, batch, key):
+        # Drop requests whose caller has already gone away
+        batch = [(tensor, future) for tensor, future, _ in batch if not future.done()]
+        if not batch:
+            return
+
+        self.batches_total += 1
+        self.batch_size_counts[len(batch)] += 1
+        self.batch_key_counts[key] += 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            pixel_values = torch.stack([tensor for tensor, _ in batch])
+            captions = await loop.run_in_executor(self.executor, self.caption_fn, pixel_values, key)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), caption in zip(batch, captions):
+            if not future.done():
+                future.set_result(caption)
+
+    def stats(self):
+        """Return queue depth and batch size statistics."""
+        completed = sum(size * count for size, count in self.batch_size_counts.items())
+        return {
+            "queue_depth": (self._queue.qsize() if self._queue is not None else 0) + len(self._held),
+            "max_queue_depth": self.max_queue_depth,
+            "requests_total": self.requests_total,
+            "batches_total": self.batches_total,
+            "batches_in_flight": len(self._in_flight),
+            "avg_batch_size": completed / self.batches_total if self.batches_total else 0.0,
+            "batch_sizes": {str(size): count for size, count in sorted(self.batch_size_counts.items())},
+            "batches_by_key": {str(key): count for key, count in self.batch_key_counts.items()},
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_in_flight": self.max_in_flight,
+        }
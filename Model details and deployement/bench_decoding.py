@@ -0,0 +1,63 @@
+"""
+Benchmark the decoding profiles in decoding.py: latency per image at several
+batch sizes, and how closely each profile's captions on the bundled images
+match the default profile's.
+
+    python bench_decoding.py --checkpoint checkpoint.pth --batch-sizes 1,8 --runs 3
+"""
+import argparse
+
+import torch
+
+from model import load_model
+from backends import OnnxBackend, TorchBackend
+from decoding import DEFAULT_PROFILE, PROFILES, compare_profiles
+from evaluation import bundled_images, load_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="checkpoint.pth", help="eager model (unused with --onnx-dir)")
+    parser.add_argument("--onnx-dir", help="benchmark the exported ONNX graphs instead of eager ViTT5")
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0: torch default)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.onnx_dir:
+        # export_model.py saves the tokenizer next to the graphs; the eager model is not needed
+        from transformers import T5Tokenizer
+        backend = OnnxBackend(args.onnx_dir)
+        tokenizer = T5Tokenizer.from_pretrained(args.onnx_dir)
+    else:
+        model, tokenizer = load_model(args.checkpoint, torch.device("cpu"))
+        model.eval()
+        backend = TorchBackend(model)
+    images = load_images(bundled_images())
+
+    print(f"{'profile':<10} {'settings':<36}" + "".join(f" {'ms/img @' + size:>11}" for size in args.batch_sizes.split(",")))
+    timings = {name: [] for name in PROFILES}
+    for size in args.batch_sizes.split(","):
+        # Cycle the bundled images up to the batch size
+        pixel_values = images[torch.arange(int(size)) % len(images)]
+        report = compare_profiles(backend.generate, tokenizer, pixel_values, runs=args.runs)
+        for name in PROFILES:
+            timings[name].append(report[name]["ms_per_image"])
+    for name, settings in PROFILES.items():
+        print(f"{name:<10} {str(settings):<36}" + "".join(f" {ms:>11.1f}" for ms in timings[name]))
+
+    report = compare_profiles(backend.generate, tokenizer, images)
+    print(f"\nCaptions vs {DEFAULT_PROFILE} on {len(images)} bundled images:")
+    for name, entry in report.items():
+        print(f"{name:<10} exact match {entry['exact_match']:.2f}, similarity {entry['similarity']:.2f}, "
+              f"{entry['speedup']:.2f}x the speed")
+    for i in range(len(images)):
+        print()
+        for name, entry in report.items():
+            print(f"  {name:<10} {entry['captions'][i]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark image preprocessing: the training-time torchvision transform versus
+the draft-decode + batched resize/normalize path in preprocessing.py.
+
+Each mode runs in its own process so peak memory is measured in isolation.
+Reports ms per image and the peak RSS added while preprocessing a batch of the
+bundled photos, then how far the fast path's pixels are from the reference.
+
+    python bench_preprocessing.py --runs 5 --batch 16
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+from evaluation import bundled_images
+from preprocessing import load_image_tensor_reference, load_image_tensors
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_batch(size):
+    """`size` encoded images, cycling through the bundled photos."""
+    contents = []
+    for path in bundled_images():
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return [contents[i % len(contents)] for i in range(size)]
+
+
+def preprocess(mode, contents):
+    if mode == "reference":
+        return torch.stack([load_image_tensor_reference(data) for data in contents])
+    return load_image_tensors(contents)
+
+
+def run_mode(args):
+    torch.set_num_threads(args.threads)
+    contents = read_batch(args.batch)
+    # Warm-up on one image, so the baseline includes the libraries' own allocations
+    preprocess(args.mode, contents[:1])
+    baseline = peak_rss_mb()
+
+    latencies = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        pixel_values = preprocess(args.mode, contents)
+        latencies.append((time.perf_counter() - start) / len(contents))
+
+    print(json.dumps({
+        "mode": args.mode,
+        "ms_per_image": 1000 * min(latencies),
+        "mean_ms_per_image": 1000 * sum(latencies) / len(latencies),
+        "peak_extra_rss_mb": peak_rss_mb() - baseline,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=16, help="images preprocessed per run")
+    parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads")
+    parser.add_argument("--mode", choices=["reference", "fast"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    results = {}
+    for mode in ("reference", "fast"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--runs", str(args.runs), "--batch", str(args.batch),
+             "--threads", str(args.threads), "--mode", mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<10} {'best ms/img':>12} {'mean ms/img':>12} {'peak extra RSS MB':>18}")
+    for mode, result in results.items():
+        print(f"{mode:<10} {result['ms_per_image']:>12.1f} {result['mean_ms_per_image']:>12.1f} "
+              f"{result['peak_extra_rss_mb']:>18.1f}")
+
+    contents = read_batch(len(bundled_images()))
+    difference = (preprocess("reference", contents) - preprocess("fast", contents)).abs()
+    # Inputs span [-1, 1]; one 8-bit grey level is 2 / 255
+    print(f"\nFast vs reference pixels: mean abs diff {difference.mean():.4f}, "
+          f"max {difference.max():.4f} ({difference.mean() * 127.5:.2f} grey levels on average)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark fp32 vs dynamic INT8 ViTT5 on CPU.
+
+Each mode runs in its own process so resident memory is measured in isolation.
+Reports mean caption latency per image, weight size and peak RSS, then compares
+INT8 captions with fp32 captions on the bundled images.
+
+    python bench_quantization.py --checkpoint checkpoint.pth --runs 5
+"""
+import argparse
+import io
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+from model import load_model
+from evaluation import bundled_images, load_images, caption_images, compare_captions
+
+
+def weight_bytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def run_mode(args):
+    device = torch.device("cpu")
+    model, tokenizer = load_model(args.checkpoint, device, quantize=args.mode == "int8")
+    model.eval()
+    pixel_values = load_images(bundled_images())
+
+    # Warm-up, then time one image at a time
+    captions = caption_images(model, tokenizer, pixel_values[:1])
+    latencies = []
+    for _ in range(args.runs):
+        for i in range(len(pixel_values)):
+            start = time.perf_counter()
+            caption_images(model, tokenizer, pixel_values[i:i + 1])
+            latencies.append(time.perf_counter() - start)
+    captions = caption_images(model, tokenizer, pixel_values)
+
+    print(json.dumps({
+        "mode": args.mode,
+        "mean_latency_ms": 1000 * sum(latencies) / len(latencies),
+        "weight_mb": weight_bytes(model) / 2**20,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "captions": captions,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="checkpoint.pth")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--mode", choices=["fp32", "int8"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    results = {}
+    for mode in ("fp32", "int8"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--checkpoint", args.checkpoint, "--runs", str(args.runs), "--mode", mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<6} {'latency ms/img':>15} {'weights MB':>11} {'peak RSS MB':>12}")
+    for mode, result in results.items():
+        print(f"{mode:<6} {result['mean_latency_ms']:>15.1f} {result['weight_mb']:>11.1f} {result['peak_rss_mb']:>12.1f}")
+
+    agreement = compare_captions(results["fp32"]["captions"], results["int8"]["captions"])
+    print(f"\nINT8 vs fp32 on {agreement['images']} images: exact match {agreement['exact_match']:.2f}, "
+          f"similarity {agreement['similarity']:.2f}")
+    for ref, cand in zip(results["fp32"]["captions"], results["int8"]["captions"]):
+        print(f"  fp32: {ref}\n  int8: {cand}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark the KV-cached search loop (TorchSearchBackend) against Hugging Face
+generate (TorchBackend) at a range of batch sizes, and check that both produce
+the same captions.
+
+Batches cycle through the bundled photos. Both backends run the same ViT
+encoder, so the speedup shown is diluted by it; the gain comes from decoding.
+
+    python bench_search.py --checkpoint checkpoint.pth --batch-sizes 1,2,4,8,16,32 --num-beams 4
+"""
+import argparse
+import time
+
+import torch
+
+from model import load_model
+from backends import TorchBackend, TorchSearchBackend
+from evaluation import bundled_images, load_images
+
+
+def images_per_second(backend, pixel_values, runs, **generate_kwargs):
+    backend.generate(pixel_values[:1], **generate_kwargs)  # warm-up
+    start = time.perf_counter()
+    for _ in range(runs):
+        output_ids = backend.generate(pixel_values, **generate_kwargs)
+    return runs * len(pixel_values) / (time.perf_counter() - start), output_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="checkpoint.pth")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32")
+    parser.add_argument("--num-beams", type=int, default=4)
+    parser.add_argument("--max-length", type=int, default=30)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0: torch default)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, _ = load_model(args.checkpoint, torch.device("cpu"))
+    model.eval()
+    images = load_images(bundled_images())
+    hf, search = TorchBackend(model), TorchSearchBackend(model)
+    settings = {"num_beams": args.num_beams, "max_length": args.max_length}
+
+    print(f"num_beams={args.num_beams} max_length={args.max_length}")
+    print(f"{'batch':>5} {'generate img/s':>15} {'search img/s':>13} {'speedup':>8} {'same':>5}")
+    for size in (int(size) for size in args.batch_sizes.split(",")):
+        pixel_values = images[torch.arange(size) % len(images)]
+        hf_rate, expected = images_per_second(hf, pixel_values, args.runs, **settings)
+        search_rate, actual = images_per_second(search, pixel_values, args.runs, **settings)
+        same = expected.shape == actual.shape and torch.equal(expected, actual)
+        print(f"{size:>5} {hf_rate:>15.2f} {search_rate:>13.2f} {search_rate / hf_rate:>7.2f}x {'yes' if same else 'NO':>5}")
+
+    special = torch.tensor([search.config["pad_token_id"], search.config["eos_token_id"]])
+    lengths = (~torch.isin(actual, special)).sum(dim=1)
+    print(f"\nCaption lengths in tokens (last batch): min {int(lengths.min())}, max {int(lengths.max())}")
+
+
+if __name__ == "__main__":
+    main()
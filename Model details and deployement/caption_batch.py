@@ -0,0 +1,240 @@
+"""
+Caption large sets of images offline.
+
+The input is a directory tree, a glob pattern, or a CSV/JSONL manifest with one
+image path per row (column/field "path", relative paths resolved against the
+manifest's directory; an "id" is copied to the output when present). Images
+stream through a bounded pipeline: a thread pool reads and decodes up to
+--prefetch images ahead, they are grouped into --batch-size batches, and each
+batch is captioned with one ViTT5.generate call while the next images decode.
+
+Results are appended to the output as JSON lines in input order, one per
+image: {"path", "caption"} or {"path", "error"}. Every --save-every
+batches the output is flushed to disk and the resume file records how many
+output bytes are complete. Running the same command again drops any lines
+written after that and skips the inputs whose paths those complete lines
+record, so a directory that gained or lost files in the meantime still
+resumes correctly.
+
+    python caption_batch.py /data/archive --output captions.jsonl --checkpoint checkpoint.pth
+"""
+import argparse
+import csv
+import fnmatch
+import glob
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from model import load_model
+from evaluation import caption_images
+from preprocessing import decode_image, preprocess_batch
+
+IMAGE_PATTERNS = ["*.jpg", "*.jpeg", "*.png", "*.bmp", "*.gif", "*.webp"]
+
+
+def is_image(name):
+    name = name.lower()
+    return any(fnmatch.fnmatch(name, pattern) for pattern in IMAGE_PATTERNS)
+
+
+def walk_directory(root):
+    """Image files under root, in a stable (sorted) order."""
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        for name in sorted(files):
+            if is_image(name):
+                yield {"path": os.path.join(directory, name)}
+
+
+def read_manifest(path):
+    """Rows of a CSV or JSONL manifest with a "path" column/field."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            item = {"path": os.path.join(base, row["path"])}
+            if row.get("id") not in (None, ""):
+                item["id"] = row["id"]
+            yield item
+
+
+def iter_inputs(source):
+    if os.path.isdir(source):
+        return walk_directory(source)
+    if os.path.isfile(source) and source.lower().endswith((".csv", ".jsonl")):
+        return read_manifest(source)
+    if glob.has_magic(source):
+        return ({"path": path} for path in sorted(glob.iglob(source, recursive=True)) if is_image(path))
+    raise SystemExit(f"Not a directory, glob pattern or .csv/.jsonl manifest: {source}")
+
+
+def completed_paths(output):
+    """Count of each input path recorded in the output, read from the start."""
+    output.seek(0)
+    return Counter(json.loads(line)["path"] for line in output if line.strip())
+
+
+def skip_completed(items, completed):
+    """Items whose path is not in `completed`; each recorded occurrence skips one input."""
+    for item in items:
+        if completed[item["path"]] > 0:
+            completed[item["path"]] -= 1
+        else:
+            yield item
+
+
+def load_and_decode(item):
+    """(item, uint8 image tensor or None, error or None)."""
+    try:
+        with open(item["path"], "rb") as f:
+            return item, decode_image(f.read()), None
+    except Exception as e:
+        return item, None, f"Failed to decode image: {e}"
+
+
+def prefetch(items, pool, depth):
+    """Decode items on `pool`, keeping at most `depth` in flight, yielding results in input order."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(load_and_decode, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def batches(decoded, size):
+    batch = []
+    for entry in decoded:
+        batch.append(entry)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_resume_state(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def write_resume_state(path, state):
+    # Write then rename, so an interruption never leaves a half-written state file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def caption_batch_of(model, tokenizer, device, batch, args):
+    """Output records for one batch of (item, image, error) entries."""
+    records = []
+    images = [image for _, image, error in batch if error is None]
+    captions = []
+    if images:
+        try:
+            pixel_values = preprocess_batch(images).to(device)
+            captions = caption_images(model, tokenizer, pixel_values, max_length=args.max_length, num_beams=args.num_beams)
+        except Exception as e:
+            batch = [(item, image, error or str(e)) for item, image, error in batch]
+    captions = iter(captions)
+    for item, _, error in batch:
+        record = dict(item)
+        if error is None:
+            record["caption"] = next(captions)
+        else:
+            record["error"] = error
+        records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="image directory, glob pattern (quote it), or .csv/.jsonl manifest")
+    parser.add_argument("--output", required=True, help="JSONL file the captions are appended to")
+    parser.add_argument("--resume-file", help="resume state (default: <output>.resume)")
+    parser.add_argument("--checkpoint", dest="model_checkpoint", default=os.getenv("CAPTION_CHECKPOINT", "checkpoint.pth"),
+                        help="model checkpoint file or merged model directory")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--prefetch", type=int, default=64, help="images read and decoded ahead of the model")
+    parser.add_argument("--decode-threads", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0: torch default)")
+    parser.add_argument("--save-every", type=int, default=10, help="batches between saves of the resume state")
+    parser.add_argument("--report-every", type=float, default=30, help="seconds between progress lines")
+    parser.add_argument("--max-length", type=int, default=30)
+    parser.add_argument("--num-beams", type=int, default=4)
+    parser.add_argument("--quantize", action="store_true", help="dynamic INT8 Linear layers (CPU only)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing resume file and output")
+    args = parser.parse_args()
+
+    resume_file = args.resume_file or args.output + ".resume"
+    state = None if args.restart else read_resume_state(resume_file)
+    if state is not None and state.get("source") != args.source:
+        raise SystemExit(f"{resume_file} is for {state.get('source')!r}; pass --restart to start over")
+    if state is not None and not os.path.exists(args.output):
+        raise SystemExit(f"{args.output} is missing; pass --restart to start over")
+    if state is None and not args.restart and os.path.exists(args.output) and os.path.getsize(args.output):
+        raise SystemExit(f"{args.output} already has captions but {resume_file} is missing; pass --restart to overwrite")
+
+    # Drop output written after the last save; those inputs run again
+    output = open(args.output, "r+b" if state else "wb")
+    output.truncate(state["output_bytes"] if state else 0)
+    completed = completed_paths(output) if state else Counter()
+    output.seek(0, os.SEEK_END)
+    done = sum(completed.values())
+    if done:
+        print(f"Resuming with {done} images already done")
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model, tokenizer = load_model(args.model_checkpoint, device, quantize=args.quantize)
+    model.eval()
+
+    items = skip_completed(iter_inputs(args.source), completed)
+    captioned = failed = 0
+    start = last_report = time.perf_counter()
+
+    def save_resume_state():
+        output.flush()
+        os.fsync(output.fileno())
+        write_resume_state(resume_file, {"source": args.source, "processed": done, "output_bytes": output.tell()})
+
+    with ThreadPoolExecutor(max_workers=args.decode_threads) as pool:
+        decoded = prefetch(items, pool, max(args.prefetch, args.batch_size))
+        for number, batch in enumerate(batches(decoded, args.batch_size), 1):
+            for record in caption_batch_of(model, tokenizer, device, batch, args):
+                output.write((json.dumps(record) + "\n").encode())
+                if "error" in record:
+                    failed += 1
+                else:
+                    captioned += 1
+            done += len(batch)
+            if number % args.save_every == 0:
+                save_resume_state()
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                print(f"{done} images done, {(captioned + failed) / (now - start):.1f} images/sec")
+                last_report = now
+
+    save_resume_state()
+    output.close()
+    elapsed = time.perf_counter() - start
+    print(f"Captioned {captioned} images ({failed} failed) in {elapsed:.1f}s: "
+          f"{(captioned + failed) / max(elapsed, 1e-9):.1f} images/sec; {done} done in total")
+
+
+if __name__ == "__main__":
+    main()
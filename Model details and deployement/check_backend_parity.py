@@ -0,0 +1,57 @@
+"""
+Parity test: caption the bundled images with eager ViTT5.generate and with the
+other backends (the KV-cached search loop and the exported ONNX graphs), and
+fail if any generated token sequence differs.
+
+    python check_backend_parity.py --checkpoint checkpoint.pth --onnx-dir onnx
+    python check_backend_parity.py --checkpoint checkpoint.pth --backends torch_search
+"""
+import argparse
+import sys
+
+import torch
+
+from model import load_model
+from backends import OnnxBackend, TorchBackend, TorchSearchBackend
+from decoding import PROFILES
+from evaluation import bundled_images, load_images
+
+# Decoding settings to compare: every profile app.py can serve
+SETTINGS = list(PROFILES.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="checkpoint.pth")
+    parser.add_argument("--onnx-dir", default="onnx")
+    parser.add_argument("--backends", default="torch_search,onnx", help="backends to compare with torch")
+    args = parser.parse_args()
+
+    model, tokenizer = load_model(args.checkpoint, torch.device("cpu"))
+    model.eval()
+    eager = TorchBackend(model)
+    candidates = {"torch_search": lambda: TorchSearchBackend(model), "onnx": lambda: OnnxBackend(args.onnx_dir)}
+    backends = [candidates[name]() for name in args.backends.split(",")]
+    pixel_values = load_images(bundled_images())
+
+    failures = 0
+    for settings in SETTINGS:
+        expected = eager.generate(pixel_values, **settings)
+        for backend in backends:
+            actual = backend.generate(pixel_values, **settings)
+            for i, (exp_ids, act_ids) in enumerate(zip(expected, actual)):
+                exp_caption = tokenizer.decode(exp_ids, skip_special_tokens=True)
+                act_caption = tokenizer.decode(act_ids, skip_special_tokens=True)
+                same = exp_ids.shape == act_ids.shape and torch.equal(exp_ids, act_ids)
+                failures += not same
+                print(f"[{'ok' if same else 'MISMATCH'}] {backend.name} {settings} image {i}: "
+                      f"{exp_caption!r} / {act_caption!r}")
+
+    if failures:
+        print(f"{failures} caption(s) differ from the torch backend")
+        sys.exit(1)
+    print(f"torch and {args.backends.replace(',', ', ')} backends agree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Image decoding on a pool of worker processes.
+
+Decoding and resizing photos is CPU work that holds the GIL for much of its
+time, so on the inference threads it competes with generate. DecodePool runs
+it in separate processes instead, overlapping with inference. Workers write
+the finished 3 x 224 x 224 float tensor into a slot of a shared-memory slab
+rather than pickling it back through a pipe; only the slot number travels.
+
+The slab has a fixed number of slots, which bounds the decodes in progress;
+further requests wait for a free slot.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from preprocessing import IMAGE_SIZE, decode_image, preprocess_batch
+
+SLOT_SHAPE = (3, IMAGE_SIZE, IMAGE_SIZE)
+
+# Set in each worker process by _init_worker
+_shm = None
+_slab = None
+
+
+def _attach(shm, slots):
+    return torch.from_numpy(np.ndarray((slots,) + SLOT_SHAPE, dtype=np.float32, buffer=shm.buf))
+
+
+def _init_worker(name, slots):
+    global _shm, _slab
+    # One decode per process; more intra-op threads would only oversubscribe the CPUs
+    torch.set_num_threads(1)
+    _shm = shared_memory.SharedMemory(name=name)
+    _slab = _attach(_shm, slots)
+
+
+def _ready():
+    return True
+
+
+def _decode_into(slot, contents):
+    _slab[slot].copy_(preprocess_batch([decode_image(contents)])[0])
+
+
+class DecodePool:
+    """
+    `workers` decode processes sharing a slab of `slots` image tensors.
+    Create it in the process that will use it (after any fork), then
+    `await start()` on the running event loop.
+    """
+
+    def __init__(self, workers=2, slots=None):
+        self.workers = workers
+        self.slots = slots or 2 * workers
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * int(np.prod(SLOT_SHAPE)) * 4)
+        self.slab = _attach(self._shm, self.slots)
+        # Spawned, not forked: the parent holds model weights and inference threads
+        self._context = multiprocessing.get_context("spawn")
+        self.pool = self._new_pool()
+        self._free = None
+
+        self.decoded_total = 0
+        self.failed_total = 0
+        self.restarts_total = 0
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(self._shm.name, self.slots),
+        )
+
+    async def start(self):
+        """Create the free-slot queue on the running loop and start the workers."""
+        self._free = asyncio.Queue()
+        for slot in range(self.slots):
+            self._free.put_nowait(slot)
+        loop = asyncio.get_running_loop()
+        # Pay the process start-up now rather than on the first requests
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _ready) for _ in range(self.workers)])
+
+    async def decode(self, contents):
+        """Decode and preprocess raw image bytes into a normalized 3 x 224 x 224 tensor."""
+        slot = await self._free.get()
+        pool = self.pool
+        try:
+            # submit() itself raises BrokenProcessPool once a worker has died
+            future = asyncio.get_running_loop().run_in_executor(pool, _decode_into, slot, contents)
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker may still be writing the slot; free it only once it is done
+            future.add_done_callback(lambda _: self._free.put_nowait(slot))
+            raise
+        except BrokenProcessPool:
+            self._free.put_nowait(slot)
+            self.failed_total += 1
+            # Every decode in flight on the broken pool lands here; only the first restarts it
+            if self.pool is pool:
+                self.restarts_total += 1
+                print("A decode worker died, restarting the decode pool")
+                self.pool = self._new_pool()
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception:
+            self._free.put_nowait(slot)
+            self.failed_total += 1
+            raise
+        # Copy out of the slab so the slot can be reused at once
+        image = self.slab[slot].clone()
+        self._free.put_nowait(slot)
+        self.decoded_total += 1
+        return image
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        # The slab view must go before the shared memory it points into
+        del self.slab
+        self._shm.close()
+        self._shm.unlink()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "slots": self.slots,
+            "free_slots": self._free.qsize() if self._free is not None else self.slots,
+            "decoded_total": self.decoded_total,
+            "failed_total": self.failed_total,
+            "restarts_total": self.restarts_total,
+        }
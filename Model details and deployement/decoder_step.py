@@ -0,0 +1,97 @@
+"""
+Explicit single-step T5 decoder built from the submodules of a loaded
+T5ForConditionalGeneration.
+
+Hugging Face's T5 derives the cached length from the cache object as a Python
+int, so it cannot be traced into a graph with a dynamic past length. Here the
+past length is read from the shape of the past tensors instead, which keeps it
+dynamic for ONNX export and lets the key-value layout be controlled directly.
+
+Key-values are [rows, heads, length, d_kv]. Cross-attention key-values may have
+fewer rows than the queries (one per image while the queries have one per beam);
+they are then broadcast across the beams instead of being copied.
+"""
+import torch
+
+
+def _heads(t5, states):
+    # [rows, length, inner] -> [rows, heads, length, d_kv]
+    config = t5.config
+    return states.view(states.shape[0], -1, config.num_heads, config.d_kv).transpose(1, 2)
+
+
+def _attend(q, k, v, bias=None):
+    # Group the query rows by key-value row so each image's key-values broadcast
+    # over its beams; done unconditionally so traced graphs keep it dynamic
+    rows, shared = q.shape[0], k.shape[0]
+    q = q.view(shared, rows // shared, *q.shape[1:])
+    k, v = k.unsqueeze(1), v.unsqueeze(1)
+    scores = torch.matmul(q, k.transpose(-1, -2))  # T5 does not scale the dot product
+    if bias is not None:
+        scores = scores + bias
+    weights = torch.softmax(scores.float(), dim=-1).type_as(scores)
+    output = torch.matmul(weights, v)
+    output = output.reshape(rows, *output.shape[-3:])
+    return output.transpose(1, 2).reshape(rows, output.shape[-2], -1)
+
+
+def _self_attention_bias(t5, query_length, past_length, device):
+    attention = t5.decoder.block[0].layer[0].SelfAttention
+    context = torch.arange(query_length, dtype=torch.long, device=device)[:, None] + past_length
+    memory = torch.arange(query_length + past_length, dtype=torch.long, device=device)[None, :]
+    buckets = attention._relative_position_bucket(
+        memory - context,
+        bidirectional=False,
+        num_buckets=attention.relative_attention_num_buckets,
+        max_distance=attention.relative_attention_max_distance,
+    )
+    bias = attention.relative_attention_bias(buckets).permute(2, 0, 1).unsqueeze(0)
+    causal = (memory > context).to(bias.dtype) * torch.finfo(bias.dtype).min
+    return bias + causal
+
+
+def cross_attention_states(t5, encoder_hidden_states):
+    """Project encoder states to per-layer cross-attention (key, value) pairs."""
+    states = []
+    for block in t5.decoder.block:
+        attention = block.layer[1].EncDecAttention
+        states.append((_heads(t5, attention.k(encoder_hidden_states)), _heads(t5, attention.v(encoder_hidden_states))))
+    return states
+
+
+def decoder_step(t5, input_ids, self_past, cross_states):
+    """
+    Run the decoder over `input_ids` ([rows, length], the new tokens only).
+
+    `self_past` is a list of per-layer (key, value) pairs for the tokens decoded
+    so far, or None on the first step. Returns next-token logits
+    [rows, length, vocab] and the updated self-attention key-values.
+    """
+    decoder = t5.decoder
+    hidden = decoder.embed_tokens(input_ids)
+    past_length = self_past[0][0].shape[2] if self_past else 0
+    bias = _self_attention_bias(t5, input_ids.shape[1], past_length, hidden.device)
+
+    present = []
+    for i, block in enumerate(decoder.block):
+        layer = block.layer[0]
+        attention = layer.SelfAttention
+        normed = layer.layer_norm(hidden)
+        q, k, v = (_heads(t5, proj(normed)) for proj in (attention.q, attention.k, attention.v))
+        if self_past:
+            k = torch.cat([self_past[i][0], k], dim=2)
+            v = torch.cat([self_past[i][1], v], dim=2)
+        present.append((k, v))
+        hidden = hidden + attention.o(_attend(q, k, v, bias))
+
+        layer = block.layer[1]
+        attention = layer.EncDecAttention
+        q = _heads(t5, attention.q(layer.layer_norm(hidden)))
+        hidden = hidden + attention.o(_attend(q, *cross_states[i]))
+
+        hidden = block.layer[2](hidden)
+
+    hidden = decoder.final_layer_norm(hidden)
+    if t5.config.tie_word_embeddings:
+        hidden = hidden * (t5.config.d_model ** -0.5)
+    return t5.lm_head(hidden), present
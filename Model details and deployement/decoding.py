@@ -0,0 +1,115 @@
+"""
+Decoding profiles: named sets of generate() arguments that trade caption
+quality for latency, chosen per request (?profile=fast on the caption endpoints).
+
+  fast      greedy search, no beams
+  balanced  2 beams
+  quality   4 beams, what every request used before profiles existed (default)
+
+All profiles keep the repetition penalty and n-gram blocking ViTT5 was tuned
+with; with greedy search those cost next to nothing, since there is one
+hypothesis per image. CAPTION_PROFILES (JSON, e.g. '{"fast": {"max_length": 20}}')
+overrides or adds profiles; CAPTION_DEFAULT_PROFILE picks the default one.
+"""
+import json
+import os
+import time
+from collections import deque
+
+from evaluation import compare_captions
+
+PROFILES = {
+    "fast": {"num_beams": 1, "max_length": 30},
+    "balanced": {"num_beams": 2, "max_length": 30},
+    "quality": {"num_beams": 4, "max_length": 30},
+}
+for _name, _overrides in json.loads(os.getenv("CAPTION_PROFILES", "{}")).items():
+    PROFILES[_name] = dict(PROFILES.get(_name, {}), **_overrides)
+
+DEFAULT_PROFILE = os.getenv("CAPTION_DEFAULT_PROFILE", "quality")
+if DEFAULT_PROFILE not in PROFILES:
+    raise ValueError(f"CAPTION_DEFAULT_PROFILE {DEFAULT_PROFILE!r} is not one of {sorted(PROFILES)}")
+
+# Latencies kept per profile for the percentiles in ProfileStats
+LATENCY_WINDOW = 1000
+
+
+class UnknownProfileError(ValueError):
+    pass
+
+
+def resolve_profile(name):
+    """Profile name for a request's ?profile= value (None for the default)."""
+    if name is None or name == "":
+        return DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise UnknownProfileError(f"Unknown decoding profile {name!r}; choose one of {sorted(PROFILES)}.")
+    return name
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ProfileStats:
+    """Per-profile request and generate-call latencies, over the last LATENCY_WINDOW of each."""
+
+    def __init__(self):
+        self._requests = {name: deque(maxlen=LATENCY_WINDOW) for name in PROFILES}
+        self._batches = {name: deque(maxlen=LATENCY_WINDOW) for name in PROFILES}
+        self.requests_total = {name: 0 for name in PROFILES}
+
+    def record_request(self, profile, seconds):
+        self._requests[profile].append(seconds)
+        self.requests_total[profile] += 1
+
+    def record_batch(self, profile, seconds, batch_size):
+        self._batches[profile].append((seconds, batch_size))
+
+    def stats(self):
+        report = {}
+        for name in PROFILES:
+            requests = self._requests[name]
+            batches = self._batches[name]
+            entry = {"settings": PROFILES[name], "requests_total": self.requests_total[name]}
+            if requests:
+                entry["request_ms"] = {
+                    "mean": 1000 * sum(requests) / len(requests),
+                    "p50": 1000 * percentile(requests, 0.5),
+                    "p95": 1000 * percentile(requests, 0.95),
+                }
+            if batches:
+                entry["generate_ms_per_image"] = 1000 * sum(s for s, _ in batches) / sum(n for _, n in batches)
+            report[name] = entry
+        return report
+
+
+def caption_with_profile(generate, tokenizer, pixel_values, profile):
+    """Caption a batch with `generate(pixel_values, **kwargs)` using a profile's settings."""
+    output_ids = generate(pixel_values, **PROFILES[profile])
+    return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+
+def compare_profiles(generate, tokenizer, pixel_values, reference=DEFAULT_PROFILE, runs=1):
+    """
+    Caption the same images with every profile; report each profile's mean
+    latency per image and how closely its captions match the `reference` profile's.
+    """
+    timings = {}
+    captions = {}
+    for name in PROFILES:
+        caption_with_profile(generate, tokenizer, pixel_values[:1], name)  # warm-up
+        start = time.perf_counter()
+        for _ in range(runs):
+            captions[name] = caption_with_profile(generate, tokenizer, pixel_values, name)
+        timings[name] = (time.perf_counter() - start) / (runs * len(pixel_values))
+
+    report = {}
+    for name in PROFILES:
+        entry = compare_captions(captions[reference], captions[name])
+        entry["ms_per_image"] = 1000 * timings[name]
+        entry["speedup"] = timings[reference] / timings[name]
+        entry["captions"] = captions[name]
+        report[name] = entry
+    return report
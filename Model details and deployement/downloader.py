@@ -0,0 +1,220 @@
+"""
+Resumable, verified, parallel file download.
+
+The file is fetched in fixed-size parts with HTTP range requests on a pool of
+threads, into `<path>.part`. Finished part numbers are recorded in
+`<path>.part.json`, so a download interrupted by a killed pod resumes where it
+stopped. Once complete, the file is checked against its SHA-256 and atomically
+renamed to `<path>`; a partial file therefore never appears under the final name.
+
+A lock file (`<path>.lock`) makes several workers on one host share a single
+download: the first one fetches, the others wait and then find the file in place.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import requests
+
+PART_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class RangesIgnored(DownloadError):
+    """The server answered a range request with the whole file (200, not 206)."""
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_url, filename, timeout=30):
+    """Look up `filename` in a `sha256sum`-style manifest ("<hex digest>  <name>" per line)."""
+    response = requests.get(manifest_url, timeout=timeout)
+    response.raise_for_status()
+    for line in response.text.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip("*") == filename:
+            return parts[0].lower()
+    raise DownloadError(f"{filename} is not listed in {manifest_url}")
+
+
+@contextmanager
+def file_lock(path):
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _probe(session, url, timeout):
+    """Return (final url, size, supports_ranges, sha256 advertised by the server or None)."""
+    response = session.head(url, allow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    size = int(response.headers.get("Content-Length", 0)) or None
+    ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    # The Hugging Face Hub reports the SHA-256 of LFS files as their linked ETag,
+    # on the redirect to the storage backend
+    sha256 = None
+    for hop in response.history + [response]:
+        etag = hop.headers.get("X-Linked-Etag", "").strip('"')
+        if len(etag) == 64:
+            sha256 = etag.lower()
+    return response.url, size, ranges, sha256
+
+
+def _fetch_part(session, url, part_path, start, end, timeout, retries):
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=timeout)
+            response.raise_for_status()
+            if response.status_code == 200:
+                response.close()
+                raise RangesIgnored(f"Server ignored the range request for bytes {start}-{end}")
+            if response.status_code != 206:
+                raise DownloadError(f"Server ignored the range request (status {response.status_code})")
+            received = 0
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    received += len(chunk)
+            if received != end - start + 1:
+                raise DownloadError(f"Short read for bytes {start}-{end}: got {received}")
+            return
+        except RangesIgnored:
+            # Retrying gets the same answer; download_file falls back to one stream
+            raise
+        except (requests.RequestException, DownloadError) as e:
+            if attempt == retries:
+                raise
+            print(f"Retrying bytes {start}-{end} after error: {e}")
+            time.sleep(2 ** attempt)
+
+
+def _fetch_whole(session, url, part_path, timeout):
+    response = session.get(url, stream=True, timeout=timeout)
+    response.raise_for_status()
+    with open(part_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            f.write(chunk)
+
+
+def _fetch_parts(session, url, part_path, state_path, size, part_size, workers, timeout, retries):
+    parts = [(i, start, min(start + part_size, size) - 1) for i, start in enumerate(range(0, size, part_size))]
+    done = _load_state(state_path, size, part_size)
+    if not os.path.exists(part_path) or os.path.getsize(part_path) != size:
+        done = set()
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    pending = [part for part in parts if part[0] not in done]
+    if done:
+        print(f"Resuming download of {url}: {len(done)}/{len(parts)} parts already present")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_fetch_part, session, url, part_path, start, end, timeout, retries): index
+            for index, start, end in pending
+        }
+        # Record every finished part, even if another one fails, so a retry resumes
+        error = None
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except RangesIgnored:
+                for other in futures:
+                    other.cancel()
+                raise
+            except Exception as e:
+                error = error or e
+                continue
+            done.add(futures[future])
+            _save_state(state_path, size, part_size, done)
+    if error is not None:
+        raise DownloadError(f"Download of {url} incomplete ({len(done)}/{len(parts)} parts): {error}")
+
+
+def _load_state(state_path, size, part_size):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if state.get("size") != size or state.get("part_size") != part_size:
+        return set()
+    return set(state.get("done", []))
+
+
+def _save_state(state_path, size, part_size, done):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"size": size, "part_size": part_size, "done": sorted(done)}, f)
+    os.replace(tmp_path, state_path)
+
+
+def download_file(url, path, sha256=None, manifest_url=None, workers=4, part_size=PART_SIZE,
+                  timeout=60, retries=3):
+    """
+    Download `url` to `path` unless it is already there.
+
+    The expected SHA-256 comes from `sha256`, else from `manifest_url`, else from
+    the server's X-Linked-Etag header; without any, the download is unverified.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    part_path = path + ".part"
+    state_path = path + ".part.json"
+
+    with file_lock(path + ".lock"):
+        if os.path.exists(path):
+            return path
+
+        session = requests.Session()
+        source, size, ranges, advertised = _probe(session, url, timeout)
+        if sha256 is None and manifest_url:
+            sha256 = read_manifest(manifest_url, os.path.basename(path), timeout)
+        sha256 = sha256 or advertised
+        if sha256 is None:
+            print(f"No SHA-256 known for {url}; the download will not be verified")
+
+        whole = not (size and ranges)
+        if not whole:
+            try:
+                _fetch_parts(session, source, part_path, state_path, size, part_size, workers, timeout, retries)
+            except RangesIgnored:
+                # Advertised Accept-Ranges but sent the whole file back
+                whole = True
+                if os.path.exists(state_path):
+                    os.remove(state_path)
+        if whole:
+            print(f"{url} does not support range requests; downloading in one stream")
+            _fetch_whole(session, source, part_path, timeout)
+
+        if size and os.path.getsize(part_path) != size:
+            raise DownloadError(f"Downloaded {os.path.getsize(part_path)} bytes, expected {size}")
+        if sha256 is not None:
+            actual = sha256_file(part_path)
+            if actual != sha256.lower():
+                for stale in (part_path, state_path):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                raise DownloadError(f"SHA-256 mismatch for {url}: expected {sha256}, got {actual}")
+
+        os.replace(part_path, path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+    return path
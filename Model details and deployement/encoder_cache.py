@@ -0,0 +1,199 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+# Name prefix of the per-process spill subdirectories: <prefix><pid>-<random>
+SPILL_PREFIX = "encoder-cache-"
+
+
+def _remove_orphaned_dirs(spill_dir):
+    """Remove spill subdirectories left behind by processes that no longer run."""
+    for name in os.listdir(spill_dir):
+        if not name.startswith(SPILL_PREFIX):
+            continue
+        try:
+            pid = int(name[len(SPILL_PREFIX):].split("-", 1)[0])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(spill_dir, name), ignore_errors=True)
+        except OSError:
+            # Exists but belongs to another user
+            pass
+
+
+def _remove_own_dir(path, pid):
+    # atexit handlers are inherited across fork; only the owner removes its directory
+    if os.getpid() == pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class EncoderCache:
+    """
+    LRU cache of projected encoder hidden states, keyed by a SHA-256 of the
+    preprocessed pixels of one image.
+
+    The in-memory tier is bounded by `max_bytes`. When `spill_dir` is given,
+    entries evicted from memory are written there (bounded by `spill_max_bytes`)
+    and promoted back to memory on the next hit. Each process spills into its
+    own private subdirectory of `spill_dir` (worker processes forked from one
+    preloaded app must not share files), which is removed when the process
+    exits; nothing else in `spill_dir` is touched.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, spill_dir=None, spill_max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+
+        self._memory = OrderedDict()  # key -> cpu tensor
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size in bytes
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        # Private spill subdirectory and the process it belongs to
+        self._spill_pid = None
+        self._private_dir = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def key_for(pixels):
+        """Hash one preprocessed image tensor (3 x H x W)."""
+        data = pixels.detach().to("cpu", torch.float32).contiguous().numpy()
+        return hashlib.sha256(data.tobytes()).hexdigest()
+
+    def _process_spill_dir(self):
+        """This process's spill subdirectory, created on first use. Caller holds the lock."""
+        pid = os.getpid()
+        if self._spill_pid != pid:
+            # Forked from the process that built the cache: its spilled files are not ours
+            self._spill_pid = pid
+            self._private_dir = None
+            self._disk.clear()
+            self._disk_bytes = 0
+        if self._private_dir is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            _remove_orphaned_dirs(self.spill_dir)
+            self._private_dir = tempfile.mkdtemp(prefix=f"{SPILL_PREFIX}{pid}-", dir=self.spill_dir)
+            atexit.register(_remove_own_dir, self._private_dir, pid)
+        return self._private_dir
+
+    def _spill_path(self, key):
+        # Caller holds the lock
+        return os.path.join(self._process_spill_dir(), key + ".pt")
+
+    def get(self, key):
+        with self._lock:
+            tensor = self._memory.get(key)
+            if tensor is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return tensor
+            if not self.spill_dir or key not in self._disk or self._spill_pid != os.getpid():
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+            path = self._spill_path(key)
+
+        try:
+            tensor = torch.load(path, map_location="cpu")
+        except Exception as e:
+            print(f"Failed to read spilled encoder state {key}: {e}")
+            with self._lock:
+                self._drop_from_disk(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        self.put(key, tensor)
+        return tensor
+
+    def put(self, key, tensor):
+        tensor = tensor.detach().to("cpu").clone()
+        size = tensor.numel() * tensor.element_size()
+        if size > self.max_bytes:
+            return
+
+        spilled = []
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = tensor
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_bytes:
+                old_key, old_tensor = self._memory.popitem(last=False)
+                self._memory_bytes -= old_tensor.numel() * old_tensor.element_size()
+                self.evictions += 1
+                if self.spill_dir and old_key not in self._disk:
+                    spilled.append((old_key, old_tensor))
+
+        for old_key, old_tensor in spilled:
+            self._spill(old_key, old_tensor)
+
+    def _spill(self, key, tensor):
+        with self._lock:
+            path = self._spill_path(key)
+        try:
+            # Write then rename, so a reader never loads a half-written file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    torch.save(tensor, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            size = os.path.getsize(path)
+        except Exception as e:
+            print(f"Failed to spill encoder state {key}: {e}")
+            return
+
+        with self._lock:
+            self._disk[key] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self.spill_max_bytes and self._disk:
+                old_key = next(iter(self._disk))
+                self._drop_from_disk(old_key)
+                self.disk_evictions += 1
+
+    def _drop_from_disk(self, key):
+        # Caller holds the lock
+        size = self._disk.pop(key, 0)
+        self._disk_bytes -= size
+        try:
+            os.remove(self._spill_path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
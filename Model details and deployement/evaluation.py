@@ -0,0 +1,63 @@
+import glob
+import os
+
+import torch
+
+from preprocessing import load_image_tensors
+
+# Sample photos shipped next to this file, used for startup checks and benchmarks
+BUNDLED_IMAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def bundled_images():
+    """Paths of the sample images bundled with the deployment."""
+    return sorted(glob.glob(os.path.join(BUNDLED_IMAGE_DIR, "*.jpg")))
+
+
+def load_images(image_paths):
+    """Preprocess image files into one stacked pixel_values tensor."""
+    contents = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return load_image_tensors(contents)
+
+
+def caption_images(model, tokenizer, pixel_values, **generate_kwargs):
+    """Caption a batch of preprocessed images with model.generate."""
+    generate_kwargs.setdefault("max_length", 30)
+    generate_kwargs.setdefault("num_beams", 4)
+    with torch.no_grad():
+        output_ids = model.generate(pixel_values=pixel_values, **generate_kwargs)
+    return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+
+def caption_similarity(reference, candidate):
+    """Unigram F1 between two captions (1.0 for identical word multisets)."""
+    ref_words = reference.lower().split()
+    cand_words = candidate.lower().split()
+    if not ref_words and not cand_words:
+        return 1.0
+    remaining = list(ref_words)
+    overlap = 0
+    for word in cand_words:
+        if word in remaining:
+            remaining.remove(word)
+            overlap += 1
+    if not overlap:
+        return 0.0
+    precision = overlap / len(cand_words)
+    recall = overlap / len(ref_words)
+    return 2 * precision * recall / (precision + recall)
+
+
+def compare_captions(reference, candidate):
+    """Exact-match rate and mean unigram F1 of candidate captions against reference captions."""
+    pairs = list(zip(reference, candidate))
+    if not pairs:
+        return {"images": 0, "exact_match": 1.0, "similarity": 1.0}
+    return {
+        "images": len(pairs),
+        "exact_match": sum(ref == cand for ref, cand in pairs) / len(pairs),
+        "similarity": sum(caption_similarity(ref, cand) for ref, cand in pairs) / len(pairs),
+    }
@@ -0,0 +1,82 @@
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class QueueFullError(Exception):
+    """Raised when the executor is draining or already holds `max_pending` requests."""
+
+
+def _init_worker(num_threads):
+    # torch's intra-op thread count is process-wide; every worker applies the same value
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+
+class InferenceExecutor:
+    """
+    Bounded worker pool that keeps blocking inference work off the event loop.
+
+    `admit()` guards a whole request (decode, batching and generate) and raises
+    `QueueFullError` once `max_pending` requests are in flight or the executor
+    is draining. `run()` executes a blocking callable on the pool.
+    """
+
+    def __init__(self, max_workers=2, num_threads=None, max_pending=64):
+        self.max_workers = max_workers
+        self.num_threads = num_threads
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="inference",
+            initializer=_init_worker,
+            initargs=(num_threads,),
+        )
+
+        self.draining = False
+        self.in_flight = 0
+        self.completed_total = 0
+        self.rejected_total = 0
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        if self.draining or self.in_flight >= self.max_pending:
+            self.rejected_total += 1
+            raise QueueFullError("Server is busy, please retry shortly.")
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed_total += 1
+
+    async def run(self, fn, *args):
+        """Run a blocking callable on the worker pool and await its result."""
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def drain(self, timeout=30.0):
+        """Stop admitting new requests and wait for in-flight ones to finish."""
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.in_flight and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.in_flight:
+            print(f"Executor drain timed out with {self.in_flight} requests still running")
+
+    def shutdown(self):
+        self.draining = True
+        self.pool.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "torch_threads": self.num_threads or torch.get_num_threads(),
+            "in_flight": self.in_flight,
+            "max_pending": self.max_pending,
+            "completed_total": self.completed_total,
+            "rejected_total": self.rejected_total,
+            "draining": self.draining,
+        }
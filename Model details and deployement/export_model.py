@@ -0,0 +1,171 @@
+"""
+Export ViTT5 to ONNX for the "onnx" inference backend.
+
+Writes three graphs to the output directory:
+  encoder.onnx            pixel_values -> encoder_hidden_states (ViT + projection)
+  decoder.onnx            first decoder step: input_ids, encoder_hidden_states
+                          -> logits, present self/cross key-values
+  decoder_with_past.onnx  later steps: last input_ids, past self/cross key-values
+                          -> logits, present self key-values
+plus config.json describing the layer count and special token ids.
+
+The decoder graphs are traced from decoder_step.py rather than the Hugging Face
+forward, so the past length stays dynamic. input_ids may have several rows
+(beams) per encoder row; cross-attention key-values keep one row per image.
+
+    python export_model.py --checkpoint checkpoint.pth --output onnx
+"""
+import argparse
+import json
+import os
+
+import torch
+import torch.nn as nn
+
+from model import load_model
+from decoder_step import cross_attention_states, decoder_step
+
+PAST_NAMES = ("self_key", "self_value", "cross_key", "cross_value")
+OPSET_VERSION = 17
+
+
+class EncoderGraph(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.vit_encoder = model.vit_encoder
+        self.projection = model.projection
+
+    def forward(self, pixel_values):
+        return self.projection(self.vit_encoder(pixel_values=pixel_values).last_hidden_state)
+
+
+class DecoderInitGraph(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.t5_decoder = model.t5_decoder
+
+    def forward(self, input_ids, encoder_hidden_states):
+        cross_states = cross_attention_states(self.t5_decoder, encoder_hidden_states)
+        logits, present = decoder_step(self.t5_decoder, input_ids, None, cross_states)
+        outputs = [logits]
+        for (self_key, self_value), (cross_key, cross_value) in zip(present, cross_states):
+            outputs += [self_key, self_value, cross_key, cross_value]
+        return tuple(outputs)
+
+
+class DecoderWithPastGraph(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.t5_decoder = model.t5_decoder
+        self.num_layers = model.t5_decoder.config.num_decoder_layers
+
+    def forward(self, input_ids, *past):
+        past = [past[i:i + 4] for i in range(0, 4 * self.num_layers, 4)]
+        logits, present = decoder_step(
+            self.t5_decoder, input_ids, [layer[:2] for layer in past], [layer[2:] for layer in past]
+        )
+        # Cross-attention key-values never change, so only the self-attention ones are returned
+        return (logits, *[tensor for layer in present for tensor in layer])
+
+
+def past_names(prefix, num_layers, kinds=PAST_NAMES):
+    return [f"{prefix}.{layer}.{kind}" for layer in range(num_layers) for kind in kinds]
+
+
+def past_axes(names, self_length):
+    # Self-attention entries have a row per beam and grow with the decoded length;
+    # cross-attention ones have a row per image and match the encoder length
+    return {
+        name: {0: "batch", 2: "encoder_length"} if ".cross_" in name else {0: "rows", 2: self_length}
+        for name in names
+    }
+
+
+def export(model, tokenizer, output_dir):
+    """Export the encoder and both decoder graphs of an eval-mode ViTT5 model."""
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.to("cpu").eval()
+    config = model.t5_decoder.config
+    num_layers = config.num_decoder_layers
+    image_size = model.vit_encoder.config.image_size
+
+    pixel_values = torch.randn(2, 3, image_size, image_size)
+    # Two beams per image, so the graphs keep separate beam-row and image dimensions
+    input_ids = torch.full((4, 1), config.decoder_start_token_id, dtype=torch.long)
+
+    # The exporter restores each wrapper's training flag onto the shared submodules
+    # afterwards, so the wrappers must be in eval mode too
+    encoder = EncoderGraph(model).eval()
+    decoder_init = DecoderInitGraph(model).eval()
+    decoder_with_past = DecoderWithPastGraph(model).eval()
+
+    with torch.no_grad():
+        encoder_hidden_states = encoder(pixel_values)
+        init_outputs = decoder_init(input_ids, encoder_hidden_states)
+
+        torch.onnx.export(
+            encoder, (pixel_values,), os.path.join(output_dir, "encoder.onnx"),
+            input_names=["pixel_values"],
+            output_names=["encoder_hidden_states"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "encoder_hidden_states": {0: "batch"}},
+            opset_version=OPSET_VERSION, dynamo=False,
+        )
+
+        present_names = past_names("present", num_layers)
+        torch.onnx.export(
+            decoder_init, (input_ids, encoder_hidden_states), os.path.join(output_dir, "decoder.onnx"),
+            input_names=["input_ids", "encoder_hidden_states"],
+            output_names=["logits"] + present_names,
+            dynamic_axes={
+                "input_ids": {0: "rows", 1: "length"},
+                "encoder_hidden_states": {0: "batch"},
+                "logits": {0: "rows", 1: "length"},
+                **past_axes(present_names, "length"),
+            },
+            opset_version=OPSET_VERSION, dynamo=False,
+        )
+
+        past_inputs = past_names("past", num_layers)
+        present_self = past_names("present", num_layers, PAST_NAMES[:2])
+        next_ids = torch.full((4, 1), config.pad_token_id, dtype=torch.long)
+        torch.onnx.export(
+            decoder_with_past, (next_ids, *init_outputs[1:]),
+            os.path.join(output_dir, "decoder_with_past.onnx"),
+            input_names=["input_ids"] + past_inputs,
+            output_names=["logits"] + present_self,
+            dynamic_axes={
+                "input_ids": {0: "rows"},
+                "logits": {0: "rows"},
+                **past_axes(past_inputs, "past_length"),
+                **past_axes(present_self, "present_length"),
+            },
+            opset_version=OPSET_VERSION, dynamo=False,
+        )
+
+    with open(os.path.join(output_dir, "config.json"), "w") as f:
+        json.dump({
+            "num_layers": num_layers,
+            "image_size": image_size,
+            "decoder_start_token_id": config.decoder_start_token_id,
+            "eos_token_id": config.eos_token_id,
+            "pad_token_id": config.pad_token_id,
+            "vocab_size": config.vocab_size,
+            "max_length": model.t5_decoder.generation_config.max_length,
+            "num_beams": model.t5_decoder.generation_config.num_beams,
+        }, f, indent=2)
+    tokenizer.save_pretrained(output_dir)
+    print("Exported ONNX graphs to", output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="checkpoint.pth")
+    parser.add_argument("--output", default="onnx")
+    args = parser.parse_args()
+
+    model, tokenizer = load_model(args.checkpoint, torch.device("cpu"))
+    export(model, tokenizer, args.output)
+
+
+if __name__ == "__main__":
+    main()
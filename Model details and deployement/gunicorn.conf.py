@@ -0,0 +1,19 @@
+# Run several API workers that share one copy of the model weights:
+#   gunicorn -c gunicorn.conf.py app:app
+# preload_app makes the master import app.py (and load ViTT5) once before
+# forking; each worker then maps the same weight pages instead of loading its own.
+import gc
+import os
+
+bind = "0.0.0.0:" + os.getenv("PORT", "7860")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("INFERENCE_DRAIN_TIMEOUT", "30")) + 5
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far out of the collector's reach, so garbage
+    # collections in the workers do not touch (and copy) the master's pages
+    gc.freeze()
@@ -0,0 +1,40 @@
+"""
+Build-time step: merge the pretrained backbones and the fine-tuned checkpoint
+into one self-contained model directory (configs, tokenizer, model.safetensors).
+
+    python merge_checkpoint.py --checkpoint checkpoint.pth --output merged
+
+Point the app at the directory (CAPTION_CHECKPOINT=merged) to skip the hub
+downloads and the double weight load at startup; load_model then builds the
+modules from config and memory-maps the weights, fully offline.
+"""
+import argparse
+import time
+
+import torch
+
+from model import load_model, save_merged_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="checkpoint.pth")
+    parser.add_argument("--output", default="merged")
+    args = parser.parse_args()
+
+    model, tokenizer = load_model(args.checkpoint, torch.device("cpu"))
+    save_merged_model(model, tokenizer, args.output)
+
+    # Reload once so a broken artifact fails the build rather than the first request
+    start = time.perf_counter()
+    merged, _ = load_model(args.output, torch.device("cpu"))
+    elapsed = time.perf_counter() - start
+    expected, actual = model.state_dict(), merged.state_dict()
+    for name, tensor in expected.items():
+        if not torch.equal(tensor, actual[name]):
+            raise SystemExit(f"Merged weights differ from the checkpoint at {name}")
+    print(f"Verified {len(expected)} tensors; merged model loads in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
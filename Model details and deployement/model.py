@@ -7,12 +7,19 @@ os.makedirs("/tmp/cache", exist_ok=True)
 
 import torch
 import torch.nn as nn
-from transformers import ViTModel, T5ForConditionalGeneration, T5Tokenizer
+from transformers import ViTConfig, ViTModel, T5Config, T5ForConditionalGeneration, T5Tokenizer
 from transformers.modeling_outputs import BaseModelOutput
-import requests
 
 
 
+# Decoding settings ViTT5.generate uses unless the caller passes its own
+GENERATE_DEFAULTS = {
+    "no_repeat_ngram_size": 2,  # Prevents repeating phrases
+    "repetition_penalty": 1.2,  # Penalizes repeated words
+    "temperature": 0.9,         # More diverse outputs
+}
+
+
 class ViTT5(nn.Module):
     def __init__(self, vit_encoder, t5_decoder):
         super(ViTT5, self).__init__()
@@ -20,6 +27,8 @@ class ViTT5(nn.Module):
         self.t5_decoder = t5_decoder
         # Project ViT's hidden size (768) to T5's d_model (512 for t5-small)
         self.projection = nn.Linear(vit_encoder.config.hidden_size, t5_decoder.config.d_model)
+        # Optional EncoderCache of projected hidden states, used by generate()
+        self.encoder_cache = None
         
     def forward(self, pixel_values, labels=None):
         # Extract ViT encoder outputs
@@ -36,46 +45,144 @@ class ViTT5(nn.Module):
         )
         return outputs
     
-    def generate(self, pixel_values, **kwargs):
-        # Extract ViT encoder outputs
-        vit_outputs = self.vit_encoder(pixel_values=pixel_values)
-        vit_hidden_states = vit_outputs.last_hidden_state
+    def encode(self, pixel_values):
+        """
+        Run the ViT encoder and projection. Images already in encoder_cache
+        skip the ViT forward pass; only the missing rows are encoded.
+        """
+        if self.encoder_cache is None or torch.is_grad_enabled():
+            return self.projection(self.vit_encoder(pixel_values=pixel_values).last_hidden_state)
         
-        # Project to T5's dimension
-        encoder_hidden_states = self.projection(vit_hidden_states)
+        keys = [self.encoder_cache.key_for(pixels) for pixels in pixel_values]
+        states = [self.encoder_cache.get(key) for key in keys]
+        missing = [i for i, state in enumerate(states) if state is None]
+        if missing:
+            vit_hidden_states = self.vit_encoder(pixel_values=pixel_values[missing]).last_hidden_state
+            projected = self.projection(vit_hidden_states)
+            for row, i in enumerate(missing):
+                states[i] = projected[row]
+                self.encoder_cache.put(keys[i], projected[row])
+        return torch.stack([state.to(pixel_values.device) for state in states])
+    
+    def generate(self, pixel_values, **kwargs):
+        # Extract ViT encoder outputs projected to T5's dimension
+        encoder_hidden_states = self.encode(pixel_values)
         
         # Wrap the hidden states in a BaseModelOutput which has a last_hidden_state attribute
         encoder_outputs = BaseModelOutput(last_hidden_state=encoder_hidden_states)
         
-        # Generate captions using T5's decoder
-        return self.t5_decoder.generate(
-            encoder_outputs=encoder_outputs,
-            no_repeat_ngram_size=2,  # Prevents repeating phrases
-            repetition_penalty=1.2,  # Penalizes repeated words
-            temperature=0.9,         # More diverse outputs
-            **kwargs
-        )
-def download_checkpoint(checkpoint_path):
+        # Generate captions using T5's decoder; kwargs override GENERATE_DEFAULTS
+        return self.t5_decoder.generate(encoder_outputs=encoder_outputs, **dict(GENERATE_DEFAULTS, **kwargs))
+# Where the fine-tuned checkpoint is fetched from, how it is verified (an explicit
+# SHA-256 or a sha256sum-style manifest; the Hub's own checksum is used otherwise)
+# and how many ranges are fetched in parallel
+CHECKPOINT_URL = os.getenv(
+    "CHECKPOINT_URL", "https://huggingface.co/Rishabh2234/image-caption-generator/resolve/main/checkpoint.pth"
+)
+CHECKPOINT_SHA256 = os.getenv("CHECKPOINT_SHA256")
+CHECKPOINT_MANIFEST_URL = os.getenv("CHECKPOINT_MANIFEST_URL")
+CHECKPOINT_DOWNLOAD_WORKERS = int(os.getenv("CHECKPOINT_DOWNLOAD_WORKERS", "4"))
+
+
+def download_checkpoint(checkpoint_path, url=CHECKPOINT_URL):
     """
     Downloads the checkpoint from Hugging Face Model Hub if not found locally.
+    Resumes partial downloads, verifies the SHA-256 and only then moves the
+    file into place; concurrent workers on one host share one download.
     """
-    model_url = "https://huggingface.co/Rishabh2234/image-caption-generator/resolve/main/checkpoint.pth"
-    print("Checkpoint not found locally. Downloading from Hugging Face Model Hub...")
-    response = requests.get(model_url, stream=True)
-    if response.status_code == 200:
-        with open(checkpoint_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        print("Download complete!")
-    else:
-        raise RuntimeError(f"Error downloading model, status code: {response.status_code}")
+    from downloader import download_file
+    
+    print("Checkpoint not found locally. Downloading from", url)
+    download_file(
+        url,
+        checkpoint_path,
+        sha256=CHECKPOINT_SHA256,
+        manifest_url=CHECKPOINT_MANIFEST_URL,
+        workers=CHECKPOINT_DOWNLOAD_WORKERS,
+    )
+    print("Download complete!")
+
+
+# Files of a merged model directory written by merge_checkpoint.py
+MERGED_WEIGHTS = "model.safetensors"
+MERGED_VIT_CONFIG = "vit_config.json"
+MERGED_T5_CONFIG = "t5_config.json"
 
 
-def load_model(checkpoint_path, device):
+def is_merged_model(path):
+    return os.path.isfile(os.path.join(path, MERGED_WEIGHTS))
+
+
+def configure_decoder(model, tokenizer):
+    """Set the special tokens and decoding defaults the captioner was trained with."""
+    config = model.t5_decoder.config
+    config.decoder_start_token_id = tokenizer.pad_token_id
+    config.eos_token_id = tokenizer.eos_token_id
+    config.pad_token_id = tokenizer.pad_token_id
+    # Decoding defaults live on the generation config; newer transformers
+    # versions refuse to generate when they are set on the model config
+    generation_config = model.t5_decoder.generation_config
+    generation_config.decoder_start_token_id = tokenizer.pad_token_id
+    generation_config.eos_token_id = tokenizer.eos_token_id
+    generation_config.pad_token_id = tokenizer.pad_token_id
+    generation_config.max_length = 40
+    generation_config.num_beams = 6
+    generation_config.repetition_penalty = 1.2
+    generation_config.no_repeat_ngram_size = 2
+    generation_config.temperature = 0.9
+
+
+def save_merged_model(model, tokenizer, output_dir):
     """
-    Loads the ViTT5 model along with the T5 tokenizer.
-    Downloads the checkpoint from Hugging Face Hub if not available locally.
+    Write a self-contained model directory: both configs, the tokenizer and
+    all ViTT5 weights (pretrained backbones plus fine-tuned checkpoint) in one
+    safetensors file.
+    """
+    from safetensors.torch import save_model
+    
+    os.makedirs(output_dir, exist_ok=True)
+    model.vit_encoder.config.to_json_file(os.path.join(output_dir, MERGED_VIT_CONFIG))
+    model.t5_decoder.config.to_json_file(os.path.join(output_dir, MERGED_T5_CONFIG))
+    tokenizer.save_pretrained(output_dir)
+    # save_model drops the duplicate names of T5's tied embedding weights
+    save_model(model, os.path.join(output_dir, MERGED_WEIGHTS))
+    print("Merged model saved to", output_dir)
+
+
+def load_merged_model(model_dir, device):
+    """
+    Build ViTT5 from the saved configs only (no hub access, no random init)
+    and attach the memory-mapped weights of a directory from save_merged_model.
+    """
+    from safetensors.torch import load_file
+    
+    vit_config = ViTConfig.from_json_file(os.path.join(model_dir, MERGED_VIT_CONFIG))
+    t5_config = T5Config.from_json_file(os.path.join(model_dir, MERGED_T5_CONFIG))
+    with torch.device("meta"):
+        model = ViTT5(ViTModel(vit_config), T5ForConditionalGeneration(t5_config))
+    
+    state_dict = load_file(os.path.join(model_dir, MERGED_WEIGHTS))
+    # Only one name of each tied weight is stored; point the others at the same tensor
+    tied = {}
+    for name, param in model.named_parameters(remove_duplicate=False):
+        tied.setdefault(param, []).append(name)
+    for names in tied.values():
+        stored = [name for name in names if name in state_dict]
+        for name in names:
+            if stored and name not in state_dict:
+                state_dict[name] = state_dict[stored[0]]
+    model.load_state_dict(state_dict, assign=True)
+    
+    tokenizer = T5Tokenizer.from_pretrained(model_dir)
+    configure_decoder(model, tokenizer)
+    print("Merged model loaded from", model_dir)
+    return model.to(device).eval(), tokenizer
+
+
+def load_checkpoint_model(checkpoint_path, device):
+    """
+    Builds ViTT5 from the pretrained Hugging Face Hub backbones and loads the
+    fine-tuned checkpoint on top, downloading it if not available locally.
     """
     # Load pre-trained vision encoder and T5 decoder
     encoder = ViTModel.from_pretrained("google/vit-base-patch16-224-in21k")
@@ -88,14 +195,7 @@ def load_model(checkpoint_path, device):
     tokenizer = T5Tokenizer.from_pretrained("t5-small")
     
     # Configure decoder settings
-    model.t5_decoder.config.decoder_start_token_id = tokenizer.pad_token_id
-    model.t5_decoder.config.eos_token_id = tokenizer.eos_token_id
-    model.t5_decoder.config.pad_token_id = tokenizer.pad_token_id
-    model.t5_decoder.config.max_length = 40
-    model.t5_decoder.config.num_beams = 6
-    model.t5_decoder.config.repetition_penalty = 1.2
-    model.t5_decoder.config.no_repeat_ngram_size = 2
-    model.t5_decoder.config.temperature = 0.9
+    configure_decoder(model, tokenizer)
     model.to(device)
     
     # Check if checkpoint exists; if not, download it
@@ -117,6 +217,27 @@ def load_model(checkpoint_path, device):
     
     return model, tokenizer
 
+
+def load_model(checkpoint_path, device, quantize=False):
+    """
+    Loads the ViTT5 model along with the T5 tokenizer.
+    checkpoint_path is either a merged model directory (see merge_checkpoint.py),
+    loaded offline from its configs and memory-mapped weights, or a checkpoint
+    file applied on top of the hub backbones.
+    With quantize=True the model is returned with dynamic INT8 Linear layers (CPU only).
+    """
+    if is_merged_model(checkpoint_path):
+        model, tokenizer = load_merged_model(checkpoint_path, device)
+    else:
+        model, tokenizer = load_checkpoint_model(checkpoint_path, device)
+    
+    if quantize:
+        from quantization import quantize_model
+        model = quantize_model(model)
+        print("Model quantized to dynamic INT8")
+    
+    return model, tokenizer
+
 # For deployment, when running this file directly:
 if __name__ == "__main__":
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
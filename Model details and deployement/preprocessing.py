@@ -0,0 +1,74 @@
+"""
+Image preprocessing: raw image bytes to the normalized 3 x 224 x 224 input of ViTT5.
+
+Training used the torchvision chain kept below as `transform` (PIL decode at full
+resolution, Resize, ToTensor, Normalize). Serving does the same maths in fewer,
+cheaper steps:
+
+- decode_image asks the JPEG decoder for a reduced-size image (draft mode: the
+  DCT is scaled by 1/2, 1/4 or 1/8 while decoding, never below 224 pixels on
+  either side), so a 12 MP photo is never materialized at full size, and
+  returns it as a uint8 tensor;
+- preprocess_batch resizes each decoded image with antialiased bilinear
+  interpolation on uint8 into one preallocated batch, then normalizes the whole
+  batch in one pass: ToTensor + Normalize(0.5, 0.5) is x / 127.5 - 1.
+"""
+import io
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+import torchvision.transforms as transforms
+
+IMAGE_SIZE = 224
+
+# Image preprocessing used at training time
+transform = transforms.Compose([
+    transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+])
+
+
+def load_image_tensor_reference(contents):
+    """Decode raw image bytes with the training-time transform (full-size decode)."""
+    image = Image.open(io.BytesIO(contents)).convert("RGB")
+    return transform(image)
+
+
+def decode_image(contents, size=IMAGE_SIZE):
+    """
+    Decode raw image bytes into a uint8 [3, H, W] RGB tensor, letting JPEG
+    decoding skip resolution that the resize to `size` would throw away.
+    """
+    image = Image.open(io.BytesIO(contents))
+    # Only JPEG supports draft mode; for other formats this is a no-op
+    image.draft("RGB", (size, size))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    # H x W x 3, viewed as 3 x H x W (channels-last strides, which uint8 resizing prefers)
+    return torch.from_numpy(np.array(image)).permute(2, 0, 1)
+
+
+def preprocess_batch(images, size=IMAGE_SIZE):
+    """Resize and normalize uint8 [3, H, W] tensors into one float [N, 3, size, size] batch."""
+    batch = torch.empty((len(images), 3, size, size), dtype=torch.uint8)
+    for i, image in enumerate(images):
+        if image.shape[1:] == (size, size):
+            batch[i] = image
+        else:
+            batch[i] = F.interpolate(
+                image.unsqueeze(0), size=(size, size), mode="bilinear", antialias=True, align_corners=False
+            )[0]
+    return batch.float().div_(127.5).sub_(1.0)
+
+
+def load_image_tensors(contents_list):
+    """Decode and preprocess several images into one batch."""
+    return preprocess_batch([decode_image(contents) for contents in contents_list])
+
+
+def load_image_tensor(contents):
+    """Decode raw image bytes into a normalized 3 x 224 x 224 tensor."""
+    return preprocess_batch([decode_image(contents)])[0]
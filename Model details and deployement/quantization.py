@@ -0,0 +1,42 @@
+import copy
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+import torch.ao.nn.quantized.dynamic as nnqd
+
+from evaluation import caption_images, compare_captions
+
+# Submodules of ViTT5 whose nn.Linear layers get INT8 weights. The T5 encoder
+# stack is never run (the ViT replaces it), so it is left alone.
+QUANTIZED_SUBMODULES = ["vit_encoder", "projection", "t5_decoder.decoder", "t5_decoder.lm_head"]
+
+
+def quantize_model(model):
+    """
+    Return a copy of a ViTT5 model with dynamic INT8 quantization applied to the
+    Linear layers of the ViT encoder, the projection and the T5 decoder.
+    Dynamic quantization only runs on CPU: the copy is moved there, while the
+    model passed in stays on its device.
+    """
+    qconfig_spec = {name: default_dynamic_qconfig for name in QUANTIZED_SUBMODULES}
+    # nn.Module.to moves in place, so copy before moving
+    return quantize_dynamic(
+        copy.deepcopy(model).to("cpu"),
+        qconfig_spec,
+        mapping={nn.Linear: nnqd.Linear},
+        dtype=torch.qint8,
+        inplace=True,
+    )
+
+
+def check_quantized_model(model, quantized_model, tokenizer, pixel_values, **generate_kwargs):
+    """
+    Caption the same images with the fp32 and the quantized model and report
+    how closely the quantized captions match.
+    """
+    reference = caption_images(model, tokenizer, pixel_values, **generate_kwargs)
+    candidate = caption_images(quantized_model, tokenizer, pixel_values, **generate_kwargs)
+    report = compare_captions(reference, candidate)
+    report["captions"] = [{"fp32": ref, "int8": cand} for ref, cand in zip(reference, candidate)]
+    return report
@@ -0,0 +1,169 @@
+"""
+Greedy and beam search over an arbitrary decoder step function.
+
+Used by inference backends that do not run through Hugging Face `generate`
+(e.g. exported ONNX graphs). The search follows the semantics of
+`transformers` generate for the options ViTT5 uses (repetition penalty,
+no-repeat n-grams, length penalty, default early stopping), so both paths
+produce the same captions.
+
+Items whose captions are settled (greedy: EOS emitted; beam: no running beam
+can beat the finished ones) are compacted out of the active batch, so later
+steps only run over the rows still decoding. Outputs are unchanged by this:
+Hugging Face keeps decoding such items, but never lets it change their result.
+
+`step(input_ids, reorder, items)` receives the full decoded sequences so far
+([rows, cur_len]) and, from the second call on, the indices of the previous
+rows each new row continues from (None on the first call). It must reorder
+any cached state accordingly and return next-token logits of shape [rows, vocab].
+`items` is None unless items were compacted out since the previous call; it
+then holds the positions, among the previous call's items, of those still
+decoding, for selecting per-item state (e.g. encoder states shared by beams).
+Rows are grouped by item: item i owns rows i * num_beams to (i + 1) * num_beams - 1.
+"""
+import torch
+
+
+def process_scores(input_ids, scores, no_repeat_ngram_size=0, repetition_penalty=1.0):
+    """Apply the repetition penalty and no-repeat n-gram ban to next-token scores."""
+    if repetition_penalty != 1.0:
+        score = torch.gather(scores, 1, input_ids)
+        score = torch.where(score < 0, score * repetition_penalty, score / repetition_penalty)
+        scores = scores.scatter(1, input_ids, score)
+
+    cur_len = input_ids.shape[1]
+    if no_repeat_ngram_size and cur_len + 1 >= no_repeat_ngram_size:
+        n = no_repeat_ngram_size
+        for row, tokens in enumerate(input_ids.tolist()):
+            prefix = tuple(tokens[cur_len + 1 - n:])
+            banned = [ngram[-1] for ngram in zip(*[tokens[i:] for i in range(n)]) if tuple(ngram[:-1]) == prefix]
+            if banned:
+                scores[row, banned] = -float("inf")
+    return scores
+
+
+def greedy_search(step, batch_size, max_length, decoder_start_token_id, eos_token_id, pad_token_id,
+                  no_repeat_ngram_size=0, repetition_penalty=1.0, device="cpu"):
+    output = torch.full((batch_size, max_length), pad_token_id, dtype=torch.long, device=device)
+    output[:, 0] = decoder_start_token_id
+    active = torch.arange(batch_size, device=device)  # output rows still decoding
+    input_ids = output[:, :1]
+    reorder = items = None
+    cur_len = 1
+    while cur_len < max_length:
+        logits = step(input_ids, reorder, items).float()
+        scores = process_scores(input_ids, logits, no_repeat_ngram_size, repetition_penalty)
+        next_tokens = torch.argmax(scores, dim=-1)
+        input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
+        output[active, cur_len] = next_tokens
+        cur_len += 1
+
+        unfinished = next_tokens != eos_token_id
+        if not unfinished.any():
+            break
+        reorder = torch.arange(len(active), device=device)
+        items = None
+        if not unfinished.all():
+            reorder = items = unfinished.nonzero()[:, 0]
+            active = active[items]
+            input_ids = input_ids[items]
+    return output[:, :cur_len]
+
+
+def _gather(tensor, indices):
+    while indices.dim() < tensor.dim():
+        indices = indices.unsqueeze(-1)
+    return torch.take_along_dim(tensor, indices, dim=1)
+
+
+def beam_search(step, batch_size, num_beams, max_length, decoder_start_token_id, eos_token_id, pad_token_id,
+                no_repeat_ngram_size=0, repetition_penalty=1.0, length_penalty=1.0, early_stopping=False,
+                device="cpu"):
+    B, K = batch_size, num_beams
+    keep = 2 * K
+    fill = pad_token_id or eos_token_id  # what transformers pads beam outputs with
+
+    running = torch.full((B, K, max_length), fill, dtype=torch.long, device=device)
+    running[:, :, 0] = decoder_start_token_id
+    running_scores = torch.zeros((B, K), device=device)
+    running_scores[:, 1:] = -1e9
+
+    sequences = running.clone()
+    lengths = torch.ones((B, K), dtype=torch.long, device=device)
+    beam_scores = torch.full((B, K), -1e9, device=device)
+    finished = torch.zeros((B, K), dtype=torch.bool, device=device)
+    improvable = torch.ones((B, 1), dtype=torch.bool, device=device)
+    top_mask = torch.cat([torch.ones(K, dtype=torch.bool), torch.zeros(keep - K, dtype=torch.bool)]).to(device)
+
+    # Results of the items compacted out of the batch, by original position
+    output = torch.full((B, max_length), fill, dtype=torch.long, device=device)
+    output_lengths = torch.ones(B, dtype=torch.long, device=device)
+    active = torch.arange(B, device=device)
+
+    cur_len = 1
+    reorder = items = None
+    while True:
+        flat = running[:, :, :cur_len].reshape(B * K, cur_len)
+        log_probs = torch.log_softmax(step(flat, reorder, items).float(), dim=-1)
+        log_probs = process_scores(flat, log_probs, no_repeat_ngram_size, repetition_penalty)
+        vocab_size = log_probs.shape[-1]
+        log_probs = (log_probs.view(B, K, vocab_size) + running_scores[:, :, None]).view(B, K * vocab_size)
+
+        # Top 2K continuations across all beams of each item
+        topk_scores, topk_indices = torch.topk(log_probs, keep)
+        topk_beams = topk_indices // vocab_size
+        topk_tokens = topk_indices % vocab_size
+        topk_sequences = _gather(running, topk_beams)
+        topk_sequences[:, :, cur_len] = topk_tokens
+        hits = (topk_tokens == eos_token_id) | (cur_len + 1 >= max_length)
+
+        # Best K continuations that are still running
+        running_candidates = topk_scores + hits.float() * -1e9
+        next_indices = torch.topk(running_candidates, K)[1]
+        running = _gather(topk_sequences, next_indices)
+        running_scores = _gather(running_candidates, next_indices)
+        source_beams = _gather(topk_beams, next_indices)
+
+        # Merge newly finished hypotheses (only from the top K) into the finished set
+        just_finished = hits & top_mask[None, :]
+        candidate_scores = topk_scores / (cur_len ** length_penalty)
+        if early_stopping is True:
+            candidate_scores = candidate_scores + finished.all(-1, keepdim=True).float() * -1e9
+        candidate_scores = candidate_scores + (~improvable).float() * -1e9
+        candidate_scores = candidate_scores + (~just_finished).float() * -1e9
+        merged_scores = torch.cat([beam_scores, candidate_scores], dim=1)
+        best = torch.topk(merged_scores, K)[1]
+        sequences = _gather(torch.cat([sequences, topk_sequences], dim=1), best)
+        lengths = _gather(torch.cat([lengths, torch.full_like(topk_tokens, cur_len + 1)], dim=1), best)
+        beam_scores = _gather(merged_scores, best)
+        finished = _gather(torch.cat([finished, just_finished], dim=1), best)
+
+        reorder = (source_beams + torch.arange(B, device=device)[:, None] * K).view(-1)
+        cur_len += 1
+
+        # Stop once no running beam can beat the worst finished one
+        best_running = running_scores[:, :1] / ((cur_len - 1) ** length_penalty)
+        worst_finished = torch.where(finished, beam_scores.min(dim=1, keepdim=True)[0], -1e9)
+        improvable = improvable & (best_running > worst_finished).any(dim=-1, keepdim=True)
+        done = ~improvable[:, 0]
+        if early_stopping is True:
+            done |= finished.all(dim=-1)
+        if bool(done.all()) or bool(hits.all()):
+            break
+
+        items = None
+        if bool(done.any()):
+            # Record the settled items and drop them from every per-item tensor
+            output[active[done]] = sequences[done, 0]
+            output_lengths[active[done]] = lengths[done, 0]
+            items = (~done).nonzero()[:, 0]
+            reorder = reorder.view(B, K)[items].view(-1)
+            running, running_scores, sequences, lengths, beam_scores, finished, improvable, active = (
+                tensor[items] for tensor in
+                (running, running_scores, sequences, lengths, beam_scores, finished, improvable, active)
+            )
+            B = len(items)
+
+    output[active] = sequences[:, 0]
+    output_lengths[active] = lengths[:, 0]
+    return output[:, :int(output_lengths.max())]
@@ -0,0 +1,94 @@
+"""
+Parity tests for backends.py: a tiny randomly initialised ViTT5 must get the
+same token ids from the KV-cached search backends as from eager generate.
+check_backend_parity.py does the same with the real checkpoint.
+
+    python -m unittest test_backends
+"""
+import importlib.util
+import shutil
+import tempfile
+import types
+import unittest
+import warnings
+
+import torch
+from transformers import T5Config, T5ForConditionalGeneration, ViTConfig, ViTModel
+
+from backends import OnnxBackend, TorchBackend, TorchSearchBackend
+from model import ViTT5, configure_decoder
+
+PAD, EOS = 0, 1
+MAX_LENGTH = 12
+NUM_BEAMS = (1, 2, 4)
+
+
+def tiny_model():
+    """A two-layer ViTT5 whose images finish at different steps under every beam count."""
+    torch.manual_seed(4)
+    vit = ViTModel(ViTConfig(
+        hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=37,
+        image_size=32, patch_size=8,
+    ), add_pooling_layer=False)
+    t5 = T5ForConditionalGeneration(T5Config(
+        vocab_size=40, d_model=16, d_kv=8, d_ff=32, num_layers=2, num_heads=2,
+    ))
+    model = ViTT5(vit, t5).eval()
+    configure_decoder(model, types.SimpleNamespace(pad_token_id=PAD, eos_token_id=EOS))
+    with torch.no_grad():
+        # Random weights rarely pick EOS; make it a close call so sequence lengths vary
+        t5.lm_head.weight[EOS] *= 3
+    return model
+
+
+def eos_steps(output_ids):
+    """Step at which each row emitted EOS, or None if it ran to max_length."""
+    steps = []
+    for row in output_ids:
+        hits = (row == EOS).nonzero()
+        steps.append(hits[0].item() if len(hits) else None)
+    return steps
+
+
+class BackendParityTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = tiny_model()
+        cls.pixel_values = torch.randn(6, 3, 32, 32, generator=torch.Generator().manual_seed(0)) * 3
+        cls.expected = {
+            num_beams: TorchBackend(cls.model).generate(cls.pixel_values, num_beams=num_beams, max_length=MAX_LENGTH)
+            for num_beams in NUM_BEAMS
+        }
+
+    def assert_matches_generate(self, backend):
+        for num_beams in NUM_BEAMS:
+            with self.subTest(num_beams=num_beams):
+                expected = self.expected[num_beams]
+                actual = backend.generate(self.pixel_values, num_beams=num_beams, max_length=MAX_LENGTH)
+                self.assertEqual(actual.shape, expected.shape)
+                self.assertEqual(actual.tolist(), expected.tolist())
+
+    def test_batches_finish_at_mixed_lengths(self):
+        # Guards the other tests: finished images must be dropped mid-batch
+        for num_beams, expected in self.expected.items():
+            with self.subTest(num_beams=num_beams):
+                self.assertGreaterEqual(len(set(eos_steps(expected))), 2)
+
+    def test_torch_search_matches_generate(self):
+        self.assert_matches_generate(TorchSearchBackend(self.model))
+
+    @unittest.skipUnless(importlib.util.find_spec("onnxruntime"), "onnxruntime is not installed")
+    def test_onnx_matches_generate(self):
+        from export_model import export
+
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # tracer warnings
+            export(self.model, types.SimpleNamespace(save_pretrained=lambda path: None), export_dir)
+        self.assert_matches_generate(OnnxBackend(export_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
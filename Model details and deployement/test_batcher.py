@@ -0,0 +1,89 @@
+"""
+Tests for batcher.py with a stub caption function.
+
+    python -m unittest test_batcher
+"""
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from batcher import CaptionBatcher
+
+
+class CaptionBatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.pool.shutdown)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.batches = []
+
+    def caption_fn(self, pixel_values, key):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.batches.append((key, pixel_values.shape[0]))
+        time.sleep(0.2)
+        with self.lock:
+            self.running -= 1
+        return [f"{key}:{int(value)}" for value in pixel_values[:, 0, 0, 0]]
+
+    def run_requests(self, requests, **kwargs):
+        async def main():
+            batcher = CaptionBatcher(self.caption_fn, executor=self.pool, **kwargs)
+            await batcher.start()
+            try:
+                return await asyncio.gather(*(
+                    batcher.submit(torch.full((3, 2, 2), float(i)), key) for i, key in requests
+                ))
+            finally:
+                await batcher.stop()
+        return asyncio.run(main())
+
+    def test_batches_overlap_up_to_max_in_flight(self):
+        start = time.monotonic()
+        captions = self.run_requests([(0, "a"), (1, "b"), (2, "c")], max_wait_ms=0, max_in_flight=2)
+        self.assertEqual(captions, ["a:0", "b:1", "c:2"])
+        self.assertEqual(self.max_running, 2)
+        # Two rounds of 0.2 s instead of three
+        self.assertLess(time.monotonic() - start, 0.55)
+
+    def test_one_batch_at_a_time_by_default(self):
+        self.run_requests([(0, "a"), (1, "b")], max_wait_ms=0)
+        self.assertEqual(self.max_running, 1)
+
+    def test_requests_coalesce_while_slots_are_busy(self):
+        async def main():
+            batcher = CaptionBatcher(self.caption_fn, executor=self.pool, max_wait_ms=0, max_in_flight=1)
+            await batcher.start()
+            try:
+                first = asyncio.ensure_future(batcher.submit(torch.zeros(3, 2, 2), "a"))
+                await asyncio.sleep(0.05)
+                # The slot is busy with the first batch; these wait and go out together
+                rest = [batcher.submit(torch.full((3, 2, 2), float(i)), "a") for i in (1, 2, 3)]
+                return await asyncio.gather(first, *rest)
+            finally:
+                await batcher.stop()
+        self.assertEqual(asyncio.run(main()), ["a:0", "a:1", "a:2", "a:3"])
+        self.assertEqual(self.batches, [("a", 1), ("a", 3)])
+
+    def test_stop_fails_queued_requests(self):
+        async def main():
+            batcher = CaptionBatcher(self.caption_fn, executor=self.pool, max_wait_ms=1000, max_in_flight=1)
+            await batcher.start()
+            pending = asyncio.ensure_future(batcher.submit(torch.zeros(3, 2, 2), "a"))
+            await asyncio.sleep(0.05)
+            await batcher.stop()
+            with self.assertRaisesRegex(RuntimeError, "stopped"):
+                await pending
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
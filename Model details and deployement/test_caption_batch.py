@@ -0,0 +1,44 @@
+"""
+Tests for the resume helpers of caption_batch.py.
+
+    python -m unittest test_caption_batch
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+from caption_batch import completed_paths, skip_completed, walk_directory
+
+
+class ResumeTests(unittest.TestCase):
+
+    def test_completed_paths_counts_each_record(self):
+        records = [{"path": "a.jpg", "caption": "x"}, {"path": "b.jpg", "error": "bad"}, {"path": "a.jpg", "caption": "y"}]
+        output = io.BytesIO("".join(json.dumps(record) + "\n" for record in records).encode())
+        output.seek(0, os.SEEK_END)
+        self.assertEqual(completed_paths(output), {"a.jpg": 2, "b.jpg": 1})
+
+    def test_skips_by_path_when_the_inputs_change(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ("b.jpg", "c.jpg", "d.jpg"):
+            open(os.path.join(directory, name), "wb").close()
+        done = {os.path.join(directory, "b.jpg"): 1, os.path.join(directory, "c.jpg"): 1}
+        # a.jpg was added in front of the completed files since the first run
+        open(os.path.join(directory, "a.jpg"), "wb").close()
+
+        remaining = [item["path"] for item in skip_completed(walk_directory(directory), Counter(done))]
+        self.assertEqual(remaining, [os.path.join(directory, name) for name in ("a.jpg", "d.jpg")])
+
+    def test_repeated_paths_skip_one_input_per_record(self):
+        items = [{"path": "a.jpg", "id": "1"}, {"path": "a.jpg", "id": "2"}, {"path": "b.jpg"}]
+        remaining = list(skip_completed(iter(items), Counter({"a.jpg": 1})))
+        self.assertEqual(remaining, items[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
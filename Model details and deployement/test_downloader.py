@@ -0,0 +1,146 @@
+"""
+Tests for downloader.py against a local range-serving HTTP server.
+
+    python -m unittest test_downloader
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from downloader import DownloadError, download_file
+
+DATA = os.urandom(10000)
+PART_SIZE = 1000
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves DATA at any path. Range requests get 206 unless server.ignore_ranges;
+    a range starting at one of server.short_parts gets only half its bytes.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.server.heads += 1
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(DATA)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        with self.server.lock:
+            self.server.gets.append(match.group(0) if match else None)
+        if match is None or self.server.ignore_ranges:
+            self.send_response(200)
+            body = DATA
+        else:
+            start, end = int(match.group(1)), int(match.group(2))
+            body = DATA[start:end + 1]
+            if start in self.server.short_parts:
+                body = body[:len(body) // 2]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client closed a 200 reply to a range request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.heads = 0
+        self.server.gets = []
+        self.server.ignore_ranges = False
+        self.server.short_parts = set()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/model.bin"
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "model.bin")
+        self.sha256 = hashlib.sha256(DATA).hexdigest()
+
+    def download(self, **kwargs):
+        kwargs = dict({"sha256": self.sha256, "part_size": PART_SIZE, "retries": 0}, **kwargs)
+        return download_file(self.url, self.path, **kwargs)
+
+    def assert_downloaded(self):
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertFalse(os.path.exists(self.path + ".part.json"))
+
+    def test_downloads_in_parts(self):
+        self.assertEqual(self.download(), self.path)
+        self.assert_downloaded()
+        self.assertEqual(len(self.server.gets), len(DATA) // PART_SIZE)
+
+    def test_resumes_after_a_partial_part(self):
+        self.server.short_parts = {3000}
+        with self.assertRaisesRegex(DownloadError, "incomplete"):
+            self.download()
+        self.assertFalse(os.path.exists(self.path))
+
+        self.server.short_parts = set()
+        self.server.gets = []
+        self.download()
+        self.assert_downloaded()
+        # Only the part that came back short is fetched again
+        self.assertEqual(self.server.gets, ["bytes=3000-3999"])
+
+    def test_falls_back_to_one_stream_when_ranges_are_ignored(self):
+        self.server.ignore_ranges = True
+        start = time.monotonic()
+        self.download(retries=3, workers=1)
+        self.assert_downloaded()
+        # No retries (and their backoff) are spent on the 200 reply
+        self.assertLess(time.monotonic() - start, 1)
+        ranges, whole = self.server.gets[:-1], self.server.gets[-1]
+        self.assertIsNone(whole)
+        self.assertEqual(len(ranges), len(set(ranges)))
+        # The remaining parts are cancelled; at most the next one had already started
+        self.assertLessEqual(len(ranges), 2)
+
+    def test_sha256_mismatch(self):
+        with self.assertRaisesRegex(DownloadError, "SHA-256 mismatch"):
+            self.download(sha256="0" * 64)
+        for leftover in (self.path, self.path + ".part", self.path + ".part.json"):
+            self.assertFalse(os.path.exists(leftover))
+
+    def test_lock_file_shares_one_download(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.download())) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [self.path] * 3)
+        self.assert_downloaded()
+        self.assertTrue(os.path.exists(self.path + ".lock"))
+        # The first caller downloads; the others wait on the lock and find the file
+        self.assertEqual(self.server.heads, 1)
+        self.assertEqual(len(self.server.gets), len(DATA) // PART_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
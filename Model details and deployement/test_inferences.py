@@ -1,7 +1,6 @@
 import torch
-from PIL import Image
-import torchvision.transforms as transforms
 from model import load_model  # Import the load_model function from your model.py
+from preprocessing import load_image_tensor  # Same preprocessing as the API
 
 # Set device (GPU if available)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -12,18 +11,11 @@ checkpoint_path = "checkpoint.pth"
 # Load the model and tokenizer using the helper function
 model, tokenizer = load_model(checkpoint_path, device)
 
-# Define the image transformation (should match what was used during training)
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-])
-
 # Specify the path to an example image (update this to a valid image file path on your system)
 image_path = "/home/rishabh/coding/minor_project/for deployment/image-captionator/GJwtW4JGdR4.jpg"
 # Open and preprocess the image
-image = Image.open(image_path).convert("RGB")
-image_tensor = transform(image).unsqueeze(0).to(device)
+with open(image_path, "rb") as f:
+    image_tensor = load_image_tensor(f.read()).unsqueeze(0).to(device)
 
 # Use the model's generate function to produce a caption
 output_ids = model.generate(pixel_values=image_tensor, max_length=30, num_beams=4)
@@ -0,0 +1,96 @@
+"""
+Sharing model weights across forked server workers, and measuring the result.
+
+With gunicorn's preload (see gunicorn.conf.py) the master imports app.py and
+loads ViTT5 once before forking the workers. share_model_weights moves the
+parameter and buffer storages into shared memory first, so they stay shared
+even if something later writes to a page that copy-on-write would duplicate.
+
+    python worker_memory.py --pid <gunicorn master pid>
+
+prints RSS / PSS / shared / private memory for the master and each worker.
+PSS splits shared pages between the processes mapping them, so the PSS total
+is the real footprint; with shared weights it grows far slower than RSS.
+"""
+import argparse
+import os
+
+MB = 1024 * 1024
+
+
+def share_model_weights(model):
+    """
+    Move every CPU parameter and buffer storage of `model` into shared memory.
+    Returns the number of bytes now shared. Packed INT8 weights of a quantized
+    model are not tensors and stay in ordinary (copy-on-write) memory.
+    """
+    shared = 0
+    seen = set()
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        if tensor.device.type != "cpu" or tensor.is_meta:
+            continue
+        # A no-op for storages already shared, e.g. tied embedding weights
+        tensor.share_memory_()
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in seen:
+            seen.add(storage.data_ptr())
+            shared += storage.nbytes()
+    return shared
+
+
+def process_memory(pid="self"):
+    """Memory of one process in MB, from /proc/<pid>/smaps_rollup (Linux)."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "pid": os.getpid() if pid == "self" else int(pid),
+        "rss_mb": round(fields.get("Rss", 0) / MB, 1),
+        "pss_mb": round(fields.get("Pss", 0) / MB, 1),
+        "shared_mb": round((fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / MB, 1),
+        "private_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / MB, 1),
+    }
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the parent pid follows its closing ")"
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pid", type=int, required=True, help="gunicorn master process id")
+    args = parser.parse_args()
+
+    rows = [("master", process_memory(args.pid))]
+    rows += [("worker", process_memory(pid)) for pid in child_pids(args.pid)]
+    rows = [(role, memory) for role, memory in rows if memory is not None]
+
+    print(f"{'role':<8}{'pid':>8}{'rss MB':>10}{'pss MB':>10}{'shared MB':>11}{'private MB':>12}")
+    for role, memory in rows:
+        print(f"{role:<8}{memory['pid']:>8}{memory['rss_mb']:>10}{memory['pss_mb']:>10}"
+              f"{memory['shared_mb']:>11}{memory['private_mb']:>12}")
+    total_rss = sum(memory["rss_mb"] for _, memory in rows)
+    total_pss = sum(memory["pss_mb"] for _, memory in rows)
+    print(f"total: rss {total_rss:.1f} MB, pss {total_pss:.1f} MB across {len(rows)} processes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,23 @@
 from django.contrib import admin
-from .models import RatedCaption
+from .models import CaptionJob, RatedCaption
 
 @admin.register(RatedCaption)
 class RatedCaptionAdmin(admin.ModelAdmin):
     list_display = ('user', 'rating', 'created_at')
     list_filter = ('rating', 'created_at', 'tone')
     search_fields = ('user__email', 'generated_caption', 'custom_instruction')
-    readonly_fields = ('created_at',)
-    
-    def get_readonly_fields(self, request, obj=None):
-        # Make image display-only to prevent accidental editing of large base64 strings
-        if obj:
-            return self.readonly_fields + ('image',)
-        return self.readonly_fields
+    readonly_fields = ('created_at', 'image_sha256', 'thumbnail_sha256')
         
     def has_add_permission(self, request):
         # Ratings should only be created through the frontend
         return False
 
+@admin.register(CaptionJob)
+class CaptionJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('id', 'image_hash', 'user__email')
+    exclude = ('image',)
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
 # Register your models here.
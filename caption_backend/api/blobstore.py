@@ -0,0 +1,151 @@
+# api/blobstore.py
+"""
+Content-addressed storage for uploaded images.
+
+A blob is stored once under the SHA-256 of its bytes, so the same image rated
+many times takes the space of one. The backend is chosen by the
+BLOB_STORE_BACKEND setting (a dotted class path, constructed with
+BLOB_STORE_OPTIONS); FileSystemBlobStore is the default. Other backends (S3,
+GCS, ...) only need to implement the BlobStore methods.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from PIL import Image
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+# Magic bytes of the image formats browsers upload
+CONTENT_TYPES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobStore:
+    """Interface of a blob store backend; blobs are addressed by their SHA-256 hex digest."""
+
+    def put(self, data: bytes) -> str:
+        """Store `data` unless a blob with the same digest exists; return the digest."""
+        raise NotImplementedError
+
+    def open(self, digest: str):
+        """Binary file object for reading the blob; raises BlobNotFound."""
+        raise NotImplementedError
+
+    def exists(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, digest: str):
+        raise NotImplementedError
+
+
+class FileSystemBlobStore(BlobStore):
+    """Blobs as files under `root`, fanned out by digest prefix: root/ab/cd/abcd...."""
+
+    def __init__(self, root):
+        self.root = str(root)
+
+    def path(self, digest: str) -> str:
+        if not DIGEST_RE.match(digest):
+            raise BlobNotFound(digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write under a temporary name and rename, so a reader never sees a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def open(self, digest: str):
+        try:
+            return open(self.path(digest), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(digest)
+
+    def exists(self, digest: str) -> bool:
+        try:
+            return os.path.exists(self.path(digest))
+        except BlobNotFound:
+            return False
+
+    def delete(self, digest: str):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+@lru_cache(maxsize=None)
+def get_blob_store() -> BlobStore:
+    return import_string(settings.BLOB_STORE_BACKEND)(**settings.BLOB_STORE_OPTIONS)
+
+
+def sniff_content_type(head: bytes) -> str:
+    for magic, content_type in CONTENT_TYPES:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def decode_image_data(value: str) -> bytes:
+    """Bytes of an image given as a data URL ("data:image/png;base64,...") or bare base64."""
+    if value.startswith("data:"):
+        value = value.split(",", 1)[-1]
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Image is not valid base64 data.")
+
+
+def make_thumbnail(data: bytes) -> bytes:
+    """JPEG no larger than THUMBNAIL_SIZE on either side."""
+    with Image.open(io.BytesIO(data)) as image:
+        # Let the JPEG decoder downscale while decoding instead of decoding full size
+        image.draft("RGB", (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+        image = image.convert("RGB")
+        image.thumbnail((settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=80, optimize=True)
+    return output.getvalue()
+
+
+def store_image(data: bytes):
+    """Store an image and its thumbnail; returns (image digest, thumbnail digest)."""
+    store = get_blob_store()
+    digest = store.put(data)
+    try:
+        thumbnail = store.put(make_thumbnail(data))
+    except Exception as e:
+        # Not an image Pillow can read; list views fall back to the full image
+        print(f"Could not make a thumbnail for blob {digest}: {e}")
+        thumbnail = digest
+    return digest, thumbnail
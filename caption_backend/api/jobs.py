@@ -0,0 +1,330 @@
+# api/jobs.py
+"""
+Asynchronous caption jobs, queued in the CaptionJob table.
+
+caption-jobs/ stores the upload and returns at once; a worker then
+captions the image (and refines the caption), records the result on the job
+and, if one was given, POSTs it to the job's webhook. Workers are threads of
+the web process (JOB_WORKERS, started when a job is submitted) and/or
+`python manage.py run_caption_jobs` processes. All of them claim jobs with a
+conditional UPDATE, so any number of replicas can share the table safely.
+
+A failed attempt puts the job back in the queue, claimable again after an
+exponential backoff (JOB_RETRY_DELAY, doubling per attempt). Worker threads
+keep polling while jobs wait out their backoff or run elsewhere, so retries
+and jobs left running by a crashed worker are picked up without a new submission.
+
+Webhooks are only taken from logged-in users, and their URL is checked when
+the job is submitted and again before every delivery: it must resolve to
+public addresses only (no loopback, private or link-local hosts such as cloud
+metadata endpoints), or, when JOB_WEBHOOK_ALLOWED_HOSTS is set, name one of
+those hosts. The delivery then connects to an address that was checked,
+rather than resolving the host name again.
+"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import threading
+from datetime import timedelta
+from urllib.parse import urlsplit, urlunsplit
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Min, Q
+from requests.adapters import HTTPAdapter
+from django.utils import timezone
+
+from .models import CaptionJob
+from .serializers import CaptionJobSerializer
+from .services import (
+    PooledHTTPClient, caption_with_hf_api, get_cached_caption, http_client, is_refinable_caption, refine_caption_with_groq,
+)
+
+# Job threads per web process; 0 leaves all jobs to run_caption_jobs workers
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# A running job not finished after this many seconds is assumed lost with its worker and claimed again
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", 600))
+# Seconds before a failed job may be claimed again, doubling per attempt up to JOB_RETRY_DELAY_MAX
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 10))
+JOB_RETRY_DELAY_MAX = float(os.getenv("JOB_RETRY_DELAY_MAX", 600))
+# Longest a web process worker thread sleeps between looks at the queue while jobs are pending
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 5))
+JOB_MAX_IMAGE_BYTES = int(os.getenv("JOB_MAX_IMAGE_BYTES", 10 * 1024 * 1024))
+# When set, webhooks carry an X-Caption-Signature: sha256=<HMAC of the body>
+JOB_WEBHOOK_SECRET = os.getenv("JOB_WEBHOOK_SECRET", "")
+JOB_WEBHOOK_TIMEOUT = 10
+# Comma-separated hostnames webhooks may be sent to; when set, only these are
+# allowed (and they may be internal), otherwise any host with public addresses
+JOB_WEBHOOK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+
+
+class JobError(Exception):
+    pass
+
+
+class WebhookURLError(ValueError):
+    pass
+
+
+def check_webhook_url(url: str):
+    """
+    Raise WebhookURLError unless `url` is an http(s) URL webhooks may be sent to.
+    Returns the checked addresses of its host, or None for an allowed host.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise WebhookURLError("webhook_url must be an http(s) URL.")
+    host = parts.hostname.lower()
+    if JOB_WEBHOOK_ALLOWED_HOSTS:
+        if host not in JOB_WEBHOOK_ALLOWED_HOSTS:
+            raise WebhookURLError(f"webhook_url host {host} is not allowed.")
+        return None
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, ValueError):
+        raise WebhookURLError(f"webhook_url host {host} cannot be resolved.")
+    for address in addresses:
+        # Drop an IPv6 zone ("fe80::1%eth0")
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise WebhookURLError(f"webhook_url host {host} is not a public address.")
+    return sorted(addresses)
+
+
+class PinnedAddressAdapter(HTTPAdapter):
+    """
+    Connects to `address` instead of resolving the URL's host again, so DNS
+    cannot change between the check and the request. The host name is still
+    sent as Host and in TLS SNI, and the certificate is checked against it.
+    """
+
+    def __init__(self, url, address, **kwargs):
+        self.parts = urlsplit(url)
+        self.address = address
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.parts.scheme == "https":
+            kwargs.update(server_hostname=self.parts.hostname, assert_hostname=self.parts.hostname)
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        if parts.hostname != self.parts.hostname:
+            raise WebhookURLError(f"Refusing to send to {parts.hostname} through an address pinned for {self.parts.hostname}.")
+        request.headers["Host"] = parts.netloc.rsplit("@", 1)[-1]
+        address = f"[{self.address}]" if ":" in self.address else self.address
+        request.url = urlunsplit(parts._replace(netloc=address + (f":{parts.port}" if parts.port else "")))
+        return super().send(request, **kwargs)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def claim_job(worker: str):
+    """
+    Claim the oldest queued (or stale running) job for `worker`, or return None.
+    The UPDATE only matches while the job still has the status and attempt count
+    read here, so exactly one worker wins each job.
+    """
+    now = timezone.now()
+    candidates = (
+        CaptionJob.objects.filter(
+            Q(status=CaptionJob.QUEUED, available_at__lte=now)
+            | Q(status=CaptionJob.RUNNING, started_at__lt=now - timedelta(seconds=JOB_STALE_AFTER))
+        )
+        .order_by("created_at")
+        .values_list("id", "status", "attempts")[:10]
+    )
+    for job_id, status, attempts in candidates:
+        claimed = CaptionJob.objects.filter(id=job_id, status=status, attempts=attempts).update(
+            status=CaptionJob.RUNNING, worker=worker, started_at=now, attempts=attempts + 1
+        )
+        if claimed:
+            return CaptionJob.objects.get(id=job_id)
+    return None
+
+
+def seconds_until_next_job():
+    """
+    Seconds until a queued job is due or a running one goes stale (0 if one
+    already is); None when no job is queued or running.
+    """
+    queued = CaptionJob.objects.filter(status=CaptionJob.QUEUED).aggregate(due=Min("available_at"))["due"]
+    running = CaptionJob.objects.filter(status=CaptionJob.RUNNING).aggregate(started=Min("started_at"))["started"]
+    times = [queued] if queued else []
+    if running:
+        times.append(running + timedelta(seconds=JOB_STALE_AFTER))
+    if not times:
+        return None
+    return max(0.0, (min(times) - timezone.now()).total_seconds())
+
+
+def retry_delay(attempts: int) -> float:
+    return min(JOB_RETRY_DELAY_MAX, JOB_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _finish(job, **fields):
+    """Record the outcome, unless the job was meanwhile reclaimed; returns whether it was recorded."""
+    fields.update(finished_at=timezone.now(), image=b"")
+    updated = CaptionJob.objects.filter(id=job.id, worker=job.worker, attempts=job.attempts).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return bool(updated)
+
+
+def _caption(job) -> str:
+    caption = get_cached_caption(job.image_hash)
+    if caption is None:
+        caption = caption_with_hf_api(ContentFile(bytes(job.image), name=job.image_name), image_hash=job.image_hash)
+    # caption_with_hf_api reports failures as text rather than raising
+    if not is_refinable_caption(caption) or caption.startswith("Error "):
+        raise JobError(caption)
+    return caption
+
+
+def process_job(job):
+    try:
+        if job.attempts > JOB_MAX_ATTEMPTS:
+            raise JobError("Job abandoned by its worker too many times")
+        caption = _caption(job)
+        refined = refine_caption_with_groq(caption, job.tone, job.additional_info) if job.refine else None
+    except Exception as e:
+        print(f"Caption job {job.id} attempt {job.attempts} failed: {e}")
+        if job.attempts < JOB_MAX_ATTEMPTS:
+            # Back in the queue for another attempt by any worker, once the backoff has passed
+            available_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            CaptionJob.objects.filter(id=job.id, worker=job.worker, attempts=job.attempts).update(
+                status=CaptionJob.QUEUED, error=str(e), available_at=available_at
+            )
+            return
+        recorded = _finish(job, status=CaptionJob.FAILED, error=str(e))
+    else:
+        recorded = _finish(job, status=CaptionJob.SUCCEEDED, caption=caption, refined_caption=refined, error=None)
+    if recorded and job.webhook_url:
+        deliver_webhook(job)
+
+
+def deliver_webhook(job):
+    # Checked again here: DNS may have changed since the job was submitted
+    try:
+        addresses = check_webhook_url(job.webhook_url)
+    except WebhookURLError as e:
+        print(f"Webhook for caption job {job.id} refused: {e}")
+        status = f"refused: {e}"[:100]
+        CaptionJob.objects.filter(id=job.id).update(webhook_status=status)
+        job.webhook_status = status
+        return
+    body = json.dumps(CaptionJobSerializer(job).data).encode()
+    headers = {"Content-Type": "application/json"}
+    if JOB_WEBHOOK_SECRET:
+        signature = hmac.new(JOB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        headers["X-Caption-Signature"] = f"sha256={signature}"
+    client = http_client
+    if addresses:
+        client = PooledHTTPClient(pool_size=1, adapter=PinnedAddressAdapter(job.webhook_url, addresses[0]))
+        # Proxies from the environment would resolve the host themselves
+        client.session.trust_env = False
+    try:
+        # The client retries connection errors, 429 and 5xx
+        # No redirects: they could lead to a host that was never checked
+        response = client.post(
+            job.webhook_url, data=body, headers=headers, timeout=JOB_WEBHOOK_TIMEOUT, allow_redirects=False
+        )
+        status = str(response.status_code)
+    except Exception as e:
+        print(f"Webhook for caption job {job.id} failed: {e}")
+        status = f"error: {e}"[:100]
+    finally:
+        if client is not http_client:
+            client.session.close()
+    CaptionJob.objects.filter(id=job.id).update(webhook_status=status)
+    job.webhook_status = status
+
+
+def run_next_job(worker: str = None) -> bool:
+    """Claim and process one job; False when the queue is empty."""
+    job = claim_job(worker or worker_name())
+    if job is None:
+        return False
+    process_job(job)
+    return True
+
+
+class JobRunner:
+    """
+    Pool of up to `workers` threads in this process that drain the queue.
+    kick() is called when a job is submitted. While jobs wait out a retry
+    backoff or run (possibly on a dead worker), threads sleep until the next
+    is due, at most `poll_interval` seconds; a thread exits once no job is
+    queued or running and no kick arrived meanwhile.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._active = 0
+        self._kicked = False
+
+    def kick(self):
+        with self._lock:
+            self._kicked = True
+            self._wake.notify_all()
+            if self._active >= self.workers:
+                return
+            self._active += 1
+        threading.Thread(target=self._drain, name=f"caption-job-{self._active}", daemon=True).start()
+
+    def _drain(self):
+        try:
+            while True:
+                with self._lock:
+                    self._kicked = False
+                try:
+                    ran = run_next_job()
+                    wait = None if ran else seconds_until_next_job()
+                except Exception as e:
+                    print(f"Caption job worker error: {e}")
+                    ran, wait = False, self.poll_interval
+                close_old_connections()
+                if ran:
+                    continue
+                with self._lock:
+                    if self._kicked:
+                        continue
+                    if wait is None:
+                        self._active -= 1
+                        return
+                    self._wake.wait(min(wait, self.poll_interval))
+        finally:
+            connection.close()
+
+
+job_runner = JobRunner()
+
+
+def submit_job(file_obj, image_hash: str, user=None, refine=True, tone=None, additional_info=None, webhook_url=None):
+    """Queue a caption job for an uploaded file and wake a local worker."""
+    job = CaptionJob.objects.create(
+        user=user,
+        image=b"".join(file_obj.chunks()),
+        image_name=os.path.basename(file_obj.name or "image.jpg")[:255],
+        image_hash=image_hash,
+        refine=refine,
+        tone=tone,
+        additional_info=additional_info,
+        webhook_url=webhook_url or None,
+    )
+    # Only once the row is visible to the worker threads' own connections
+    transaction.on_commit(job_runner.kick)
+    return job
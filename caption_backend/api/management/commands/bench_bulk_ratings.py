@@ -0,0 +1,82 @@
+"""
+Throughput of rating ingestion: one captions/rate/ request per rating versus
+captions/rate/bulk/ batches, as JSON and as NDJSON.
+
+    python manage.py bench_bulk_ratings --rows 10000 --single-rows 1000
+
+Requests go through the full Django/DRF stack (test client) against the
+configured database, as a throwaway user that is deleted afterwards together
+with its ratings. The per-rating path is timed on --single-rows rows only.
+"""
+import base64
+import io
+import json
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.models import RatedCaption
+
+
+def sample_image():
+    output = io.BytesIO()
+    Image.new("RGB", (64, 48), (120, 160, 200)).save(output, "JPEG")
+    return "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+class Command(BaseCommand):
+    help = "Benchmark single vs bulk rating ingestion"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--single-rows", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=10000, help="ratings per bulk request")
+
+    def handle(self, *args, **options):
+        image = sample_image()
+        ratings = [
+            {"image": image, "generated_caption": f"a photo number {i}", "rating": i % 5 + 1, "tone": "casual",
+             "hashtags": "#bench", "refined_caption": f"A refined caption for photo number {i}"}
+            for i in range(options["rows"])
+        ]
+        user = get_user_model().objects.create_user(
+            username=f"bench-{uuid.uuid4().hex[:12]}", email=f"bench-{uuid.uuid4().hex[:12]}@example.invalid"
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            self.stdout.write(f"{'path':<16}{'rows':>8}{'seconds':>10}{'rows/s':>10}")
+
+            rows = ratings[:options["single_rows"]]
+            start = time.perf_counter()
+            for rating in rows:
+                response = client.post("/api/captions/rate/", rating, format="json")
+                assert response.status_code == 201, response.content
+            self.report("single", len(rows), time.perf_counter() - start)
+
+            batches = [ratings[i:i + options["batch_size"]] for i in range(0, len(ratings), options["batch_size"])]
+            start = time.perf_counter()
+            for batch in batches:
+                response = client.post("/api/captions/rate/bulk/", batch, format="json")
+                assert response.status_code == 201, response.content
+            self.report("bulk json", len(ratings), time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for batch in batches:
+                body = "\n".join(json.dumps(rating) for rating in batch)
+                response = client.post("/api/captions/rate/bulk/", body, content_type="application/x-ndjson")
+                assert response.status_code == 201, response.content
+            self.report("bulk ndjson", len(ratings), time.perf_counter() - start)
+
+            expected = len(rows) + 2 * len(ratings)
+            stored = RatedCaption.objects.filter(user=user).count()
+            self.stdout.write(f"{stored} of {expected} ratings stored")
+        finally:
+            user.delete()
+
+    def report(self, label, rows, seconds):
+        self.stdout.write(f"{label:<16}{rows:>8}{seconds:>10.2f}{rows / seconds:>10.0f}")
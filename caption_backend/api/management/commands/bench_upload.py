@@ -0,0 +1,125 @@
+"""
+Compare the old temp-file upload path of generate_caption with the streaming one.
+
+    python manage.py bench_upload --requests 50 --sizes-kb 200 2000 8000
+
+Both paths post to a local stand-in for the caption Space, so only the Django
+side is measured: per-request latency and the bytes this process read from and
+wrote to storage (/proc/self/io, Linux).
+"""
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+
+from api import services
+
+
+class StubSpace(BaseHTTPRequestHandler):
+    """Reads the whole upload and answers like the caption Space."""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 1024 * 1024)))
+        body = json.dumps({"caption": "a stub caption"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def storage_io():
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["read_bytes"]), int(fields["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def make_upload(data, name="image.jpg"):
+    """Build the uploaded file object Django's upload handlers would produce."""
+    if len(data) <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        return InMemoryUploadedFile(BytesIO(data), "file", name, "image/jpeg", len(data), None)
+    upload = TemporaryUploadedFile(name, "image/jpeg", len(data), None)
+    upload.write(data)
+    upload.flush()
+    return upload
+
+
+def legacy_caption(file_obj):
+    """The previous view: copy the upload to <tempdir>/<name>, reopen it and post it."""
+    temp_path = os.path.join(tempfile.gettempdir(), file_obj.name)
+    try:
+        with open(temp_path, "wb") as temp_file:
+            for chunk in file_obj.chunks():
+                temp_file.write(chunk)
+            # Force the copy to storage, as it eventually would be
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        with open(temp_path, "rb") as img_file:
+            response = requests.post(services.HF_API_URL, files={"file": img_file}, timeout=services.HF_TIMEOUT)
+        return response.json()["caption"]
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def streaming_caption(file_obj):
+    return services.caption_with_hf_api(file_obj)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the temp-file vs streaming upload path of generate_caption"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=30)
+        parser.add_argument("--sizes-kb", type=int, nargs="+", default=[200, 2000, 8000])
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubSpace)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        services.HF_API_URL = f"http://127.0.0.1:{server.server_port}/generate_caption/"
+
+        self.stdout.write(f"{'size KB':>8} {'path':<10}{'mean ms':>9}{'p95 ms':>9}{'disk read KB':>14}{'disk write KB':>15}")
+        try:
+            for size_kb in options["sizes_kb"]:
+                data = os.urandom(size_kb * 1024)
+                for label, caption in (("temp-file", legacy_caption), ("streaming", streaming_caption)):
+                    self.run(label, caption, data, options["requests"])
+        finally:
+            server.shutdown()
+
+    def run(self, label, caption, data, count):
+        latencies = []
+        read_total = write_total = 0
+        for _ in range(count):
+            upload = make_upload(data)
+            read_before, write_before = storage_io()
+            start = time.perf_counter()
+            caption(upload)
+            latencies.append((time.perf_counter() - start) * 1000)
+            read_after, write_after = storage_io()
+            read_total += read_after - read_before
+            write_total += write_after - write_before
+            upload.close()
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{len(data) // 1024:>8} {label:<10}{statistics.mean(latencies):>9.2f}{p95:>9.2f}"
+            f"{read_total / count / 1024:>14.1f}{write_total / count / 1024:>15.1f}"
+        )
@@ -0,0 +1,64 @@
+"""
+Dedicated caption job worker.
+
+    python manage.py run_caption_jobs --workers 4
+
+Polls the CaptionJob table and processes jobs on `--workers` threads until
+interrupted; with --once it exits as soon as the queue is empty. Run it next
+to (or instead of, with JOB_WORKERS=0) the web process threads, on as many
+hosts as needed: jobs are claimed atomically, and jobs left running by a
+crashed worker are claimed again after JOB_STALE_AFTER seconds.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from api.jobs import run_next_job
+
+
+class Command(BaseCommand):
+    help = "Process queued caption jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        counts = [0] * options["workers"]
+
+        def work(index):
+            try:
+                while not stop.is_set():
+                    try:
+                        ran = run_next_job()
+                    except Exception as e:
+                        self.stderr.write(f"Caption job worker error: {e}")
+                        ran = False
+                    close_old_connections()
+                    if ran:
+                        counts[index] += 1
+                    elif options["once"]:
+                        return
+                    else:
+                        stop.wait(options["poll_interval"])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(i,), name=f"caption-job-{i}") for i in range(options["workers"])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the jobs in progress")
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(f"Processed {sum(counts)} jobs in {time.perf_counter() - start:.1f}s")
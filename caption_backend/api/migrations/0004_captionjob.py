@@ -0,0 +1,45 @@
+# Generated by Django 5.1.15 on 2026-10-18 01:57
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_remove_ratedcaption_generated_hashtags_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaptionJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('image', models.BinaryField(blank=True)),
+                ('image_name', models.CharField(default='image.jpg', max_length=255)),
+                ('image_hash', models.CharField(max_length=64)),
+                ('refine', models.BooleanField(default=True)),
+                ('tone', models.CharField(blank=True, max_length=50, null=True)),
+                ('additional_info', models.TextField(blank=True, null=True)),
+                ('caption', models.TextField(blank=True, null=True)),
+                ('refined_caption', models.TextField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('worker', models.CharField(blank=True, max_length=255, null=True)),
+                ('webhook_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('webhook_status', models.CharField(blank=True, max_length=100, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='caption_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='api_caption_status_fe162c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+import base64
+
+from django.db import migrations, models
+
+from api.blobstore import decode_image_data, get_blob_store, sniff_content_type, store_image
+
+
+def move_images_to_blob_store(apps, schema_editor):
+    RatedCaption = apps.get_model('api', 'RatedCaption')
+    batch = []
+    for rated in RatedCaption.objects.only('id', 'image').iterator(chunk_size=200):
+        try:
+            data = decode_image_data(rated.image)
+        except ValueError as e:
+            # Kept verbatim as an opaque blob, so dropping the column loses nothing
+            print(f"RatedCaption {rated.id}: image is not base64 ({e}), stored as is")
+            data = rated.image.encode()
+        rated.image_sha256, rated.thumbnail_sha256 = store_image(data)
+        batch.append(rated)
+        if len(batch) >= 200:
+            RatedCaption.objects.bulk_update(batch, ['image_sha256', 'thumbnail_sha256'])
+            batch = []
+    RatedCaption.objects.bulk_update(batch, ['image_sha256', 'thumbnail_sha256'])
+    missing = RatedCaption.objects.filter(image_sha256='').count()
+    if missing:
+        raise RuntimeError(f"{missing} rated captions have no stored image; not removing the image column")
+
+
+def inline_image(data):
+    """The image column value for blob bytes: a data URL, or the text of a blob stored verbatim."""
+    if sniff_content_type(data[:16]) == "application/octet-stream" and data.isascii():
+        text = data.decode("ascii")
+        try:
+            decode_image_data(text)
+        except ValueError:
+            # Text that is not base64: moved as is by move_images_to_blob_store
+            return text
+    return f"data:{sniff_content_type(data[:16])};base64,{base64.b64encode(data).decode()}"
+
+
+def restore_inline_images(apps, schema_editor):
+    RatedCaption = apps.get_model('api', 'RatedCaption')
+    store = get_blob_store()
+    for rated in RatedCaption.objects.exclude(image_sha256='').iterator(chunk_size=200):
+        with store.open(rated.image_sha256) as f:
+            data = f.read()
+        rated.image = inline_image(data)
+        rated.save(update_fields=['image'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_captionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ratedcaption',
+            name='image_sha256',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='ratedcaption',
+            name='thumbnail_sha256',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        # Gives the column a default, so unapplying can re-add it before the images are restored
+        migrations.AlterField(
+            model_name='ratedcaption',
+            name='image',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(move_images_to_blob_store, restore_inline_images),
+        migrations.RemoveField(
+            model_name='ratedcaption',
+            name='image',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 02:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_ratedcaption_blob_images'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ratedcaption',
+            index=models.Index(fields=['user', '-created_at'], name='ratedcaption_user_created'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 02:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_ratedcaption_user_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='captionjob',
+            name='available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,9 +1,13 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class RatedCaption(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='rated_captions')
-    image = models.TextField()  # Base64 encoded image
+    image_sha256 = models.CharField(max_length=64)  # Blob store digest of the image
+    thumbnail_sha256 = models.CharField(max_length=64)  # Blob store digest of its thumbnail
     generated_caption = models.TextField()
     rating = models.IntegerField()  # Rating out of 5 or 10
     tone = models.CharField(max_length=50, null=True, blank=True)
@@ -14,6 +18,47 @@ class RatedCaption(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['user', '-created_at'], name='ratedcaption_user_created')]
     
     def __str__(self):
         return f"Caption by {self.user.email} (Rating: {self.rating})"
+
+
+class CaptionJob(models.Model):
+    """
+    One asynchronous caption (+ refinement) request. The table is the queue:
+    workers on any replica claim queued jobs with a conditional UPDATE.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='caption_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    image = models.BinaryField(blank=True)  # Uploaded bytes, cleared once the job is finished
+    image_name = models.CharField(max_length=255, default='image.jpg')
+    image_hash = models.CharField(max_length=64)
+    refine = models.BooleanField(default=True)
+    tone = models.CharField(max_length=50, null=True, blank=True)
+    additional_info = models.TextField(null=True, blank=True)
+    caption = models.TextField(null=True, blank=True)
+    refined_caption = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Not claimed before this (retry backoff)
+    worker = models.CharField(max_length=255, null=True, blank=True)
+    webhook_url = models.URLField(max_length=500, null=True, blank=True)
+    webhook_status = models.CharField(max_length=100, null=True, blank=True)  # HTTP status or error of the callback
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Caption job {self.id} ({self.status})"
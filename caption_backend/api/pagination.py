@@ -0,0 +1,14 @@
+# api/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class RatingCursorPagination(CursorPagination):
+    """
+    Newest ratings first, a page at a time. The cursor encodes the created_at
+    of the last row seen, so every page is an index range scan on
+    (user, -created_at) however long the history is.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
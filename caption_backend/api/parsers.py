@@ -0,0 +1,87 @@
+# api/parsers.py
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import BaseParser
+
+
+class RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Request body is too large."
+    default_code = "request_too_large"
+
+
+class SizeLimitedStream:
+    """Read-through wrapper counting the bytes read, raising RequestTooLarge past `max_bytes`."""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def _count(self, data):
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_bytes:
+            raise RequestTooLarge(f"Request body is limited to {self.max_bytes} bytes.")
+        return data
+
+    def read(self, size=-1):
+        return self._count(self.stream.read(size))
+
+    def readline(self, size=-1):
+        return self._count(self.stream.readline(size))
+
+
+class SizeLimitedParser(BaseParser):
+    """
+    Base for parsers reading the request stream themselves. With `max_bytes`
+    set (see with_limit) they stop with RequestTooLarge as soon as the body
+    passes it, whatever Content-Length said, or if it was missing.
+    """
+    max_bytes = None
+
+    @classmethod
+    def with_limit(cls, max_bytes):
+        return type(cls.__name__, (cls,), {"max_bytes": max_bytes})
+
+    def limited(self, stream):
+        return stream if self.max_bytes is None else SizeLimitedStream(stream, self.max_bytes)
+
+
+class StreamingJSONParser(SizeLimitedParser):
+    """
+    JSON read straight from the request stream. DRF parses JSONParser bodies
+    through request.body, which caps them at DATA_UPLOAD_MAX_MEMORY_SIZE; views
+    using this parser set their own limit with with_limit() instead.
+    """
+    media_type = 'application/json'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return json.load(codecs.getreader(encoding)(self.limited(stream)))
+        except ValueError as e:
+            raise ParseError(f"JSON parse error - {e}")
+
+
+class NDJSONParser(SizeLimitedParser):
+    """Newline-delimited JSON: one JSON value per line, parsed into a list. Blank lines are skipped."""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        # Read line by line rather than the whole body at once
+        for number, line in enumerate(codecs.getreader(encoding)(self.limited(stream)), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                raise ParseError(f"NDJSON parse error on line {number}: {e}")
+        return items
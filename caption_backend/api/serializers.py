@@ -1,21 +1,154 @@
+import re
+
+from django.urls import reverse
 from rest_framework import serializers
-from .models import RatedCaption
 
-class RatedCaptionSerializer(serializers.ModelSerializer):
+from .blobstore import BlobNotFound, decode_image_data, get_blob_store, sniff_content_type, store_image
+from .models import CaptionJob, RatedCaption
+
+# An image given as the URL of a blob this server already holds, e.g. when an
+# item from the rating history is rated again
+BLOB_URL_RE = re.compile(r"/blobs/([0-9a-f]{64})/?$")
+
+
+def blob_url(request, digest):
+    if not digest:
+        return None
+    url = reverse('blob', args=[digest])
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+class FieldsProjectionMixin:
+    """Renders only the fields listed in context["fields"], when given."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class RatedCaptionListSerializer(serializers.ListSerializer):
+    """
+    Validates every item, keeping the valid ones in `valid_items` ((index,
+    validated data) pairs) even when others fail, and saves with bulk_create
+    in chunks of `chunk_size` rows.
+    """
+    chunk_size = 500
+
+    def to_internal_value(self, data):
+        self.valid_items = []
+        if not isinstance(data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of ratings.']})
+        # The list-level checks of ListSerializer.to_internal_value, which this replaces
+        if not self.allow_empty and not data:
+            raise serializers.ValidationError({'non_field_errors': [self.error_messages['empty']]}, code='empty')
+        if self.max_length is not None and len(data) > self.max_length:
+            message = self.error_messages['max_length'].format(max_length=self.max_length)
+            raise serializers.ValidationError({'non_field_errors': [message]}, code='max_length')
+        if self.min_length is not None and len(data) < self.min_length:
+            message = self.error_messages['min_length'].format(min_length=self.min_length)
+            raise serializers.ValidationError({'non_field_errors': [message]}, code='min_length')
+        errors = []
+        for index, item in enumerate(data):
+            try:
+                self.valid_items.append((index, self.child.run_validation(item)))
+                errors.append({})
+            except serializers.ValidationError as e:
+                errors.append(e.detail)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [validated for _, validated in self.valid_items]
+
+    def create(self, validated_data):
+        # Labelling batches often rate the same image many times; store and thumbnail it once
+        stored_images = {}
+        instances = [self.child.build(item, stored_images) for item in validated_data]
+        created = []
+        for start in range(0, len(instances), self.chunk_size):
+            created += RatedCaption.objects.bulk_create(instances[start:start + self.chunk_size])
+        return created
+
+
+class RatedCaptionSerializer(FieldsProjectionMixin, serializers.ModelSerializer):
     user_email = serializers.SerializerMethodField()
+    # Write: the image as a data URL or base64. Read: URLs of the stored image and its thumbnail
+    image = serializers.CharField(write_only=True)
+    image_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
     
     class Meta:
         model = RatedCaption
         fields = [
-            'id', 'user', 'user_email', 'image', 'generated_caption', 'rating', 
+            'id', 'user', 'user_email', 'image', 'image_url', 'thumbnail_url', 'generated_caption', 'rating', 
             'tone', 'custom_instruction', 'hashtags', 'refined_caption', 'created_at'
         ]
         read_only_fields = ['user', 'user_email', 'created_at']
+        list_serializer_class = RatedCaptionListSerializer
+
+    # What the rating list returns without fields=: no per-row user details
+    LIST_FIELDS = [
+        'id', 'image_url', 'thumbnail_url', 'generated_caption', 'rating',
+        'tone', 'custom_instruction', 'hashtags', 'refined_caption', 'created_at'
+    ]
+    # Model columns each output field is read from, so a listing loads only those
+    SOURCE_COLUMNS = {'user_email': 'user', 'image_url': 'image_sha256', 'thumbnail_url': 'thumbnail_sha256'}
     
     def get_user_email(self, obj):
         return obj.user.email
+
+    def get_image_url(self, obj):
+        return blob_url(self.context.get('request'), obj.image_sha256)
+
+    def get_thumbnail_url(self, obj):
+        return blob_url(self.context.get('request'), obj.thumbnail_sha256)
+
+    def validate_image(self, value):
+        """Return the image bytes."""
+        match = BLOB_URL_RE.search(value.split("?", 1)[0])
+        if match:
+            try:
+                with get_blob_store().open(match.group(1)) as f:
+                    return f.read()
+            except BlobNotFound:
+                raise serializers.ValidationError("Unknown image.")
+        try:
+            data = decode_image_data(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        if not sniff_content_type(data[:16]).startswith("image/"):
+            raise serializers.ValidationError("Unsupported image format.")
+        return data
         
-    def create(self, validated_data):
+    def build(self, validated_data, stored_images=None):
+        """
+        Unsaved RatedCaption for validated data, with its image moved to the blob
+        store. `stored_images` maps image bytes already stored to their digests.
+        """
+        validated_data = dict(validated_data)
         # Assign the current user
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        image = validated_data.pop('image')
+        digests = stored_images.get(image) if stored_images is not None else None
+        if digests is None:
+            digests = store_image(image)
+            if stored_images is not None:
+                stored_images[image] = digests
+        validated_data['image_sha256'], validated_data['thumbnail_sha256'] = digests
+        return RatedCaption(**validated_data)
+        
+    def create(self, validated_data):
+        rated = self.build(validated_data)
+        rated.save()
+        return rated
+
+
+class CaptionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CaptionJob
+        fields = [
+            'id', 'status', 'caption', 'refined_caption', 'error', 'attempts',
+            'webhook_status', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
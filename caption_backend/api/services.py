@@ -1,12 +1,30 @@
 # api/services.py
 import os
 import json
+import hashlib
+import io
+import logging
+import random
+import re
+import socket
+import time
+import unicodedata
+import uuid
+import httpx
 import requests
 import threading
 import concurrent.futures
-from groq import Groq
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from groq import APIConnectionError, APIStatusError, APITimeoutError, DefaultHttpxClient, Groq
+from django.conf import settings
+from django.core.cache import caches
 from dotenv import load_dotenv
 from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -26,23 +44,466 @@ load_dotenv(dotenv_path=BASE_DIR / ".env")
 # Get the API key
 # api_key = os.getenv("API_KEY")
 HF_API_URL = os.getenv("HF_API_URL", )
+# Multi-image endpoint of the same Space; derived from HF_API_URL unless set explicitly
+HF_BATCH_API_URL = os.getenv("HF_BATCH_API_URL") or (
+    HF_API_URL.replace("generate_caption/", "generate_captions/") if HF_API_URL else None
+)
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "fallback-secret-key")
 HF_TIMEOUT = 60  # Timeout for caption generation in seconds
+HF_BATCH_TIMEOUT = 300  # Timeout for multi-image caption generation in seconds
 GROQ_TIMEOUT = 25  # Timeout for Groq API calls in seconds
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+
+
+# Outbound HTTP: connections kept per host, retries on 429/5xx with jittered
+# exponential backoff, and a cap on concurrent requests to any one host
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", 0.5))  # seconds
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 10))  # seconds
+HTTP_PER_HOST_CONCURRENCY = int(os.getenv("HTTP_PER_HOST_CONCURRENCY", 8))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class PooledHTTPClient:
+    """
+    Thread-safe wrapper around one keep-alive requests.Session shared by the
+    whole process, so calls to the same host reuse open TCP/TLS connections.
+
+    Requests answered with 429/5xx, or failing to connect, are retried up to
+    `max_retries` times, sleeping a full-jitter exponential backoff (or the
+    server's Retry-After, when given). At most `per_host_concurrency` requests
+    run against one host at a time; further callers wait for a slot.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES, backoff_base=HTTP_BACKOFF_BASE,
+                 backoff_max=HTTP_BACKOFF_MAX, per_host_concurrency=HTTP_PER_HOST_CONCURRENCY, adapter=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.per_host_concurrency = per_host_concurrency
+
+        self.session = requests.Session()
+        self.adapter = adapter or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._hosts = {}  # host -> {"requests", "retries", "errors", "in_flight"}
+
+    def _host(self, url):
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.hostname}:{parts.port or DEFAULT_PORTS.get(parts.scheme)}"
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+                self._hosts[host] = {"requests": 0, "retries": 0, "errors": 0, "in_flight": 0}
+            return host, self._host_slots[host], self._hosts[host]
+
+    def _count(self, counters, name, delta=1):
+        with self._lock:
+            counters[name] += delta
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the shared session, retrying as described above.
+        A `data` body with a rewind() method (MultipartStream) is rewound before
+        each retry. Returns the last response, or raises the last error.
+        """
+        host, slots, counters = self._host(url)
+        data = kwargs.get("data")
+        with slots:
+            self._count(counters, "in_flight")
+            try:
+                for attempt in range(self.max_retries + 1):
+                    if attempt and hasattr(data, "rewind"):
+                        data.rewind()
+                    self._count(counters, "requests")
+                    try:
+                        response = self.session.request(method, url, **kwargs)
+                    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                        self._count(counters, "errors")
+                        if attempt == self.max_retries or isinstance(e, requests.exceptions.ReadTimeout):
+                            raise
+                        delay = self._backoff(attempt)
+                    else:
+                        if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                            return response
+                        delay = self._backoff(attempt, response)
+                        response.close()
+                    self._count(counters, "retries")
+                    print(f"Retrying {method} {host} in {delay:.2f}s (attempt {attempt + 1} of {self.max_retries})")
+                    time.sleep(delay)
+            finally:
+                self._count(counters, "in_flight", -1)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """Per-host request, retry and connection counts; reuse = share of requests on an existing connection."""
+        with self._lock:
+            hosts = {host: dict(counters) for host, counters in self._hosts.items()}
+        # urllib3 counts opened connections and sent requests per connection pool
+        opened, sent = {}, {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                host = f"{key.key_scheme}://{key.key_host}:{key.key_port or DEFAULT_PORTS.get(key.key_scheme)}"
+                opened[host] = opened.get(host, 0) + pool.num_connections
+                sent[host] = sent.get(host, 0) + pool.num_requests
+        for host, counters in hosts.items():
+            counters["connections_opened"] = opened.get(host, 0)
+            counters["connection_reuse"] = round(1 - opened[host] / sent[host], 3) if sent.get(host) else 0.0
+        return {
+            "pool_size": self.adapter._pool_maxsize,
+            "max_retries": self.max_retries,
+            "per_host_concurrency": self.per_host_concurrency,
+            "hosts": hosts,
+        }
+
+
+http_client = PooledHTTPClient()
+
+# Groq calls: threads shared by every request, and how many calls may be
+# running or queued before new ones are rejected straight away
+GROQ_WORKERS = int(os.getenv("GROQ_WORKERS", 8))
+GROQ_MAX_PENDING = int(os.getenv("GROQ_MAX_PENDING", 32))
+
+
+class GroqBusyError(Exception):
+    """Raised when the Groq executor already holds `max_pending` calls."""
+
+
+class GroqExecutor:
+    """
+    Process-wide bounded thread pool for blocking Groq calls.
+
+    `run()` rejects a call immediately with GroqBusyError once `max_pending`
+    calls are running or queued, and waits at most `timeout` seconds for the
+    result. A timed-out call is cancelled if it has not started; one already
+    running keeps its slot until the client's own timeout ends it, so the
+    bound always reflects the threads actually in use.
+    """
+
+    def __init__(self, max_workers=GROQ_WORKERS, max_pending=GROQ_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="groq")
+
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed_total = 0
+        self.rejected_total = 0
+        self.timeouts_total = 0
+
+    def _started(self, fn):
+        def call():
+            with self._lock:
+                self.running += 1
+            try:
+                return fn()
+            finally:
+                with self._lock:
+                    self.running -= 1
+        return call
+
+    def _finished(self, future):
+        with self._lock:
+            self.pending -= 1
+            if not future.cancelled():
+                self.completed_total += 1
+
+    def run(self, fn, timeout):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected_total += 1
+                raise GroqBusyError("Too many caption requests in progress, please retry shortly.")
+            self.pending += 1
+        future = self.pool.submit(self._started(fn))
+        future.add_done_callback(self._finished)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts_total += 1
+            raise
+
+    @contextmanager
+    def slot(self):
+        """
+        Count a call made on the caller's own thread, such as a streamed
+        completion, against the same bound; raises GroqBusyError when full.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected_total += 1
+                raise GroqBusyError("Too many caption requests in progress, please retry shortly.")
+            self.pending += 1
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.running -= 1
+                self.completed_total += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self.running,
+                "queued": self.pending - self.running,
+                "completed_total": self.completed_total,
+                "rejected_total": self.rejected_total,
+                "timeouts_total": self.timeouts_total,
+            }
+
+
+groq_executor = GroqExecutor()
+
+
+def normalize_prompt_text(value) -> str:
+    """Text the model works on: only its Unicode form (NFC) and spacing do not change a cache key."""
+    return " ".join(unicodedata.normalize("NFC", str(value or "")).split())
+
+
+def normalize_prompt_field(value) -> str:
+    """Option fields: case, Unicode form, spacing, quotes and end punctuation do not change a cache key."""
+    if isinstance(value, (list, tuple)):
+        return "|".join(sorted(normalize_prompt_field(item) for item in value))
+    text = unicodedata.normalize("NFKC", str(value or "")).casefold()
+    return " ".join(text.split()).strip(" \"'.!?,;:")
+
+
+class GroqResponseCache:
+    """
+    Cache of parsed Groq responses in the "groq" cache alias, keyed by the
+    calling function, the model and its normalized inputs. TEXT_FIELDS, whose
+    case and punctuation show in the answer, are compared exactly but for
+    Unicode form and spacing; the option fields more loosely.
+
+    Good answers are kept for the alias TIMEOUT, failures for
+    GROQ_CACHE_NEGATIVE_TTL; rejections by a full groq_executor are not kept.
+    Concurrent misses on one key share a single upstream call (single flight):
+    the first caller makes it and the others wait for its result.
+    """
+
+    TEXT_FIELDS = ("caption", "additional_info")
+
+    def __init__(self, alias="groq", negative_ttl=None):
+        self.alias = alias
+        self.negative_ttl = negative_ttl if negative_ttl is not None else settings.GROQ_CACHE_NEGATIVE_TTL
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> {"done": Event, "result": dict}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def key(self, function: str, **fields) -> str:
+        normalized = json.dumps([function, GROQ_MODEL, sorted(
+            (name, normalize_prompt_text(value) if name in self.TEXT_FIELDS else normalize_prompt_field(value))
+            for name, value in fields.items()
+        )])
+        return f"groq:{function}:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
 
+    def _lookup(self, key):
+        cached = caches[self.alias].get(key)
+        if cached is not None:
+            self._count("negative_hits" if cached.get("error") else "hits")
+        return cached
 
-# Initialize Groq client
-client = Groq(api_key=GROQ_API_KEY)
+    def _store(self, key, response, is_valid=None):
+        # A busy rejection says nothing about this prompt, so it is not cached
+        if response.get("busy"):
+            return
+        if "error" in response or (is_valid is not None and not is_valid(response)):
+            caches[self.alias].set(key, response, self.negative_ttl)
+        else:
+            caches[self.alias].set(key, response)
 
-def caption_with_hf_api(image_path: str) -> str:
-    headers = {"accept": "application/json"}
+    def get(self, function: str, fields: dict):
+        """The cached response for these inputs, or None; for callers that make the call themselves."""
+        return self._lookup(self.key(function, **fields))
+
+    def set(self, function: str, fields: dict, response: dict, is_valid=None):
+        self._store(self.key(function, **fields), response, is_valid)
+
+    def call(self, function: str, fields: dict, prompt: str, max_tokens: int = 100, is_valid=None) -> dict:
+        """
+        Return the response for `prompt`, from the cache when this function was
+        already called with equivalent `fields`. A response with an "error", or
+        one `is_valid` rejects, counts as a failure.
+        """
+        key = self.key(function, **fields)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = {"done": threading.Event(), "result": None}
+                self.misses += 1
+            else:
+                self.shared += 1
+        if not leader:
+            flight["done"].wait()
+            return flight["result"]
+
+        try:
+            response = call_groq_api_with_timeout(prompt, max_tokens=max_tokens)
+            self._store(key, response, is_valid)
+            flight["result"] = response
+            return response
+        except Exception as e:
+            flight["result"] = {"error": f"API request failed: {str(e)}"}
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight["done"].set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses + self.shared
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "in_flight": len(self._flights),
+                "hit_rate": round((self.hits + self.negative_hits + self.shared) / lookups, 3) if lookups else None,
+            }
+
+
+groq_cache = GroqResponseCache()
+
+# Initialize Groq client; it keeps its own pooled, keep-alive httpx client. Its
+# own retries are off: create_groq_completion retries within the call's deadline
+client = Groq(
+    api_key=GROQ_API_KEY,
+    max_retries=0,
+    http_client=DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+    ),
+)
+
+def hash_upload(file_obj) -> str:
+    """SHA-256 of an uploaded file's contents."""
+    digest = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def caption_cache_key(image_hash: str) -> str:
+    return f"caption:{settings.CAPTION_MODEL_VERSION}:{image_hash}"
+
+def get_cached_caption(image_hash: str):
+    """Return the cached caption for this image under the current model version, or None."""
+    return caches["captions"].get(caption_cache_key(image_hash))
+
+class MultipartStream:
+    """
+    File-like multipart/form-data body that reads each upload as it is sent,
+    so an upload is forwarded without being copied into memory or onto disk.
+    `fields` is a list of (field name, file object) pairs; file objects need a
+    `name` and are read from the start. The length is known up front, so the
+    request goes out with a Content-Length rather than chunked.
+    """
+
+    def __init__(self, fields):
+        self.boundary = uuid.uuid4().hex
+        self._parts = []
+        for field, file_obj in fields:
+            filename = os.path.basename(getattr(file_obj, "name", None) or "upload").replace('"', "%22")
+            content_type = getattr(file_obj, "content_type", None) or "application/octet-stream"
+            header = (
+                f"--{self.boundary}\r\n"
+                f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                f"Content-Type: {content_type}\r\n\r\n"
+            ).encode()
+            file_obj.seek(0, os.SEEK_END)
+            size = file_obj.tell()
+            file_obj.seek(0)
+            self._parts += [(io.BytesIO(header), len(header)), (file_obj, size), (io.BytesIO(b"\r\n"), 2)]
+        closing = f"--{self.boundary}--\r\n".encode()
+        self._parts.append((io.BytesIO(closing), len(closing)))
+        self._length = sum(size for _, size in self._parts)
+        self._current = 0
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._length
+
+    def rewind(self):
+        """Start the body over, e.g. to resend it on a retry."""
+        for part, _ in self._parts:
+            part.seek(0)
+        self._current = 0
+
+    def read(self, size=-1):
+        chunks = []
+        while self._current < len(self._parts) and size != 0:
+            data = self._parts[self._current][0].read(size)
+            if not data:
+                self._current += 1
+                continue
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(chunks)
+
+
+def post_uploads(url, fields, timeout):
+    """POST uploads as multipart/form-data, streaming them from their file objects."""
+    body = MultipartStream(fields)
+    headers = {"accept": "application/json", "Content-Type": body.content_type}
+    return http_client.post(url, headers=headers, data=body, timeout=timeout)
+
+def caption_with_hf_api(image, image_hash: str = None) -> str:
+    """
+    Caption an image with the HF Space. `image` is an uploaded file (or any
+    open binary file), streamed to the Space as it is sent, or a file path.
+    When image_hash is given, a successful caption is stored in the captions
+    cache under that hash.
+    """
     try:
-        with open(image_path, "rb") as img_file:
-            files = {"file": img_file}
-            print("Requesting for generating caption")
-            # Add timeout parameter to the request
-            response = requests.post(HF_API_URL, headers=headers, files=files, timeout=HF_TIMEOUT)
+        print("Requesting for generating caption")
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, "rb") as img_file:
+                response = post_uploads(HF_API_URL, [("file", img_file)], HF_TIMEOUT)
+        else:
+            response = post_uploads(HF_API_URL, [("file", image)], HF_TIMEOUT)
     except requests.exceptions.Timeout:
         print(f"Caption generation timed out after {HF_TIMEOUT} seconds")
         return f"Caption generation timed out after {HF_TIMEOUT} seconds. Please try again."
@@ -54,6 +515,8 @@ def caption_with_hf_api(image_path: str) -> str:
         try:
             data = response.json()
             print(f"Generated Caption - {data.get('caption', 'No caption found in response.')}")
+            if image_hash and data.get("caption"):
+                caches["captions"].set(caption_cache_key(image_hash), data["caption"])
             return data.get("caption", "No caption found in response.")
         except Exception as e:
             print("Error parsing response:", e)
@@ -61,60 +524,153 @@ def caption_with_hf_api(image_path: str) -> str:
     else:
         return f"Error {response.status_code}: {response.text}"
 
-def call_groq_api_with_timeout(prompt: str) -> dict:
-    result = {"error": f"Operation timed out after {GROQ_TIMEOUT} seconds"}
-    
+def captions_with_hf_api(uploads) -> list:
+    """
+    Send several uploaded images to the caption Space in a single request.
+    Returns one dict per image, in input order, holding either "caption" or "error".
+    """
+    def failed(message):
+        return [{"filename": upload.name, "error": message} for upload in uploads]
+
+    try:
+        print(f"Requesting captions for {len(uploads)} images")
+        response = post_uploads(HF_BATCH_API_URL, [("files", upload) for upload in uploads], HF_BATCH_TIMEOUT)
+    except requests.exceptions.Timeout:
+        print(f"Batch caption generation timed out after {HF_BATCH_TIMEOUT} seconds")
+        return failed(f"Caption generation timed out after {HF_BATCH_TIMEOUT} seconds. Please try again.")
+    except Exception as e:
+        print("Failed to send images:", e)
+        return failed(f"Failed to send images: {e}")
+
+    if response.status_code != 200:
+        return failed(f"Error {response.status_code}: {response.text}")
+
+    try:
+        data = response.json()
+    except Exception as e:
+        print("Error parsing response:", e)
+        return failed(f"Error parsing response: {e}")
+
+    results = data.get("results")
+    if not isinstance(results, list) or len(results) != len(uploads):
+        return failed(data.get("error", "Unexpected response from caption service."))
+    return results
+
+def parse_groq_text(response_text: str) -> dict:
+    """Turn the text of a Groq completion into the response dict the services expect."""
+    response_text = response_text.strip()
+    # A ```json ... ``` fenced object, as JsonStringField also accepts
+    fenced = re.fullmatch(r"```(?:json)?\s*(\{.*\})\s*```", response_text, re.DOTALL | re.IGNORECASE)
+    if fenced:
+        response_text = fenced.group(1)
+    try:
+        # Try to parse as JSON first
+        parsed = json.loads(response_text)
+    except json.JSONDecodeError:
+        # If not valid JSON, check if it's a plain text response
+        if "refined_caption" not in response_text.lower():
+            # If not a proper response format, create a manual JSON object
+            return {"refined_caption": response_text}
+        else:
+            # It might contain the refined caption text but not in proper JSON
+            return {"error": "Invalid JSON response from Groq. Raw response: " + response_text}
+    # Callers expect a dict; a bare JSON string is taken as the caption itself
+    if isinstance(parsed, str):
+        return {"refined_caption": parsed}
+    if not isinstance(parsed, dict):
+        return {"error": "Unexpected JSON response from Groq. Raw response: " + response_text}
+    return parsed
+
+def create_groq_completion(deadline: float, **kwargs):
+    """
+    client.chat.completions.create, retrying connection errors, 429 and 5xx up
+    to HTTP_MAX_RETRIES times with http_client's backoff. Every attempt gets
+    only the time left before `deadline` (a time.monotonic() value) as its
+    timeout, and no retry starts that could not finish by then, so the whole
+    call, retries included, ends by the deadline.
+    """
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise concurrent.futures.TimeoutError()
+        try:
+            return client.chat.completions.create(timeout=remaining, **kwargs)
+        except APITimeoutError:
+            raise concurrent.futures.TimeoutError()
+        except APIConnectionError as e:
+            error, delay = e, http_client._backoff(attempt)
+        except APIStatusError as e:
+            if e.status_code not in RETRY_STATUSES:
+                raise
+            error, delay = e, http_client._backoff(attempt, e.response)
+        if attempt == HTTP_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            raise error
+        print(f"Retrying Groq call in {delay:.2f}s (attempt {attempt + 1} of {HTTP_MAX_RETRIES})")
+        time.sleep(delay)
+
+def call_groq_api_with_timeout(prompt: str, max_tokens: int = 100) -> dict:
+    # Set before queueing, so time spent waiting for a worker counts too
+    deadline = time.monotonic() + GROQ_TIMEOUT
+
     def api_call():
-        nonlocal result
         try:
-            completion = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
+            completion = create_groq_completion(
+                deadline,
+                model=GROQ_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
-                max_completion_tokens=100,
+                max_completion_tokens=max_tokens,
                 top_p=1,
                 stream=False,
                 stop=None,
             )
-            response_text = completion.choices[0].message.content.strip()
-            try:
-                # Try to parse as JSON first
-                result = json.loads(response_text)
-            except json.JSONDecodeError:
-                # If not valid JSON, check if it's a plain text response
-                if "refined_caption" not in response_text.lower():
-                    # If not a proper response format, create a manual JSON object
-                    result = {"refined_caption": response_text}
-                else:
-                    # It might contain the refined caption text but not in proper JSON
-                    result = {"error": "Invalid JSON response from Groq. Raw response: " + response_text}
+            return parse_groq_text(completion.choices[0].message.content)
+        except concurrent.futures.TimeoutError:
+            return {"error": f"Operation timed out after {GROQ_TIMEOUT} seconds"}
         except Exception as e:
-            result = {"error": f"API request failed: {str(e)}"}
+            return {"error": f"API request failed: {str(e)}"}
     
-    # Use ThreadPoolExecutor to run the API call with a timeout
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future = executor.submit(api_call)
-        try:
-            future.result(timeout=GROQ_TIMEOUT)
-        except concurrent.futures.TimeoutError:
-            print(f"Groq API call timed out after {GROQ_TIMEOUT} seconds")
-            
-    return result
+    # Run the call on the shared Groq pool; the request thread waits at most GROQ_TIMEOUT
+    try:
+        return groq_executor.run(api_call, timeout=GROQ_TIMEOUT)
+    except GroqBusyError as e:
+        print(f"Groq call rejected: {e}")
+        return {"error": str(e), "busy": True}
+    except concurrent.futures.TimeoutError:
+        print(f"Groq API call timed out after {GROQ_TIMEOUT} seconds")
+        return {"error": f"Operation timed out after {GROQ_TIMEOUT} seconds"}
 
-def refine_caption_with_groq(caption: str, tone: str, additional_info: str) -> str:
-    # Stricter validation for caption input
-    if not caption or caption.strip() == "" or caption.lower() == "error" or "failed" in caption.lower() or caption.lower().startswith("caption"):
-        print(f"Invalid caption detected: '{caption}'")
-        return "Unable to refine caption. Please try again with a different image."
-    
-    # Ensure tone and additional info are valid
+def is_refinable_caption(caption: str) -> bool:
+    """False for empty captions and the error messages the caption functions return."""
+    return bool(caption) and caption.strip() != "" and caption.lower() != "error" and "failed" not in caption.lower() and not caption.lower().startswith("caption")
+
+def is_valid_refinement(refined, verbose: bool = True) -> bool:
+    if not isinstance(refined, str) or not refined or "error" in refined.lower() or "fail" in refined.lower():
+        if verbose:
+            print(f"Invalid refined caption detected: '{refined}', using original")
+        return False
+    # Check word count to ensure it's in the desired range
+    word_count = len(refined.split())
+    if verbose:
+        print(f"Refined caption word count: {word_count}")
+    if word_count < 7 or word_count > 60:  # Using wider bounds for validation to be safe
+        if verbose:
+            print(f"Caption length outside desired range ({word_count} words), using original")
+        return False
+    return True
+
+def has_valid_refinement(response: dict) -> bool:
+    return is_valid_refinement(response.get("refined_caption"), verbose=False)
+
+def refine_inputs(tone: str, additional_info: str):
+    """Defaults for a missing tone or additional info."""
     tone = tone if tone and tone.strip() else "casual"
     additional_info = additional_info if additional_info and additional_info.strip() else "Make it engaging"
-    
-    print(f"Refining valid caption: '{caption}' with tone: '{tone}'")
-    
+    return tone, additional_info
+
+def refine_prompt(caption: str, tone: str, additional_info: str) -> str:
     # Updated prompt for medium-length captions (20-50 words)
-    prompt = (
+    return (
         f"You are a social media caption expert. Take this basic image caption: '{caption}' "
         f"and transform it into a {tone} tone caption. "
         f"Consider this additional context: {additional_info}. "
@@ -123,35 +679,43 @@ def refine_caption_with_groq(caption: str, tone: str, additional_info: str) -> s
         f"Return ONLY in this JSON format without explanation:\n"
         f'{{"refined_caption": "YOUR_CAPTION_HERE"}}'
     )
+
+def refinement_from_response(caption: str, response: dict) -> str:
+    """The refined caption in a Groq response, or the original caption if it is missing or invalid."""
+    # Debug the raw response
+    print(f"Raw API response: {response}")
+    
+    # Check for error
+    if "error" in response:
+        error_msg = response.get("error")
+        print(f"Error refining caption: {error_msg}")
+        # Return the original caption rather than error message
+        return caption
+    
+    refined = response.get("refined_caption")
+    if not is_valid_refinement(refined):
+        return caption
+    
+    print(f"Successfully refined caption: '{refined}'")
+    return refined
+
+def refine_caption_with_groq(caption: str, tone: str, additional_info: str) -> str:
+    # Stricter validation for caption input
+    if not is_refinable_caption(caption):
+        print(f"Invalid caption detected: '{caption}'")
+        return "Unable to refine caption. Please try again with a different image."
+    
+    # Ensure tone and additional info are valid
+    tone, additional_info = refine_inputs(tone, additional_info)
+    
+    print(f"Refining valid caption: '{caption}' with tone: '{tone}'")
     
     try:
-        response = call_groq_api_with_timeout(prompt)
-        
-        # Debug the raw response
-        print(f"Raw API response: {response}")
-        
-        # Check for error
-        if "error" in response:
-            error_msg = response.get("error")
-            print(f"Error refining caption: {error_msg}")
-            # Return the original caption rather than error message
-            return caption
-        
-        refined = response.get("refined_caption")
-        if not refined or "error" in refined.lower() or "fail" in refined.lower():
-            print(f"Invalid refined caption detected: '{refined}', using original")
-            return caption
-            
-        # Check word count to ensure it's in the desired range
-        word_count = len(refined.split())
-        print(f"Refined caption word count: {word_count}")
-        
-        if word_count < 7 or word_count > 60:  # Using wider bounds for validation to be safe
-            print(f"Caption length outside desired range ({word_count} words), using original")
-            return caption
-        
-        print(f"Successfully refined caption: '{refined}'")
-        return refined
+        response = groq_cache.call(
+            "refine", {"caption": caption, "tone": tone, "additional_info": additional_info},
+            refine_prompt(caption, tone, additional_info), is_valid=has_valid_refinement,
+        )
+        return refinement_from_response(caption, response)
     except Exception as e:
         print(f"Exception during refinement: {str(e)}")
         return caption
@@ -164,27 +728,21 @@ def generate_hashtags(caption: str) -> list:
         f'{{"hashtags": ["#tag1", "#tag2", "#tag3"]}}'
     )
     print("requesting for hashtags generation")
-    response = call_groq_api_with_timeout(prompt)
+    response = groq_cache.call(
+        "hashtags", {"caption": caption}, prompt, is_valid=lambda response: isinstance(response.get("hashtags"), list)
+    )
     print(f"generated hashtags- {response.get('hashtags', [response.get('error', 'Unknown error')])}")
     return response.get("hashtags", [response.get("error", "Unknown error")])
 
-def translate_caption_service(text: str, target_language: str) -> str:
-    """
-    Translate text to the specified target language using Groq API.
-    """
-    if not text or not target_language:
-        return text
-    
-    prompt = (
+def translation_prompt(text: str, target_language: str) -> str:
+    return (
         f"Translate the following text accurately to {target_language}. "
         f"Maintain the same tone and style. Return ONLY the translated text without any formatting, JSON, or additional notes.\n\n"
         f"Text: '{text}'"
     )
-    
-    print(f"Requesting translation to {target_language}")
-    
-    response = call_groq_api_with_timeout(prompt)
-    
+
+def translation_from_response(text: str, response) -> str:
+    """The translated text in a Groq response, or the original text on error."""
     # Process response to extract the actual translated text
     if isinstance(response, dict):
         # Check for error
@@ -223,3 +781,304 @@ def translate_caption_service(text: str, target_language: str) -> str:
     
     # Default fallback, return the response as is
     return str(response)
+
+def translate_caption_service(text: str, target_language: str) -> str:
+    """
+    Translate text to the specified target language using Groq API.
+    """
+    if not text or not target_language:
+        return text
+    
+    print(f"Requesting translation to {target_language}")
+    
+    response = groq_cache.call(
+        "translate", {"caption": text, "target_language": target_language}, translation_prompt(text, target_language)
+    )
+    return translation_from_response(text, response)
+
+class JsonStringField:
+    """
+    Incremental reader for the string value of one JSON field in a completion
+    that is still arriving. `feed()` takes the next chunk of text and returns
+    the part of the value decoded so far that it has not returned before.
+
+    A completion that does not start with "{" (or a ``` fence) is treated as
+    plain text and passed through unchanged.
+    """
+
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, *names):
+        self.pattern = re.compile(r'"(?:%s)"\s*:\s*"' % "|".join(re.escape(name) for name in names))
+        self.buffer = ""
+        self.position = None  # Next unread character of the value
+        self.plain = None
+        self.closed = False
+
+    def _escape(self):
+        # Returns (decoded text, characters consumed), or None until the escape is complete
+        start = self.position
+        if start + 1 >= len(self.buffer):
+            return None
+        code = self.buffer[start + 1]
+        if code != "u":
+            return self.ESCAPES.get(code, code), 2
+        length = 6
+        if start + 6 <= len(self.buffer) and 0xD800 <= int(self.buffer[start + 2:start + 6], 16) < 0xDC00:
+            length = 12  # A surrogate pair, e.g. an emoji
+        if start + length > len(self.buffer):
+            return None
+        try:
+            return json.loads(f'"{self.buffer[start:start + length]}"'), length
+        except ValueError:
+            return self.buffer[start:start + length], length
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self.plain is None and self.buffer.strip():
+            self.plain = self.buffer.lstrip()[0] not in "{`"
+            if self.plain:
+                # Leading whitespace is dropped, as parse_groq_text strips it from the full text
+                return self.buffer.lstrip()
+        if self.plain:
+            return chunk
+        if self.closed:
+            return ""
+        if self.position is None:
+            match = self.pattern.search(self.buffer)
+            if match is None:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        while self.position < len(self.buffer):
+            character = self.buffer[self.position]
+            if character == '"':
+                self.closed = True
+                break
+            if character == "\\":
+                try:
+                    escape = self._escape()
+                except ValueError:
+                    escape = (self.buffer[self.position:self.position + 6], 6)
+                if escape is None:
+                    break
+                decoded.append(escape[0])
+                self.position += escape[1]
+            else:
+                decoded.append(character)
+                self.position += 1
+        return "".join(decoded)
+
+def _abort_stream(stream):
+    """Close a streamed completion from another thread, waking a read blocked on its socket."""
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    stream.close()
+
+def stream_groq_text(prompt: str, max_tokens: int = 100):
+    """
+    Yield the text of a streamed Groq completion chunk by chunk. The call holds
+    a groq_executor slot and is abandoned once GROQ_TIMEOUT has passed.
+    Point GROQ_BASE_URL at a local server to stream from a stub.
+    """
+    deadline = time.monotonic() + GROQ_TIMEOUT
+    with groq_executor.slot():
+        stream = create_groq_completion(
+            deadline,
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_completion_tokens=max_tokens,
+            top_p=1,
+            stream=True,
+            stop=None,
+        )
+        # The client's timeout applies to each read, not to the whole stream:
+        # a watchdog closes the stream at the deadline, even mid-read
+        watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), _abort_stream, args=(stream,))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            for chunk in stream:
+                if time.monotonic() > deadline:
+                    raise concurrent.futures.TimeoutError()
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+        except Exception:
+            if time.monotonic() >= deadline:
+                raise concurrent.futures.TimeoutError()
+            raise
+        finally:
+            watchdog.cancel()
+            stream.close()
+
+def _stream_response(function: str, fields: dict, prompt: str, extractor: JsonStringField, is_valid=None):
+    """
+    Yield ("delta", text) events for a streamed completion, then ("response",
+    response dict) with the same parsing, failure handling and caching as a
+    call through groq_cache. A cached response is replayed as a single delta.
+    """
+    cached = groq_cache.get(function, fields)
+    if cached is not None:
+        yield "response", cached
+        return
+
+    chunks = []
+    try:
+        for chunk in stream_groq_text(prompt):
+            chunks.append(chunk)
+            text = extractor.feed(chunk)
+            if text:
+                yield "delta", text
+        response = parse_groq_text("".join(chunks))
+    except GroqBusyError as e:
+        print(f"Groq call rejected: {e}")
+        response = {"error": str(e), "busy": True}
+    except concurrent.futures.TimeoutError:
+        print(f"Groq API stream timed out after {GROQ_TIMEOUT} seconds")
+        response = {"error": f"Operation timed out after {GROQ_TIMEOUT} seconds"}
+    except Exception as e:
+        response = {"error": f"API request failed: {str(e)}"}
+    groq_cache.set(function, fields, response, is_valid)
+    yield "response", response
+
+def stream_refined_caption(caption: str, tone: str, additional_info: str):
+    """
+    Streaming refine_caption_with_groq: yields ("delta", {"text": ...}) events as
+    the refined caption arrives, then ("done", {"refined_caption": ...}) with the
+    same validated result the non-streaming call returns.
+    """
+    if not is_refinable_caption(caption):
+        print(f"Invalid caption detected: '{caption}'")
+        yield "done", {"refined_caption": "Unable to refine caption. Please try again with a different image."}
+        return
+    tone, additional_info = refine_inputs(tone, additional_info)
+    fields = {"caption": caption, "tone": tone, "additional_info": additional_info}
+
+    streamed = False
+    for event, data in _stream_response(
+        "refine", fields, refine_prompt(caption, tone, additional_info), JsonStringField("refined_caption"),
+        is_valid=has_valid_refinement,
+    ):
+        if event == "delta":
+            streamed = True
+            yield "delta", {"text": data}
+    refined = refinement_from_response(caption, data)
+    if not streamed:
+        yield "delta", {"text": refined}
+    yield "done", {"refined_caption": refined}
+
+def stream_translation(text: str, target_language: str):
+    """Streaming translate_caption_service, with the same events as stream_refined_caption."""
+    fields = {"caption": text, "target_language": target_language}
+    extractor = JsonStringField("translated_text", "translation", "refined_caption")
+
+    streamed = False
+    for event, data in _stream_response("translate", fields, translation_prompt(text, target_language), extractor):
+        if event == "delta":
+            streamed = True
+            yield "delta", {"text": data}
+    translated = translation_from_response(text, data)
+    if not streamed:
+        yield "delta", {"text": translated}
+    yield "done", {"translated_text": translated, "language": target_language}
+
+# caption-pipeline/: how many translation targets one request may ask for
+PIPELINE_MAX_LANGUAGES = int(os.getenv("PIPELINE_MAX_LANGUAGES", 5))
+
+# Orchestration threads for the pipeline's fallback stages; they only wait on
+# Groq calls, which are still bounded by groq_executor
+pipeline_pool = concurrent.futures.ThreadPoolExecutor(max_workers=GROQ_WORKERS, thread_name_prefix="pipeline")
+
+def combined_pipeline_call(caption: str, tone: str, additional_info: str, languages: list, include_hashtags: bool) -> dict:
+    """Refine, tag and translate a caption with a single structured-JSON Groq prompt."""
+    fields = ['"refined_caption": "YOUR_CAPTION_HERE"']
+    tasks = []
+    if include_hashtags:
+        tasks.append("Also generate 5-7 trending hashtags for the refined caption, using only *popular and relevant* hashtags.")
+        fields.append('"hashtags": ["#tag1", "#tag2", "#tag3"]')
+    if languages:
+        tasks.append(
+            f"Also translate the refined caption accurately to each of: {', '.join(languages)}, "
+            f"keeping the same tone and style."
+        )
+        fields.append('"translations": {' + ", ".join(f'"{language}": "TRANSLATION"' for language in languages) + "}")
+    prompt = (
+        f"You are a social media caption expert. Take this basic image caption: '{caption}' "
+        f"and transform it into a {tone} tone caption. "
+        f"Consider this additional context: {additional_info}. "
+        f"Create an engaging caption that is between 20-50 words long - perfect for social media. "
+        f"The caption should be descriptive and detailed while maintaining an engaging style. "
+        f"{' '.join(tasks)} "
+        f"Return ONLY in this JSON format without explanation:\n"
+        f"{{{', '.join(fields)}}}"
+    )
+    # Room for the refined caption plus each extra field
+    max_tokens = 100 + (60 if include_hashtags else 0) + 120 * len(languages)
+    fields = {
+        "caption": caption, "tone": tone, "additional_info": additional_info,
+        "target_language": languages, "include_hashtags": include_hashtags,
+    }
+    return groq_cache.call("pipeline", fields, prompt, max_tokens=max_tokens, is_valid=has_valid_refinement)
+
+def run_caption_pipeline(caption: str, tone: str, additional_info: str, languages: list, include_hashtags: bool = True):
+    """
+    Refine a caption, generate hashtags and translate the refined caption,
+    yielding one dict per finished stage ("refine", "hashtags", one
+    "translation" per language) and finally {"stage": "done"}.
+
+    Everything is first requested in one combined prompt. Stages whose part of
+    the answer is missing or invalid fall back to the individual services:
+    refine and hashtags run concurrently, then the translations in parallel.
+    """
+    tone, additional_info = refine_inputs(tone, additional_info)
+
+    response = combined_pipeline_call(caption, tone, additional_info, languages, include_hashtags)
+    if "error" in response:
+        logger.warning("Combined pipeline call failed, falling back to separate calls: %s", response["error"])
+        response = {}
+
+    refined = response.get("refined_caption")
+    hashtags = response.get("hashtags")
+    translations = response.get("translations") if isinstance(response.get("translations"), dict) else {}
+    # A cached answer may spell the languages differently from this request
+    translations = {normalize_prompt_field(language): text for language, text in translations.items()}
+
+    pending = {}
+    if is_valid_refinement(refined):
+        yield {"stage": "refine", "refined_caption": refined}
+    else:
+        # The combined translations were made from the rejected refinement
+        translations = {}
+        pending[pipeline_pool.submit(refine_caption_with_groq, caption, tone, additional_info)] = "refine"
+    if include_hashtags:
+        if isinstance(hashtags, list) and hashtags and all(isinstance(tag, str) for tag in hashtags):
+            yield {"stage": "hashtags", "hashtags": hashtags}
+        else:
+            pending[pipeline_pool.submit(generate_hashtags, caption)] = "hashtags"
+
+    for future in concurrent.futures.as_completed(pending):
+        if pending[future] == "refine":
+            refined = future.result()
+            yield {"stage": "refine", "refined_caption": refined}
+        else:
+            yield {"stage": "hashtags", "hashtags": future.result()}
+
+    pending = {}
+    for language in languages:
+        text = translations.get(normalize_prompt_field(language))
+        if isinstance(text, str) and text.strip():
+            yield {"stage": "translation", "language": language, "translated_text": text}
+        else:
+            pending[pipeline_pool.submit(translate_caption_service, refined, language)] = language
+    for future in concurrent.futures.as_completed(pending):
+        yield {"stage": "translation", "language": pending[future], "translated_text": future.result()}
+
+    yield {"stage": "done"}
@@ -1,3 +1,493 @@
-from django.test import TestCase
+import concurrent.futures
+import io
+import json
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase
+from groq import Groq
+
+from . import jobs, serializers, services, views
+from .parsers import NDJSONParser, RequestTooLarge, StreamingJSONParser
+from .services import JsonStringField, PooledHTTPClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    /ok                                  200
+    /status?code=503&times=2&retry_after=0.1
+                                         `code` for the first `times` hits, then 200
+    /slow?seconds=0.2                    200 after a pause
+    POST /hook                           200, recording the request in server.webhooks
+    POST .../chat/completions            a Groq completion of server.completion (a list of
+                                         chunks), streamed as one SSE chunk each if asked to,
+                                         server.chunk_delay seconds apart, then stalling for
+                                         server.stall seconds before the end of the stream
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive, so the client can reuse connections
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        server = self.server
+        with server.lock:
+            server.hits[parts.path] = server.hits.get(parts.path, 0) + 1
+            hits = server.hits[parts.path]
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if parts.path == "/status" and hits <= int(query.get("times", 1)):
+                headers = {"Retry-After": query["retry_after"]} if "retry_after" in query else {}
+                self.reply(int(query["code"]), headers)
+                return
+            if parts.path == "/slow":
+                time.sleep(float(query["seconds"]))
+            self.reply(200)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/hook":
+            self.server.webhooks.append({"host": self.headers["Host"], "body": request})
+            self.reply(200)
+            return
+        base = {"id": "chatcmpl-stub", "created": 0, "model": request["model"]}
+        if not request.get("stream"):
+            message = {"role": "assistant", "content": "".join(self.server.completion)}
+            body = dict(base, object="chat.completion", choices=[{"index": 0, "message": message, "finish_reason": "stop"}])
+            self.reply(200, {"Content-Type": "application/json"}, json.dumps(body).encode())
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for text in self.server.completion:
+                chunk = dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {"content": text}}])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(self.server.chunk_delay)
+            time.sleep(self.server.stall)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except OSError:
+            pass  # the client gave up (deadline tests)
+
+    def reply(self, status, headers=None, body=b"ok"):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client gave up (read timeout tests)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServerMixin:
+    """Runs a StubHandler server on a free local port for each test."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.hits = {}
+        self.server.in_flight = self.server.max_in_flight = 0
+        self.server.completion = []
+        self.server.chunk_delay = self.server.stall = 0
+        self.server.webhooks = []
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+class StubServerTestCase(StubServerMixin, SimpleTestCase):
+    pass
+
+
+class PooledHTTPClientTests(StubServerTestCase):
+
+    def make_client(self, **kwargs):
+        client = PooledHTTPClient(**dict({"max_retries": 3, "backoff_base": 0.01, "backoff_max": 1}, **kwargs))
+        self.addCleanup(client.session.close)
+        return client
+
+    def host_stats(self, client):
+        return client.stats()["hosts"][self.base_url]
+
+    def test_reuses_connections(self):
+        client = self.make_client()
+        for _ in range(5):
+            self.assertEqual(client.get(self.base_url + "/ok").status_code, 200)
+        stats = self.host_stats(client)
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["connection_reuse"], 0.8)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_retries_429_and_5xx_after_retry_after(self):
+        client = self.make_client()
+        for code in (429, 503):
+            with self.subTest(code=code):
+                self.server.hits.clear()
+                start = time.monotonic()
+                response = client.get(f"{self.base_url}/status?code={code}&times=2&retry_after=0.2")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.server.hits["/status"], 3)
+                # Two waits of Retry-After, not the much shorter jittered backoff
+                self.assertGreaterEqual(time.monotonic() - start, 0.4)
+        self.assertEqual(self.host_stats(client)["retries"], 4)
+
+    def test_returns_last_response_when_retries_run_out(self):
+        client = self.make_client(max_retries=2)
+        response = client.get(f"{self.base_url}/status?code=502&times=10")
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.server.hits["/status"], 3)
+
+    def test_does_not_retry_other_errors(self):
+        client = self.make_client()
+        response = client.get(f"{self.base_url}/status?code=400")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.server.hits["/status"], 1)
+        self.assertEqual(self.host_stats(client)["retries"], 0)
+
+    def test_does_not_retry_read_timeout(self):
+        client = self.make_client()
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.get(self.base_url + "/slow?seconds=1", timeout=0.2)
+        self.assertEqual(self.server.hits["/slow"], 1)
+        stats = self.host_stats(client)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["retries"], 0)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_limits_concurrent_requests_per_host(self):
+        client = self.make_client(per_host_concurrency=2)
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = list(pool.map(lambda _: client.get(self.base_url + "/slow?seconds=0.2"), range(6)))
+        self.assertEqual([r.status_code for r in responses], [200] * 6)
+        self.assertEqual(self.server.hits["/slow"], 6)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+# Escaped quotes, newline and backslash; json.dumps writes é as \u00e9 and the emoji as a surrogate pair
+REFINED = 'A "golden" retriever\nchases waves on a sunny beach \\ pure joy, \u00e9t\u00e9 \U0001F600 at dawn'
+REFINED_JSON = json.dumps({"refined_caption": REFINED})
+
+
+class JsonStringFieldTests(SimpleTestCase):
+
+    def feed_all(self, chunks, *names):
+        extractor = JsonStringField(*(names or ("refined_caption",)))
+        return "".join(extractor.feed(chunk) for chunk in chunks)
+
+    def test_decodes_escapes_split_across_chunks(self):
+        completion = json.dumps({"refined_caption": 'Say "hi"\\there\t/ \u00e9 \ud83d\ude00 done'}, ensure_ascii=True)
+        expected = json.loads(completion)["refined_caption"]
+        for size in range(1, 8):
+            with self.subTest(size=size):
+                self.assertEqual(self.feed_all(split(completion, size)), expected)
+
+    def test_surrogate_pair_split_between_halves(self):
+        completion = '{"refined_caption": "smile \\ud83d\\ude00!"}'
+        index = completion.index("\\ude00")
+        self.assertEqual(self.feed_all([completion[:index], completion[index:]]), "smile \U0001F600!")
+
+    def test_ignores_other_fields_and_text_after_the_value(self):
+        completion = '{"other": "x", "translation": "hola", "refined_caption": "no"}'
+        self.assertEqual(self.feed_all(split(completion, 4), "translated_text", "translation"), "hola")
+
+    def test_reads_a_fenced_completion(self):
+        completion = '```json\n{"refined_caption": "fenced caption"}\n```'
+        self.assertEqual(self.feed_all(split(completion, 3)), "fenced caption")
+
+    def test_passes_plain_text_through(self):
+        completion = "  Bonjour, \"le\" monde\\n"
+        for size in (1, 2, 3):
+            with self.subTest(size=size):
+                self.assertEqual(self.feed_all(split(completion, size)), completion.lstrip())
+
+
+class GroqStubTestCase(StubServerTestCase):
+    """Points the services' Groq client at the stub server, with an empty Groq cache."""
+
+    def setUp(self):
+        super().setUp()
+        client = Groq(api_key="test", base_url=self.base_url, max_retries=0)
+        patcher = mock.patch.object(services, "client", client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(client.close)
+        caches["groq"].clear()
+        self.addCleanup(caches["groq"].clear)
+
+
+class GroqCacheKeyTests(SimpleTestCase):
+
+    def key(self, **fields):
+        return services.groq_cache.key("refine", **dict({"caption": "A dog", "tone": "casual", "additional_info": ""}, **fields))
+
+    def test_caption_text_is_keyed_exactly(self):
+        for first, second in (("US", "us"), ("Great!", "great"), ('"Hi"', "Hi")):
+            with self.subTest(first):
+                self.assertNotEqual(self.key(caption=first), self.key(caption=second))
+        self.assertNotEqual(self.key(additional_info="ALL CAPS"), self.key(additional_info="all caps"))
+
+    def test_caption_unicode_form_and_spacing_are_ignored(self):
+        self.assertEqual(self.key(caption="caf\u00e9  time\n"), self.key(caption=" cafe\u0301 time"))
+
+    def test_option_fields_are_keyed_loosely(self):
+        self.assertEqual(self.key(tone="Casual."), self.key(tone=" casual"))
+        self.assertEqual(
+            services.groq_cache.key("translate", caption="A dog", target_language=["French", "german "]),
+            services.groq_cache.key("translate", caption="A dog", target_language=["German", "french"]),
+        )
+
+
+class ParseGroqTextTests(GroqStubTestCase):
+
+    def test_non_object_json(self):
+        self.assertEqual(services.parse_groq_text('"A plain JSON string"'), {"refined_caption": "A plain JSON string"})
+        for text in ('["a caption"]', "42", "null", "true"):
+            with self.subTest(text):
+                self.assertIn("error", services.parse_groq_text(text))
+
+    def test_pipeline_falls_back_on_a_json_list(self):
+        caption = "a dog running on the beach"
+        self.server.completion = ['["A happy dog", "#dog"]']
+        stages = list(services.run_caption_pipeline(caption, "casual", "", ["French"], include_hashtags=False))
+        self.assertEqual([stage["stage"] for stage in stages], ["refine", "translation", "done"])
+        # Every separate call gets the same unusable answer, so the caption is kept
+        self.assertEqual(stages[0]["refined_caption"], caption)
+
+
+class CaptionStreamTests(GroqStubTestCase):
+    """The SSE views against a stub Groq server, compared with their non-streaming counterparts."""
+
+    def test_stream_ends_at_the_deadline(self):
+        cases = {
+            "chunks keep arriving": {"completion": ["word "] * 50, "chunk_delay": 0.1, "stall": 0},
+            # Each read alone stays within the client's timeout, but not the stream as a whole
+            "stall after chunks": {"completion": ["word "] * 4, "chunk_delay": 0.1, "stall": 5},
+        }
+        for name, case in cases.items():
+            with self.subTest(name):
+                for attribute, value in case.items():
+                    setattr(self.server, attribute, value)
+                received = []
+                start = time.monotonic()
+                with mock.patch.object(services, "GROQ_TIMEOUT", 0.5):
+                    with self.assertRaises(concurrent.futures.TimeoutError):
+                        for text in services.stream_groq_text("prompt"):
+                            received.append(text)
+                self.assertLess(time.monotonic() - start, 0.75)
+                self.assertGreater(len(received), 0)
+
+    def events(self, response):
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = []
+        for block in b"".join(response.streaming_content).decode().split("\n\n"):
+            if block:
+                event, data = block.split("\n")
+                events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+
+    def compare(self, path, stream_path, body, chunks):
+        self.server.completion = chunks
+        caches["groq"].clear()
+        expected = self.client.post(path, body, content_type="application/json").json()
+        # Neither call may be answered from the cache the other one filled
+        caches["groq"].clear()
+        events = self.events(self.client.post(stream_path, body, content_type="application/json"))
+        self.assertEqual(events[-1], ("done", expected))
+        self.assertTrue(all(event == "delta" for event, _ in events[:-1]))
+        return "".join(data["text"] for _, data in events[:-1]), expected
+
+    def test_refine_stream_matches_refine(self):
+        body = {"caption": "a dog running on the beach", "tone": "casual"}
+        for size in (1, 5, 13):
+            with self.subTest(size=size):
+                text, expected = self.compare(
+                    "/api/refine-caption/", "/api/refine-caption-stream/", body, split(REFINED_JSON, size)
+                )
+                self.assertEqual(expected, {"refined_caption": REFINED})
+                self.assertEqual(text, REFINED)
+
+    def test_refine_stream_of_plain_text(self):
+        body = {"caption": "a dog running on the beach", "tone": "casual"}
+        completion = "A happy dog sprints along the shoreline, chasing the \"waves\" at sunset"
+        text, expected = self.compare(
+            "/api/refine-caption/", "/api/refine-caption-stream/", body, split(completion, 7)
+        )
+        self.assertEqual(expected, {"refined_caption": completion})
+        self.assertEqual(text, completion)
+
+    def test_refine_stream_of_fenced_json(self):
+        body = {"caption": "a dog running on the beach", "tone": "casual"}
+        completion = "```json\n" + REFINED_JSON + "\n```"
+        text, expected = self.compare(
+            "/api/refine-caption/", "/api/refine-caption-stream/", body, split(completion, 6)
+        )
+        self.assertEqual(expected, {"refined_caption": REFINED})
+        self.assertEqual(text, REFINED)
+
+    def test_refine_stream_falls_back_to_the_caption_when_too_short(self):
+        body = {"caption": "a dog running on the beach", "tone": "casual"}
+        text, expected = self.compare(
+            "/api/refine-caption/", "/api/refine-caption-stream/", body,
+            split(json.dumps({"refined_caption": "Dog."}), 4),
+        )
+        self.assertEqual(expected, {"refined_caption": body["caption"]})
+
+    def test_translate_stream_matches_translate(self):
+        body = {"text": "a dog on the beach", "target_language": "French"}
+        completions = {
+            "json": json.dumps({"translated_text": "un chien \"heureux\" sur la plage \ud83d\udc15"}),
+            "plain": "Un chien sur la plage, l'\u00e9t\u00e9",
+        }
+        for name, completion in completions.items():
+            with self.subTest(name):
+                text, expected = self.compare(
+                    "/api/translate-caption/", "/api/translate-caption-stream/", body, split(completion, 3)
+                )
+                self.assertEqual(text, expected["translated_text"])
+                self.assertEqual(expected["language"], "French")
+
+
+class SizeLimitedParserTests(TestCase):
+    """Bodies counted as they are read, for requests with a wrong or missing Content-Length."""
+
+    ITEMS = [{"generated_caption": f"caption {i}", "rating": 4} for i in range(20)]
+
+    def test_parsers_stop_past_the_limit(self):
+        bodies = {
+            StreamingJSONParser: json.dumps(self.ITEMS).encode(),
+            NDJSONParser: "".join(json.dumps(item) + "\n" for item in self.ITEMS).encode(),
+        }
+        for parser_class, body in bodies.items():
+            with self.subTest(parser_class.__name__):
+                self.assertEqual(parser_class.with_limit(len(body))().parse(io.BytesIO(body)), self.ITEMS)
+                self.assertEqual(parser_class().parse(io.BytesIO(body)), self.ITEMS)
+                with self.assertRaises(RequestTooLarge):
+                    parser_class.with_limit(len(body) - 1)().parse(io.BytesIO(body))
+
+    def test_bulk_rating_answers_413(self):
+        user = get_user_model().objects.create_user(username="rater", email="rater@example.com", password="x")
+        self.client.force_login(user)
+        limited = [StreamingJSONParser.with_limit(100), NDJSONParser.with_limit(100)]
+        with mock.patch.object(views.submit_ratings_bulk.cls, "parser_classes", limited):
+            response = self.client.post("/api/captions/rate/bulk/", json.dumps(self.ITEMS), content_type="application/json")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json(), {"error": "Request body is limited to 100 bytes."})
+
+
+class BulkRatingTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="rater", email="rater@example.com", password="x")
+        self.client.force_login(self.user)
+
+    def test_empty_list(self):
+        for content_type, body in (("application/json", "[]"), ("application/x-ndjson", "\n")):
+            with self.subTest(content_type):
+                response = self.client.post("/api/captions/rate/bulk/", body, content_type=content_type)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "Expected at least one rating."})
+
+    def test_list_serializer_keeps_list_checks(self):
+        serializer = serializers.RatedCaptionSerializer(data=[], many=True, allow_empty=False)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors["non_field_errors"][0].code, "empty")
+        item = {"image": "x", "generated_caption": "a dog", "rating": 4}
+        serializer = serializers.RatedCaptionSerializer(data=[item] * 3, many=True, max_length=2)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors["non_field_errors"][0].code, "max_length")
+
+
+class CaptionJobTests(StubServerMixin, TestCase):
+
+    def make_job(self, **fields):
+        return jobs.CaptionJob.objects.create(image=b"image", image_hash="0" * 64, refine=False, **fields)
+
+    def drain(self):
+        """Run the job worker loop in this thread until no job is queued or running."""
+        runner = jobs.JobRunner(workers=1, poll_interval=0.1)
+        runner._active = 1
+        with mock.patch.object(jobs, "close_old_connections"):
+            runner._drain()
+
+    def test_failed_attempt_waits_for_its_backoff(self):
+        job = self.make_job()
+        attempts = []
+
+        def caption(job):
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise jobs.JobError("Space unavailable")
+            return "a dog running on the beach"
+
+        with mock.patch.object(jobs, "_caption", caption), mock.patch.object(jobs, "JOB_RETRY_DELAY", 0.3):
+            self.drain()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.caption), (jobs.CaptionJob.SUCCEEDED, 2, "a dog running on the beach"))
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.3)
+
+    def test_backoff_doubles_per_attempt(self):
+        with mock.patch.object(jobs, "JOB_RETRY_DELAY", 10), mock.patch.object(jobs, "JOB_RETRY_DELAY_MAX", 30):
+            self.assertEqual([jobs.retry_delay(attempt) for attempt in (1, 2, 3, 4)], [10, 20, 30, 30])
+        job = self.make_job()
+        with mock.patch.object(jobs, "_caption", side_effect=jobs.JobError("Space unavailable")):
+            jobs.run_next_job("worker")
+        job.refresh_from_db()
+        self.assertEqual(job.status, jobs.CaptionJob.QUEUED)
+        self.assertGreater(job.available_at, timezone.now())
+        self.assertIsNone(jobs.claim_job("worker"))
+
+    def test_worker_loop_reclaims_stale_jobs(self):
+        started_at = timezone.now() - timedelta(seconds=jobs.JOB_STALE_AFTER - 0.3)
+        job = self.make_job(status=jobs.CaptionJob.RUNNING, worker="dead", attempts=1, started_at=started_at)
+        start = time.monotonic()
+        with mock.patch.object(jobs, "_caption", return_value="a dog running on the beach"):
+            self.drain()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (jobs.CaptionJob.SUCCEEDED, 2))
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_webhook_connects_to_the_checked_address(self):
+        # The name is never resolved again: the request goes to the address the check returned
+        url = f"http://hooks.example.com:{self.server.server_address[1]}/hook"
+        job = self.make_job(webhook_url=url, status=jobs.CaptionJob.SUCCEEDED, caption="a dog")
+        with mock.patch.object(jobs, "check_webhook_url", return_value=["127.0.0.1"]):
+            jobs.deliver_webhook(job)
+        self.assertEqual(job.webhook_status, "200")
+        self.assertEqual(len(self.server.webhooks), 1)
+        self.assertEqual(self.server.webhooks[0]["host"], f"hooks.example.com:{self.server.server_address[1]}")
+        self.assertEqual(self.server.webhooks[0]["body"]["caption"], "a dog")
+
+    def test_pinned_adapter_refuses_other_hosts(self):
+        adapter = jobs.PinnedAddressAdapter("http://hooks.example.com/hook", "127.0.0.1")
+        client = services.PooledHTTPClient(max_retries=0, adapter=adapter)
+        with self.assertRaises(jobs.WebhookURLError):
+            client.post(f"http://other.example.com:{self.server.server_address[1]}/hook", data=b"{}")
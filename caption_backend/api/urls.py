@@ -5,11 +5,18 @@ from . import views
 urlpatterns = [
     # Existing paths
     path('generate-caption/', views.generate_caption, name='generate-caption'),
+    path('generate-captions/', views.generate_captions, name='generate-captions'),
     path('get-hashtags/', views.get_hashtags, name='get-hashtags'),
     path('translate-caption/', views.translate_caption, name='translate-caption'),
+    path('translate-caption-stream/', views.translate_caption_stream, name='translate-caption-stream'),
     
     # Your existing views
     path('refine-caption/', views.refine_caption, name='refine_caption'),
+    path('refine-caption-stream/', views.refine_caption_stream, name='refine_caption_stream'),
+    path('caption-pipeline/', views.caption_pipeline, name='caption_pipeline'),
+    path('caption-jobs/', views.create_caption_job, name='create_caption_job'),
+    path('caption-jobs/<uuid:job_id>/', views.caption_job_status, name='caption_job_status'),
+    path('service-stats/', views.service_stats, name='service_stats'),
     
     # Auth views
     path('csrf-token/', views.get_csrf_token, name='csrf_token'),
@@ -22,5 +29,7 @@ urlpatterns = [
     
     # Add these to your urlpatterns
     path('captions/rate/', views.submit_rating, name='submit_rating'),
+    path('captions/rate/bulk/', views.submit_ratings_bulk, name='submit_ratings_bulk'),
     path('captions/ratings/', views.get_user_ratings, name='get_user_ratings'),
+    path('blobs/<str:digest>/', views.blob, name='blob'),
 ]
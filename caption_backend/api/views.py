@@ -1,18 +1,27 @@
 import os
-import tempfile
 from rest_framework.decorators import api_view, parser_classes, permission_classes
 from rest_framework.parsers import MultiPartParser, JSONParser
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 # import redirect from 
 
 from django.shortcuts import redirect
 from django.middleware.csrf import get_token
-from django.http import JsonResponse
-from .services import caption_with_hf_api, refine_caption_with_groq, generate_hashtags,translate_caption_service
+import json
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from .services import PIPELINE_MAX_LANGUAGES, groq_cache, groq_executor, http_client, caption_with_hf_api, captions_with_hf_api, get_cached_caption, hash_upload, is_refinable_caption, run_caption_pipeline, refine_caption_with_groq, stream_refined_caption, stream_translation, generate_hashtags,translate_caption_service
 from rest_framework import viewsets, permissions
-from .models import RatedCaption
-from .serializers import RatedCaptionSerializer
+from .blobstore import BlobNotFound, get_blob_store, sniff_content_type
+from .jobs import JOB_MAX_IMAGE_BYTES, WebhookURLError, check_webhook_url, submit_job
+from .models import CaptionJob, RatedCaption
+from .pagination import RatingCursorPagination
+from .parsers import NDJSONParser, RequestTooLarge, StreamingJSONParser
+from .serializers import CaptionJobSerializer, RatedCaptionSerializer
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -21,6 +30,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(dotenv_path=BASE_DIR / ".env")
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")  # Default to local dev
+# Most ratings, and request body bytes, accepted by one captions/rate/bulk/ request
+BULK_RATING_MAX_ITEMS = int(os.getenv("BULK_RATING_MAX_ITEMS", 10000))
+BULK_RATING_MAX_BYTES = int(os.getenv("BULK_RATING_MAX_BYTES", 256 * 1024 * 1024))
 
 @api_view(["POST"])
 @parser_classes([MultiPartParser])
@@ -30,25 +42,132 @@ def generate_caption(request):
         return Response({"error": "No file provided."}, status=400)
 
     file_obj = request.FILES["file"]
-    temp_dir = tempfile.gettempdir()  # Get the appropriate temp directory for the current OS
-    temp_path = os.path.join(temp_dir, file_obj.name)
-    
+
+    # Serve byte-identical images from the caption cache without calling the Space
+    image_hash = hash_upload(file_obj)
+    cached_caption = get_cached_caption(image_hash)
+    if cached_caption is not None:
+        return Response({"caption": cached_caption, "cached": True})
+
+    # Stream the upload straight into the request to the Space. Django keeps
+    # uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE in memory and spills larger
+    # ones to a uniquely named temporary file, which it removes itself.
     try:
-        # Write the uploaded file to the temporary file
-        with open(temp_path, "wb") as temp_file:
-            for chunk in file_obj.chunks():
-                temp_file.write(chunk)
-        # Process the file using your service function
-        caption = caption_with_hf_api(temp_path)
+        caption = caption_with_hf_api(file_obj, image_hash=image_hash)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
-    finally:
-        # Always clean up the temporary file if it exists
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
     
     return Response({"caption": caption})
 
+@api_view(["POST"])
+@parser_classes([MultiPartParser])
+def generate_captions(request):
+    # Expecting one or more uploads under the "files" field
+    files = request.FILES.getlist("files")
+    if not files:
+        return Response({"error": "No files provided."}, status=400)
+
+    try:
+        results = captions_with_hf_api(files)
+    except Exception as e:
+        return Response({"error": str(e)}, status=500)
+
+    return Response({"results": results})
+
+@api_view(["POST"])
+@parser_classes([MultiPartParser])
+def create_caption_job(request):
+    """
+    Queue an uploaded image for captioning (and refinement unless refine=false)
+    and return the job id straight away. Poll caption-jobs/<id>/ for the result,
+    or (logged in) pass a webhook_url to have it POSTed there when the job finishes.
+    """
+    if "file" not in request.FILES:
+        return Response({"error": "No file provided."}, status=400)
+    file_obj = request.FILES["file"]
+    if file_obj.size > JOB_MAX_IMAGE_BYTES:
+        return Response({"error": f"Images are limited to {JOB_MAX_IMAGE_BYTES} bytes."}, status=413)
+
+    webhook_url = request.data.get("webhook_url") or None
+    if webhook_url:
+        if not request.user.is_authenticated:
+            return Response({"error": "Log in to use webhook_url."}, status=401)
+        try:
+            URLValidator(schemes=["http", "https"])(webhook_url)
+            check_webhook_url(webhook_url)
+        except ValidationError:
+            return Response({"error": "webhook_url must be an http(s) URL."}, status=400)
+        except WebhookURLError as e:
+            return Response({"error": str(e)}, status=400)
+
+    job = submit_job(
+        file_obj,
+        hash_upload(file_obj),
+        user=request.user if request.user.is_authenticated else None,
+        refine=str(request.data.get("refine", "true")).lower() in ("true", "1", "t"),
+        tone=request.data.get("tone", "casual"),
+        additional_info=request.data.get("additional_info", ""),
+        webhook_url=webhook_url,
+    )
+    data = CaptionJobSerializer(job).data
+    data["status_url"] = request.build_absolute_uri(f"{job.id}/")
+    return Response(data, status=202)
+
+@api_view(["GET"])
+def caption_job_status(request, job_id):
+    """Status of a caption job, with its caption and refined caption once it succeeded"""
+    job = get_object_or_404(CaptionJob, id=job_id)
+    # Jobs submitted by a user are only visible to that user
+    if job.user_id is not None and job.user_id != request.user.id:
+        raise Http404
+    return Response(CaptionJobSerializer(job).data)
+
+@api_view(["POST"])
+@parser_classes([MultiPartParser, JSONParser])
+def caption_pipeline(request):
+    """
+    Caption an uploaded image (or take a given "caption"), then refine it, generate
+    hashtags and translate it into "languages", streaming one JSON line per stage.
+    """
+    file_obj = request.FILES.get("file")
+    caption = request.data.get("caption", "")
+    if file_obj is None and not caption:
+        return Response({"error": "Provide an image file or a caption."}, status=400)
+
+    if hasattr(request.data, "getlist"):
+        languages = request.data.getlist("languages")
+    else:
+        languages = request.data.get("languages") or []
+    if isinstance(languages, str):
+        languages = [languages]
+    if not isinstance(languages, list) or not all(isinstance(value, str) for value in languages):
+        return Response({"error": "languages must be a string or a list of strings."}, status=400)
+    # Accept repeated fields as well as comma-separated values
+    languages = [language.strip() for value in languages for language in value.split(",") if language.strip()]
+    if len(languages) > PIPELINE_MAX_LANGUAGES:
+        return Response({"error": f"At most {PIPELINE_MAX_LANGUAGES} languages per request."}, status=400)
+
+    tone = request.data.get("tone", "casual")
+    additional_info = request.data.get("additional_info", "")
+    include_hashtags = str(request.data.get("hashtags", "true")).lower() in ("true", "1", "t")
+
+    def stages():
+        base_caption = caption
+        if file_obj is not None:
+            image_hash = hash_upload(file_obj)
+            base_caption = get_cached_caption(image_hash)
+            cached = base_caption is not None
+            if not cached:
+                base_caption = caption_with_hf_api(file_obj, image_hash=image_hash)
+            yield {"stage": "caption", "caption": base_caption, "cached": cached}
+        if not is_refinable_caption(base_caption):
+            yield {"stage": "error", "error": "No valid caption to refine."}
+            return
+        yield from run_caption_pipeline(base_caption, tone, additional_info, languages, include_hashtags)
+
+    lines = (json.dumps(stage) + "\n" for stage in stages())
+    return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
 @api_view(["POST"])
 @parser_classes([JSONParser])
 def refine_caption(request):
@@ -70,6 +189,29 @@ def refine_caption(request):
     
     return Response({"refined_caption": refined_caption})
 
+def event_stream(events):
+    """Server-sent events response for (event name, data dict) pairs."""
+    lines = (f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in events)
+    response = StreamingHttpResponse(lines, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+@api_view(["POST"])
+@parser_classes([JSONParser])
+def refine_caption_stream(request):
+    """
+    refine-caption/ as server-sent events: "delta" events carry text as it is
+    generated, the final "done" event the validated refined caption.
+    """
+    caption = request.data.get("caption", "")
+    if not caption or len(caption.strip()) < 3 or caption.lower() == "error":
+        return event_stream([("done", {"refined_caption": "No valid caption provided for refinement"})])
+    tone = request.data.get("tone", "formal")
+    additional_info = request.data.get("additional_info", "")
+    return event_stream(stream_refined_caption(caption, tone, additional_info))
+
 @api_view(["POST"])
 @parser_classes([JSONParser])
 def get_hashtags(request):
@@ -77,6 +219,12 @@ def get_hashtags(request):
     hashtags = generate_hashtags(caption)
     return Response({"hashtags": hashtags})
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def service_stats(request):
+    """Connection reuse, retry, concurrency and cache metrics of outbound calls"""
+    return Response({"http": http_client.stats(), "groq": groq_executor.stats(), "groq_cache": groq_cache.stats()})
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def csrf_token(request):
@@ -210,10 +358,36 @@ def custom_logout(request):
 class RatedCaptionViewSet(viewsets.ModelViewSet):
     serializer_class = RatedCaptionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = RatingCursorPagination
     
     def get_queryset(self):
         # Users can only see their own rated captions
-        return RatedCaption.objects.filter(user=self.request.user)
+        return RatedCaption.objects.filter(user=self.request.user).select_related('user')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def blob(request, digest):
+    """
+    An image or thumbnail of one of the user's rated captions. Blobs are
+    addressed by their SHA-256 and never change, so the browser may cache them
+    forever; shared caches may not, as they are the user's own uploads.
+    """
+    owned = RatedCaption.objects.filter(user=request.user).filter(Q(image_sha256=digest) | Q(thumbnail_sha256=digest))
+    if not owned.exists():
+        raise Http404("No such image")
+    if request.headers.get("If-None-Match") == f'"{digest}"':
+        response = HttpResponse(status=304)
+    else:
+        try:
+            blob_file = get_blob_store().open(digest)
+        except BlobNotFound:
+            raise Http404("No such image")
+        content_type = sniff_content_type(blob_file.read(16))
+        blob_file.seek(0)
+        response = FileResponse(blob_file, content_type=content_type)
+    response["ETag"] = f'"{digest}"'
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -225,13 +399,76 @@ def submit_rating(request):
         return Response(serializer.data, status=201)
     return Response(serializer.errors, status=400)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([StreamingJSONParser.with_limit(BULK_RATING_MAX_BYTES), NDJSONParser.with_limit(BULK_RATING_MAX_BYTES)])
+def submit_ratings_bulk(request):
+    """
+    Submit many ratings at once, as a JSON array or as NDJSON (one rating per
+    line, Content-Type: application/x-ndjson). All items are validated first
+    and inserted in one transaction. By default any invalid item rejects the
+    whole batch; with ?partial=true the valid items are still inserted.
+    Errors are reported per item, by index in the batch.
+    """
+    # Refused up front when Content-Length says so; the parsers also stop once they read more
+    if int(request.META.get("CONTENT_LENGTH") or 0) > BULK_RATING_MAX_BYTES:
+        return Response({"error": f"Request body is limited to {BULK_RATING_MAX_BYTES} bytes."}, status=413)
+    try:
+        items = request.data
+    except RequestTooLarge as e:
+        return Response({"error": str(e.detail)}, status=413)
+    if not isinstance(items, list):
+        return Response({"error": "Expected a list of ratings."}, status=400)
+    if not items:
+        return Response({"error": "Expected at least one rating."}, status=400)
+    if len(items) > BULK_RATING_MAX_ITEMS:
+        return Response({"error": f"At most {BULK_RATING_MAX_ITEMS} ratings per request."}, status=413)
+    partial = str(request.query_params.get('partial', 'false')).lower() in ('true', '1', 't')
+
+    serializer = RatedCaptionSerializer(data=items, many=True, allow_empty=False, context={'request': request})
+    valid = serializer.is_valid()
+    if not valid and isinstance(serializer.errors, dict):
+        # About the list as a whole rather than any item
+        return Response({"error": " ".join(serializer.errors.get("non_field_errors", [])), "created": 0, "ids": []}, status=400)
+    errors = [] if valid else [{"index": index, "errors": item_errors} for index, item_errors in enumerate(serializer.errors) if item_errors]
+    if not valid and not partial:
+        return Response({"created": 0, "ids": [], "errors": errors}, status=400)
+
+    with transaction.atomic():
+        if valid:
+            created = serializer.save()
+        else:
+            created = serializer.create([validated for _, validated in serializer.valid_items])
+    return Response(
+        {"created": len(created), "ids": [rated.id for rated in created], "errors": errors},
+        status=201 if created else 400,
+    )
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_ratings(request):
-    """Get all ratings submitted by the current user"""
-    ratings = RatedCaption.objects.filter(user=request.user)
-    serializer = RatedCaptionSerializer(ratings, many=True, context={'request': request})
-    return Response(serializer.data)
+    """
+    Ratings submitted by the current user, newest first, one cursor page at a
+    time ("next"/"previous" links; page_size= up to 200). fields= picks the
+    fields returned, e.g. fields=id,thumbnail_url,rating.
+    """
+    fields = RatedCaptionSerializer.LIST_FIELDS
+    if request.query_params.get('fields'):
+        fields = [name.strip() for name in request.query_params['fields'].split(',') if name.strip()]
+        readable = [name for name in RatedCaptionSerializer.Meta.fields if name != 'image']
+        unknown = [name for name in fields if name not in readable]
+        if unknown:
+            return Response({"error": f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(readable)}"}, status=400)
+
+    columns = {RatedCaptionSerializer.SOURCE_COLUMNS.get(name, name) for name in fields} | {'id', 'created_at'}
+    ratings = RatedCaption.objects.filter(user=request.user).only(*columns)
+    if 'user' in columns:
+        ratings = ratings.select_related('user')
+
+    paginator = RatingCursorPagination()
+    page = paginator.paginate_queryset(ratings, request)
+    serializer = RatedCaptionSerializer(page, many=True, context={'request': request, 'fields': fields})
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['POST'])
 @permission_classes([AllowAny]) 
@@ -266,4 +503,19 @@ def translate_caption(request):
     return Response({
         "translated_text": translated_text,
         "language": target_language
-    })
\ No newline at end of file
+    })
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def translate_caption_stream(request):
+    """translate-caption/ as server-sent events, like refine-caption-stream/"""
+    text = request.data.get('text', '')
+    target_language = request.data.get('target_language', '')
+    
+    if not text:
+        return Response({"error": "No text provided"}, status=400)
+    
+    if not target_language:
+        return Response({"error": "No target language specified"}, status=400)
+    
+    return event_stream(stream_translation(text, target_language))
@@ -1,9 +1,9 @@
 import logging
-import requests
 from django.conf import settings
 from allauth.account.adapter import DefaultAccountAdapter
 from allauth.socialaccount.adapter import DefaultSocialAccountAdapter
 from django.contrib.auth import get_user_model
+from api.services import http_client
 
 User = get_user_model()
 logger = logging.getLogger('django.request')
@@ -85,7 +85,7 @@ class CustomSocialAccountAdapter(DefaultSocialAccountAdapter):
                 'Authorization': f'token {token}',
                 'Accept': 'application/vnd.github.v3+json'
             }
-            response = requests.get('https://api.github.com/user/emails', headers=headers)
+            response = http_client.get('https://api.github.com/user/emails', headers=headers, timeout=10)
             
             if response.status_code == 200:
                 emails = response.json()
@@ -161,9 +161,56 @@ TIME_ZONE = 'UTC'
 USE_I18N = True
 USE_TZ = True
 
+# Caches. "captions" maps (image hash, model version) -> caption for generate-caption/;
+# "groq" maps normalized Groq prompts (function, caption, tone, ...) -> parsed responses.
+# Local memory by default; set CAPTION_CACHE_BACKEND/CAPTION_CACHE_LOCATION to share it
+# across replicas (e.g. django.core.cache.backends.redis.RedisCache).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'captions': {
+        'BACKEND': os.getenv("CAPTION_CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("CAPTION_CACHE_LOCATION", 'captions'),
+        'TIMEOUT': int(os.getenv("CAPTION_CACHE_TTL", 7 * 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", 10000)),
+        },
+    },
+    'groq': {
+        'BACKEND': os.getenv("GROQ_CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("GROQ_CACHE_LOCATION", 'groq'),
+        'TIMEOUT': int(os.getenv("GROQ_CACHE_TTL", 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv("GROQ_CACHE_MAX_ENTRIES", 5000)),
+        },
+    },
+}
+# Failed or rejected Groq answers are cached only this long (seconds), so a
+# struggling upstream is not hammered with the same prompt but recovers quickly
+GROQ_CACHE_NEGATIVE_TTL = int(os.getenv("GROQ_CACHE_NEGATIVE_TTL", 30))
+# Bump when the captioning model changes so old cached captions are not served
+CAPTION_MODEL_VERSION = os.getenv("CAPTION_MODEL_VERSION", "vit-t5-v1")
+
+# Uploads: allow bulk requests to generate-captions/ to carry many files
+DATA_UPLOAD_MAX_NUMBER_FILES = int(os.getenv("DATA_UPLOAD_MAX_NUMBER_FILES", 256))
+# Uploads up to this size stay in memory and are streamed to the caption Space
+# from there; larger ones spill to a uniquely named file in FILE_UPLOAD_TEMP_DIR
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv("FILE_UPLOAD_MAX_MEMORY_SIZE", 10 * 1024 * 1024))
+FILE_UPLOAD_TEMP_DIR = os.getenv("FILE_UPLOAD_TEMP_DIR") or None
+
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = 'static/'
 
+# Rated caption images, stored once per SHA-256 and served from api/blobs/<digest>/.
+# Swap the backend for any api.blobstore.BlobStore subclass (constructed with BLOB_STORE_OPTIONS).
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", 'api.blobstore.FileSystemBlobStore')
+BLOB_STORE_OPTIONS = {
+    'root': os.getenv("BLOB_STORE_ROOT", str(BASE_DIR / 'blobs')),
+}
+# Longest side of the thumbnails shown in rating lists
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 256))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS settings
@@ -4,7 +4,7 @@ import { useState, useEffect, useRef } from "react"
 import ImageUpload from "@/components/image-upload"
 import CaptionGenerator from "@/components/caption-generator"
 import TeamSection from "@/components/team-section"
-import { generateBasicCaption, generateAdvancedCaption, generateHashtags } from "@/lib/caption-service"
+import { blobToDataUrl, fetchImageBlob, generateBasicCaption, generateAdvancedCaption, generateHashtags } from "@/lib/caption-service"
 import { Button } from "@/components/ui/button"
 import { Moon, Sun, Github, Menu, AlertCircle, WifiOff, Clock, LogIn, Sparkles } from "lucide-react"
 import Link from "next/link"
@@ -22,7 +22,8 @@ const GITHUB_REPO_URL = "https://github.com/Rishabh050803/Image-caption-generato
 
 interface RatedCaption {
   id: number
-  image: string
+  image_url: string | null
+  thumbnail_url: string | null
   generated_caption: string
   rating: number
   tone: string | null
@@ -133,10 +134,13 @@ export default function Home() {
     setError({ type: null, message: "" }) // Clear any previous errors
   }
 
-  const handleSelectCaption = (selectedCaption: RatedCaption) => {
+  const handleSelectCaption = async (selectedCaption: RatedCaption) => {
     try {
-      // Set the image
-      setUploadedImage(selectedCaption.image)
+      // Keep a local copy of the image: the blob URL needs the auth cookies,
+      // which later caption calls on uploadedImage would not send
+      setUploadedImage(
+        selectedCaption.image_url ? await blobToDataUrl(await fetchImageBlob(selectedCaption.image_url)) : null
+      )
       
       // Set the caption - prefer refined caption if available
       const captionText = selectedCaption.refined_caption || selectedCaption.generated_caption
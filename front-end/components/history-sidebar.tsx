@@ -7,6 +7,7 @@ import { ChevronLeft, ChevronRight, Star, Image, FileText, Clock, Lock, RefreshC
 import { format } from "date-fns"
 import { truncate } from "@/lib/utils"
 import { useAuth } from "@/lib/auth"
+import { fetchImageBlob } from "@/lib/caption-service"
 import Link from "next/link"
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from "@/components/ui/tooltip"
 import { Input } from "@/components/ui/input"
@@ -14,7 +15,8 @@ import { motion, AnimatePresence } from "framer-motion"
 
 interface RatedCaption {
   id: number
-  image: string
+  image_url: string | null
+  thumbnail_url: string | null
   generated_caption: string
   rating: number
   tone: string | null
@@ -24,6 +26,15 @@ interface RatedCaption {
   created_at: string
 }
 
+// Ratings fetched per request; older ones are loaded on demand
+const PAGE_SIZE = 30
+
+interface RatingsPage {
+  next: string | null
+  previous: string | null
+  results: RatedCaption[]
+}
+
 interface HistorySidebarProps {
   onSelectCaption: (caption: RatedCaption) => void
   isOpen: boolean
@@ -71,11 +82,38 @@ const toneColorMap: Record<string, { bg: string, bgDark: string, text: string, i
   }
 };
 
+// Thumbnails are only served to their owner: fetch them with the auth cookies
+// rather than relying on <img> requests carrying them to the backend origin
+function Thumbnail({ src }: { src: string | null }) {
+  const [objectUrl, setObjectUrl] = useState<string | null>(null)
+
+  useEffect(() => {
+    if (!src) return
+    let url: string | null = null
+    let cancelled = false
+    fetchImageBlob(src)
+      .then((blob) => {
+        if (cancelled) return
+        url = URL.createObjectURL(blob)
+        setObjectUrl(url)
+      })
+      .catch((err) => console.error("Error loading thumbnail:", err))
+    return () => {
+      cancelled = true
+      if (url) URL.revokeObjectURL(url)
+    }
+  }, [src])
+
+  return objectUrl ? <img src={objectUrl} alt="" className="w-full h-full object-cover" /> : null
+}
+
 export function HistorySidebar({ onSelectCaption, isOpen, setIsOpen }: HistorySidebarProps) {
   const [captions, setCaptions] = useState<RatedCaption[]>([])
   const [filteredCaptions, setFilteredCaptions] = useState<RatedCaption[]>([])
   const [isLoading, setIsLoading] = useState(true)
   const [isRefreshing, setIsRefreshing] = useState(false)
+  const [nextPage, setNextPage] = useState<string | null>(null)
+  const [isLoadingMore, setIsLoadingMore] = useState(false)
   const [searchQuery, setSearchQuery] = useState("")
   const { isAuthenticated } = useAuth()
 
@@ -85,6 +123,7 @@ export function HistorySidebar({ onSelectCaption, isOpen, setIsOpen }: HistorySi
     } else {
       setCaptions([])
       setFilteredCaptions([])
+      setNextPage(null)
       setIsLoading(false)
     }
   }, [isAuthenticated])
@@ -108,14 +147,15 @@ export function HistorySidebar({ onSelectCaption, isOpen, setIsOpen }: HistorySi
     try {
       setIsLoading(true)
       const response = await fetch(
-        `${process.env.NEXT_PUBLIC_BACKEND_URL}/api/captions/ratings/`,
+        `${process.env.NEXT_PUBLIC_BACKEND_URL}/api/captions/ratings/?page_size=${PAGE_SIZE}`,
         { credentials: 'include' }
       )
       
       if (response.ok) {
-        const data = await response.json()
-        setCaptions(data)
-        setFilteredCaptions(data)
+        const data: RatingsPage = await response.json()
+        setCaptions(data.results)
+        setFilteredCaptions(data.results)
+        setNextPage(data.next)
       }
     } catch (error) {
       console.error("Error fetching captions:", error)
@@ -125,6 +165,24 @@ export function HistorySidebar({ onSelectCaption, isOpen, setIsOpen }: HistorySi
     }
   }
 
+  const loadMoreCaptions = async () => {
+    if (!nextPage || isLoadingMore) return
+    try {
+      setIsLoadingMore(true)
+      const response = await fetch(nextPage, { credentials: 'include' })
+      
+      if (response.ok) {
+        const data: RatingsPage = await response.json()
+        setCaptions(prev => [...prev, ...data.results])
+        setNextPage(data.next)
+      }
+    } catch (error) {
+      console.error("Error fetching more captions:", error)
+    } finally {
+      setIsLoadingMore(false)
+    }
+  }
+
   const handleRefresh = () => {
     if (isAuthenticated && !isRefreshing) {
       setIsRefreshing(true)
@@ -325,7 +383,7 @@ export function HistorySidebar({ onSelectCaption, isOpen, setIsOpen }: HistorySi
 
                       <div className="flex items-start space-x-3">
                         <div className="w-14 h-14 flex-shrink-0 rounded-lg overflow-hidden bg-black/20">
-                          <img src={caption.image} alt="" className="w-full h-full object-cover" />
+                          <Thumbnail src={caption.thumbnail_url || caption.image_url} />
                         </div>
                         <p className="text-sm flex-1">
                           {truncate(caption.refined_caption || caption.generated_caption, 70)}
@@ -342,6 +400,16 @@ export function HistorySidebar({ onSelectCaption, isOpen, setIsOpen }: HistorySi
                       )}
                     </motion.div>
                   ))}
+                  {nextPage && (
+                    <Button
+                      variant="ghost"
+                      className="w-full text-sm"
+                      onClick={loadMoreCaptions}
+                      disabled={isLoadingMore}
+                    >
+                      {isLoadingMore ? "Loading..." : "Load older captions"}
+                    </Button>
+                  )}
                 </div>
               ) : (
                 <div className="p-8 text-center text-muted-foreground">
@@ -11,10 +11,27 @@ interface CaptionParams {
 
 const BACKEND_URL = process.env.NEXT_PUBLIC_BACKEND_URL 
 
+// Image bytes for a data URL, object URL or backend blob URL. Blob URLs are
+// only served to their owner, so the auth cookies must go along.
+export async function fetchImageBlob(url: string): Promise<Blob> {
+  const res = await fetch(url, { credentials: 'include' });
+  if (!res.ok) {
+    throw new Error(`Failed to load image (${res.status})`);
+  }
+  return res.blob();
+}
+
+export async function blobToDataUrl(blob: Blob): Promise<string> {
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve(reader.result as string);
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(blob);
+  });
+}
 
 export async function generateBasicCaption(params: CaptionParams): Promise<string> {
-  const res = await fetch(params.image);
-  const blob = await res.blob();
+  const blob = await fetchImageBlob(params.image);
 
   const formData = new FormData();
   formData.append("file", blob, "upload.png");
@@ -112,8 +129,7 @@ export async function generateCaption(params: CaptionParams): Promise<string> {
     try {
       // Step 1: Generate basic caption
       console.log("Step 1: Generating basic caption");
-      const res = await fetch(params.image);
-      const blob = await res.blob();
+      const blob = await fetchImageBlob(params.image);
       
       const formData = new FormData();
       formData.append("file", blob, "upload.png");
@@ -190,8 +206,7 @@ export async function generateCaption(params: CaptionParams): Promise<string> {
     }
   } else {
     // For basic model, just use the original implementation
-    const res = await fetch(params.image);
-    const blob = await res.blob();
+    const blob = await fetchImageBlob(params.image);
     
     const formData = new FormData();
     formData.append("file", blob, "upload.png");